@@ -0,0 +1,609 @@
+"""
+Inference and training benchmarks for the MUNIT runway model.
+
+Example usage:
+    python benchmark.py throughput --device cpu --sizes 256 512 1024
+    python benchmark.py throughput --checkpoint gen_01000000.pt --device cuda
+    python benchmark.py startup --checkpoint gen_01000000.pt
+    python benchmark.py overhead --size 512
+    python benchmark.py restyle --size 512 --styles 8
+    python benchmark.py encode --sizes 512 1024
+    python benchmark.py adain --device cuda
+    python benchmark.py layernorm --size 1024
+    python benchmark.py upsample --sizes 512 1024
+    python benchmark.py tiled --size 2048 --tile_size 512
+    python benchmark.py precision --sizes 512 1024
+    python benchmark.py onnx --sizes 256 512 1024
+    python benchmark.py interpolate --size 512 --frames 32
+    python benchmark.py layout --sizes 512 1024 --device cuda --autotune
+    python benchmark.py buckets --device cuda --autotune --buckets 512 768 1024
+    python benchmark.py train --size 256 --batch_size 4
+    python benchmark.py sample --size 400 --chunk_sizes 1 4 16
+"""
+from inference import DEFAULT_CONFIG, ExportedTranslator, InferenceGenerator, Translator, get_device, configure_threads, \
+    interpolation_path, load_generator_checkpoint, load_inference_generator, load_onnx_generator, psnr, reduced_precision_dtype, ssim
+from export import export_onnx
+from networks import AdaINGen, AdaptiveInstanceNorm2d, LayerNorm
+from trainer import MUNIT_Trainer
+from torchvision import transforms
+from PIL import Image
+import argparse
+import copy
+import multiprocessing
+import random
+import os
+import resource
+import tempfile
+import time
+import torch
+import torch.nn.functional as F
+
+
+def synchronize(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def time_fn(fn, device, iters, warmup=1):
+    # return the mean wall time of fn() in seconds
+    for _ in range(warmup):
+        fn()
+    synchronize(device)
+    start = time.time()
+    for _ in range(iters):
+        fn()
+    synchronize(device)
+    return (time.time() - start) / iters
+
+
+def proc_status_mb(field):
+    # a memory field of /proc/self/status (Linux), in MB
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024.
+
+
+def peak_memory_mb(fn, device):
+    # peak memory allocated while running fn(): CUDA allocator statistics, or on Linux the growth of the
+    # resident set high-water mark after resetting it. None where neither is available.
+    synchronize(device)
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+        start = torch.cuda.memory_allocated(device)
+        fn()
+        synchronize(device)
+        return (torch.cuda.max_memory_allocated(device) - start) / 2. ** 20
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        start = proc_status_mb('VmRSS')
+    except (IOError, OSError):
+        return None
+    fn()
+    return proc_status_mb('VmHWM') - start
+
+
+def format_memory(mb):
+    return 'n/a' if mb is None else '%.1f MB' % mb
+
+
+def count_flops(module, *inputs):
+    # multiply-accumulates of the Conv2d and Linear layers in one forward pass, reported as 2 FLOPs each
+    flops = [0]
+
+    def hook(m, inp, out):
+        if isinstance(m, torch.nn.Conv2d):
+            flops[0] += 2 * out.numel() * (m.in_channels // m.groups) * m.kernel_size[0] * m.kernel_size[1]
+        elif isinstance(m, torch.nn.Linear):
+            flops[0] += 2 * out.numel() * m.in_features
+
+    handles = [m.register_forward_hook(hook) for m in module.modules() if isinstance(m, (torch.nn.Conv2d, torch.nn.Linear))]
+    with torch.no_grad():
+        module(*inputs)
+    for handle in handles:
+        handle.remove()
+    return flops[0]
+
+
+def build_generator(opts, device):
+    if opts.checkpoint:
+        generator = load_inference_generator(opts.checkpoint, DEFAULT_CONFIG, device)
+    else:
+        generator = InferenceGenerator(DEFAULT_CONFIG['input_dim_a'], DEFAULT_CONFIG['input_dim_b'], DEFAULT_CONFIG['gen'])
+    generator.to(device)
+    generator.eval()
+    return generator
+
+
+def benchmark_throughput(opts):
+    # images/sec of the a2b encode -> decode path used by the `generate` command
+    device = get_device(opts.device)
+    num_threads = configure_threads(device, opts.num_threads)
+    generator = build_generator(opts, device)
+    style_dim = DEFAULT_CONFIG['gen']['style_dim']
+    print('device: %s, intra-op threads: %d' % (device, num_threads))
+    for size in opts.sizes:
+        image = torch.randn(1, 3, size, size, device=device)
+        style = torch.randn(1, style_dim, 1, 1, device=device)
+
+        def run():
+            with torch.no_grad():
+                content = generator.encode_content(image)
+                generator.decode(content, style)
+
+        seconds = time_fn(run, device, opts.iters)
+        print('%5d px: %8.2f ms/image, %7.3f images/sec' % (size, seconds * 1000, 1. / seconds))
+
+
+def _startup_worker(kind, checkpoint, device_name, queue):
+    # runs in a fresh process so that peak resident memory is attributable to one loader
+    device = get_device(device_name)
+    start = time.time()
+    if kind == 'trainer':
+        trainer = MUNIT_Trainer(DEFAULT_CONFIG)
+        if checkpoint:
+            state_dict = load_generator_checkpoint(checkpoint, device)
+            trainer.gen_a.load_state_dict(state_dict['a'])
+            trainer.gen_b.load_state_dict(state_dict['b'])
+        trainer.to(device)
+    else:
+        if checkpoint:
+            load_inference_generator(checkpoint, DEFAULT_CONFIG, device)
+        else:
+            InferenceGenerator(DEFAULT_CONFIG['input_dim_a'], DEFAULT_CONFIG['input_dim_b'], DEFAULT_CONFIG['gen']).to(device)
+    queue.put((time.time() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.))
+
+
+def benchmark_startup(opts):
+    # cold-start time and peak resident memory of MUNIT_Trainer vs. InferenceGenerator
+    ctx = multiprocessing.get_context('spawn')
+    for kind in ['trainer', 'inference']:
+        queue = ctx.Queue()
+        process = ctx.Process(target=_startup_worker, args=(kind, opts.checkpoint, opts.device, queue))
+        process.start()
+        seconds, rss_mb = queue.get()
+        process.join()
+        print('%-9s: %6.2fs cold start, %8.1f MB peak resident memory' % (kind, seconds, rss_mb))
+
+
+def benchmark_overhead(opts):
+    # per-request setup work that generate() used to repeat vs. the cached Translator
+    device = get_device(opts.device)
+    generator = build_generator(opts, device)
+    translator = Translator(generator, device)
+    image = Image.new('RGB', (opts.size, opts.size), (128, 64, 32))
+
+    def per_request_setup():
+        generator.to(device)
+        generator.eval()
+        transform = transforms.Compose([transforms.Resize(opts.size),
+                                        transforms.ToTensor(),
+                                        transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))])
+        transform(image).unsqueeze(0).to(device)
+
+    def cached_setup():
+        translator.preprocess(image)
+
+    before = time_fn(per_request_setup, device, opts.iters)
+    after = time_fn(cached_setup, device, opts.iters)
+    print('per-request setup: %.3f ms, cached translator: %.3f ms, removed: %.3f ms/request' % (
+        before * 1000, after * 1000, (before - after) * 1000))
+
+
+def benchmark_restyle(opts):
+    # one image restyled with several seeds, with and without the content cache
+    device = get_device(opts.device)
+    generator = build_generator(opts, device)
+    image = Image.new('RGB', (opts.size, opts.size), (128, 64, 32))
+    for cache_size in [0, 8]:
+        translator = Translator(generator, device, content_cache_size=cache_size)
+
+        def restyle():
+            for seed in range(opts.styles):
+                translator.decode(translator.encode_image(image), translator.style_from_seed(seed))
+
+        seconds = time_fn(restyle, device, opts.iters, warmup=0)
+        stats = translator.content_cache.stats()
+        print('content cache %-3s: %8.2f ms/image, hit rate %.2f, %d items, %.1f MB' % (
+            'on' if cache_size else 'off', seconds * 1000 / opts.styles, stats['hit_rate'], stats['items'],
+            stats['bytes'] / 2. ** 20))
+
+
+def benchmark_encode(opts):
+    # FLOPs and latency of the full encode (content + style) vs. the content-only encode
+    device = get_device(opts.device)
+    gen = AdaINGen(DEFAULT_CONFIG['input_dim_a'], DEFAULT_CONFIG['gen']).to(device)
+    gen.eval()
+    for size in opts.sizes:
+        image = torch.randn(1, 3, size, size, device=device)
+        full_flops = count_flops(gen.enc_content, image) + count_flops(gen.enc_style, image)
+        content_flops = count_flops(gen.enc_content, image)
+        with torch.no_grad():
+            full = time_fn(lambda: gen.encode(image), device, opts.iters)
+            content = time_fn(lambda: gen.encode_content(image), device, opts.iters)
+        print('%5d px: encode %7.1f GFLOPs %8.2f ms | encode_content %7.1f GFLOPs %8.2f ms | saved %5.1f GFLOPs %8.2f ms' % (
+            size, full_flops / 1e9, full * 1000, content_flops / 1e9, content * 1000,
+            (full_flops - content_flops) / 1e9, (full - content) * 1000))
+
+
+def batch_norm_adain(x, weight, bias, eps=1e-5):
+    # the original AdaIN implementation: instance norm as training-mode batch norm over a (1, B * C, H, W)
+    # view, with running statistics repeated per call
+    b, c = x.size(0), x.size(1)
+    running_mean = torch.zeros(c, device=x.device).repeat(b)
+    running_var = torch.ones(c, device=x.device).repeat(b)
+    out = F.batch_norm(x.contiguous().view(1, b * c, *x.size()[2:]), running_mean, running_var,
+                       weight.contiguous().view(-1), bias.contiguous().view(-1), True, 0.1, eps)
+    return out.view(b, c, *x.size()[2:])
+
+
+def benchmark_adain(opts):
+    # batch_norm-based vs. group_norm-based AdaIN at the decoder residual-block shapes for several image sizes
+    device = get_device(opts.device)
+    dim = DEFAULT_CONFIG['gen']['dim'] * 2 ** DEFAULT_CONFIG['gen']['n_downsample']
+    downsample = 2 ** DEFAULT_CONFIG['gen']['n_downsample']
+    norm = AdaptiveInstanceNorm2d(dim).to(device)
+    for size in opts.sizes:
+        x = torch.randn(opts.batch_size, dim, size // downsample, size // downsample, device=device)
+        mean = torch.randn(opts.batch_size, dim, device=device)
+        std = torch.randn(opts.batch_size, dim, device=device)
+        with torch.no_grad():
+            error = (norm(x, (mean, std)) - batch_norm_adain(x, std, mean)).abs().max().item()
+            before = time_fn(lambda: batch_norm_adain(x, std, mean), device, opts.iters)
+            after = time_fn(lambda: norm(x, (mean, std)), device, opts.iters)
+        print('%5d px %-18s: batch_norm %8.3f ms | group_norm %8.3f ms | speedup %5.2fx | max abs diff %.2e' % (
+            size, tuple(x.shape), before * 1000, after * 1000, before / after, error))
+
+
+def two_pass_layer_norm(x, gamma, beta, eps=1e-5):
+    # the original LayerNorm implementation: separate mean and std passes, then normalize and affine
+    shape = [-1] + [1] * (x.dim() - 1)
+    mean = x.view(x.size(0), -1).mean(1).view(*shape)
+    std = x.view(x.size(0), -1).std(1).view(*shape)
+    x = (x - mean) / (std + eps)
+    shape = [1, -1] + [1] * (x.dim() - 2)
+    return x * gamma.view(*shape) + beta.view(*shape)
+
+
+def benchmark_layernorm(opts):
+    # two-pass vs. single-pass LayerNorm at the activations of the decoder upsampling blocks
+    device = get_device(opts.device)
+    dim = DEFAULT_CONFIG['gen']['dim'] * 2 ** DEFAULT_CONFIG['gen']['n_downsample']
+    for i in range(DEFAULT_CONFIG['gen']['n_downsample']):
+        dim //= 2
+        size = opts.size // 2 ** (DEFAULT_CONFIG['gen']['n_downsample'] - 1 - i)
+        norm = LayerNorm(dim).to(device)
+        x = torch.randn(opts.batch_size, dim, size, size, device=device)
+        with torch.no_grad():
+            error = (norm(x) - two_pass_layer_norm(x, norm.gamma, norm.beta)).abs().max().item()
+            before = time_fn(lambda: two_pass_layer_norm(x, norm.gamma, norm.beta), device, opts.iters)
+            after = time_fn(lambda: norm(x), device, opts.iters)
+            before_mb = peak_memory_mb(lambda: two_pass_layer_norm(x, norm.gamma, norm.beta), device)
+            after_mb = peak_memory_mb(lambda: norm(x), device)
+        print('%-20s: two-pass %8.2f ms %10s | single-pass %8.2f ms %10s | speedup %5.2fx | max abs diff %.2e' % (
+            tuple(x.shape), before * 1000, format_memory(before_mb), after * 1000, format_memory(after_mb),
+            before / after, error))
+
+
+def benchmark_upsample(opts):
+    # decode latency and peak memory with the upsample + conv pairs run as is vs. as fused sub-pixel convs
+    device = get_device(opts.device)
+    generator = build_generator(opts, device)
+    style = torch.randn(1, generator.style_dim, 1, 1, device=device)
+    for size in opts.sizes:
+        content = torch.randn(1, generator.enc_content.output_dim, size // 4, size // 4, device=device)
+        results = []
+        for fused_upsample in [False, True]:
+            generator.dec.fused_upsample = fused_upsample
+            with torch.no_grad():
+                seconds = time_fn(lambda: generator.decode(content, style), device, opts.iters)
+                results.append((seconds, peak_memory_mb(lambda: generator.decode(content, style), device)))
+        with torch.no_grad():
+            generator.dec.fused_upsample = False
+            reference = generator.decode(content, style)
+            generator.dec.fused_upsample = True
+            error = (generator.decode(content, style) - reference).abs().max().item()
+        (before, before_mb), (after, after_mb) = results
+        print('%5d px: upsample + conv %8.2f ms %10s | fused %8.2f ms %10s | speedup %5.2fx | max abs diff %.2e' % (
+            size, before * 1000, format_memory(before_mb), after * 1000, format_memory(after_mb), before / after, error))
+
+
+def benchmark_tiled(opts):
+    # latency and peak memory of translating one large image whole vs. in overlapping tiles
+    device = get_device(opts.device)
+    generator = build_generator(opts, device)
+    image = Image.new('RGB', (opts.size, opts.size), (128, 64, 32))
+    translator = Translator(generator, device, tile_size=opts.tile_size, tile_overlap=opts.tile_overlap)
+    style = translator.style_from_seed(1)
+    images = translator.preprocess(image)
+    with torch.no_grad():
+        if not opts.skip_whole:
+            seconds = time_fn(lambda: translator.translate(images, style), device, opts.iters, warmup=0)
+            mb = peak_memory_mb(lambda: translator.translate(images, style), device)
+            print('%5d px whole            : %9.2f ms %10s' % (opts.size, seconds * 1000, format_memory(mb)))
+        seconds = time_fn(lambda: translator.translate_tiled(image, style), device, opts.iters, warmup=0)
+        mb = peak_memory_mb(lambda: translator.translate_tiled(image, style), device)
+    print('%5d px tiles of %4d px : %9.2f ms %10s' % (opts.size, translator.tile_size, seconds * 1000, format_memory(mb)))
+
+
+def benchmark_precision(opts):
+    # throughput and output quality of fp32 vs. reduced-precision (fp16 on CUDA, bf16 on CPU) translation
+    device = get_device(opts.device)
+    generator = build_generator(opts, device)
+    fp32 = Translator(generator, device)
+    reduced = Translator(generator, device, precision='reduced')
+    style = fp32.style_from_seed(1)
+    image = Image.open(opts.image)
+    print('device: %s, reduced precision: %s' % (device, reduced_precision_dtype(device)))
+    for size in opts.sizes:
+        images = fp32.preprocess(image.resize((size, size)))
+        before = time_fn(lambda: fp32.translate(images, style), device, opts.iters)
+        after = time_fn(lambda: reduced.translate(images, style), device, opts.iters)
+        expected, outputs = fp32.translate(images, style), reduced.translate(images, style)
+        print('%5d px: fp32 %8.2f ms | reduced %8.2f ms | speedup %5.2fx | PSNR %6.2f dB | SSIM %.4f' % (
+            size, before * 1000, after * 1000, before / after, psnr(outputs, expected).item(), ssim(outputs, expected).item()))
+
+
+def benchmark_onnx(opts):
+    # CPU latency of the PyTorch generator vs. its ONNX export under onnxruntime, at several resolutions
+    device = get_device('cpu')
+    num_threads = configure_threads(device, opts.num_threads)
+    generator = build_generator(opts, device)
+    style_dim = DEFAULT_CONFIG['gen']['style_dim']
+    path = os.path.join(tempfile.mkdtemp(), 'munit_a2b_onnx')
+    export_onnx(ExportedTranslator(generator).eval(), torch.randn(1, 3, 64, 64), torch.randn(1, style_dim, 1, 1), path)
+    pytorch = Translator(generator, device)
+    onnx = Translator(load_onnx_generator(path, device, num_threads), device)
+    print('intra-op threads: %d' % num_threads)
+    for size in opts.sizes:
+        images = torch.randn(1, 3, size, size)
+        style = torch.randn(1, style_dim, 1, 1)
+        before = time_fn(lambda: pytorch.translate(images, style), device, opts.iters)
+        after = time_fn(lambda: onnx.translate(images, style), device, opts.iters)
+        error = (onnx.translate(images, style) - pytorch.translate(images, style)).abs().max().item()
+        print('%5d px: pytorch %8.2f ms | onnxruntime %8.2f ms | speedup %5.2fx | max abs diff %.2e' % (
+            size, before * 1000, after * 1000, before / after, error))
+    os.remove(path)
+
+
+def benchmark_interpolate(opts):
+    # frames/sec of a style interpolation rendered frame by frame vs. encoded once and decoded in batches
+    device = get_device(opts.device)
+    generator = build_generator(opts, device)
+    translator = Translator(generator, device)
+    images = torch.randn(1, 3, opts.size, opts.size, device=device)
+    styles = interpolation_path(translator.styles_from_seeds([1, 2]), opts.frames - 1)
+    per_frame = time_fn(lambda: [translator.translate(images, styles[i:i + 1]) for i in range(styles.size(0))],
+                        device, opts.iters, warmup=0)
+    content = translator._encode(images)
+    print('%5d px, %d frames: frame by frame %8.2f frames/sec' % (opts.size, styles.size(0), styles.size(0) / per_frame))
+    for chunk_size in opts.chunk_sizes:
+        batched = time_fn(lambda: list(translator.iter_decode_styles(content, styles, chunk_size)), device, opts.iters, warmup=0)
+        print('%5d px, %d frames: batches of %2d  %8.2f frames/sec | speedup %5.2fx' % (
+            opts.size, styles.size(0), chunk_size, styles.size(0) / batched, per_frame / batched))
+
+
+def benchmark_layout(opts):
+    # latency of the contiguous (NCHW) vs. channels_last (NHWC) generator, including first-call cost, with
+    # optional cuDNN autotuning
+    device = get_device(opts.device)
+    generator = build_generator(opts, device)
+    contiguous = Translator(copy.deepcopy(generator), device, autotune=opts.autotune)
+    channels_last = Translator(generator, device, channels_last=True, autotune=opts.autotune)
+    style = contiguous.style_from_seed(1)
+    print('device: %s, autotune: %s' % (device, opts.autotune and device.type == 'cuda'))
+    for size in opts.sizes:
+        results = []
+        for translator in [contiguous, channels_last]:
+            images = torch.randn(1, 3, size, size, device=device).contiguous(memory_format=translator.memory_format)
+            first = time_fn(lambda: translator.translate(images, style), device, 1, warmup=0)
+            results.append((first, time_fn(lambda: translator.translate(images, style), device, opts.iters)))
+        (first_a, a), (first_b, b) = results
+        print('%5d px: NCHW %8.2f ms (first %8.2f) | channels_last %8.2f ms (first %8.2f) | speedup %5.2fx' % (
+            size, a * 1000, first_a * 1000, b * 1000, first_b * 1000, a / b))
+
+
+def benchmark_buckets(opts):
+    # per-request latency over a stream of random image sizes, at exact sizes vs. padded to warmed-up size buckets
+    device = get_device(opts.device)
+    generator = build_generator(opts, device)
+    rng = random.Random(0)
+    sizes = [(rng.randint(opts.min_size, opts.max_size), rng.randint(opts.min_size, opts.max_size)) for _ in range(opts.requests)]
+    buckets = [(size, size) for size in opts.buckets]
+    print('device: %s, autotune: %s, %d requests of %d to %d px' % (
+        device, opts.autotune and device.type == 'cuda', opts.requests, opts.min_size, opts.max_size))
+    for name, size_buckets in [('exact sizes', ()), ('buckets', buckets)]:
+        translator = Translator(generator, device, autotune=opts.autotune, size_buckets=size_buckets)
+        style = translator.style_from_seed(1)
+        warmup = sum(seconds for _, _, seconds in translator.warmup(size_buckets))
+        latencies = []
+        for width, height in sizes:
+            images = torch.randn(1, 3, height, width, device=device)
+
+            def translate():
+                with translator.unpadded_statistics((width, height)):
+                    translator.translate(translator.pad_to_bucket(images), style)
+
+            latencies.append(time_fn(translate, device, 1, warmup=0))
+        first = latencies[0]
+        latencies.sort()
+        print('%-11s: warmup %6.2fs | first %8.2f ms | mean %8.2f ms | p95 %8.2f ms | max %8.2f ms' % (
+            name, warmup, first * 1000, sum(latencies) / len(latencies) * 1000,
+            latencies[int(0.95 * (len(latencies) - 1))] * 1000, latencies[-1] * 1000))
+
+
+def benchmark_train(opts):
+    # training iterations/sec of dis_update + gen_update vs. fused_update, in fp32 and mixed precision
+    device = get_device('cuda')
+    x_a = torch.randn(opts.batch_size, 3, opts.size, opts.size, device=device)
+    x_b = torch.randn(opts.batch_size, 3, opts.size, opts.size, device=device)
+    baseline = None
+    for amp in [False, True]:
+        config = dict(DEFAULT_CONFIG, amp=amp)
+        trainer = MUNIT_Trainer(config).to(device)
+        for mode in ['separate', 'fused exact', 'fused']:
+
+            def step():
+                if mode == 'separate':
+                    trainer.dis_update(x_a, x_b, config)
+                    trainer.gen_update(x_a, x_b, config)
+                else:
+                    trainer.fused_update(x_a, x_b, config, exact=mode == 'fused exact')
+
+            seconds = time_fn(step, device, opts.iters, warmup=2)
+            baseline = baseline or seconds
+            torch.cuda.reset_peak_memory_stats(device)
+            step()
+            print('%-4s %-11s: %8.2f ms/iter, %6.2f iters/sec, %s peak memory | speedup %5.2fx' % (
+                'amp' if amp else 'fp32', mode, seconds * 1000, 1. / seconds,
+                format_memory(torch.cuda.max_memory_allocated(device) / 2. ** 20), baseline / seconds))
+        del trainer
+
+
+def benchmark_sample(opts):
+    # latency of the trainer's display grid (trainer.sample), image by image vs. in batches of chunk_size
+    device = get_device('cuda')
+    display_size = DEFAULT_CONFIG['display_size']
+    trainer = MUNIT_Trainer(DEFAULT_CONFIG).to(device)
+    x_a = torch.randn(display_size, 3, opts.size, opts.size, device=device)
+    x_b = torch.randn(display_size, 3, opts.size, opts.size, device=device)
+    print('%d display images of %d px' % (display_size, opts.size))
+    for chunk_size in opts.chunk_sizes:
+        def sample():
+            with torch.no_grad():
+                trainer.sample(x_a, x_b, chunk_size)
+
+        seconds = time_fn(sample, device, opts.iters)
+        torch.cuda.reset_peak_memory_stats(device)
+        sample()
+        print('chunk_size %2d: %8.2f ms, %s peak memory' % (
+            chunk_size, seconds * 1000, format_memory(torch.cuda.max_memory_allocated(device) / 2. ** 20)))
+
+
+parser = argparse.ArgumentParser()
+subparsers = parser.add_subparsers(dest='benchmark')
+subparsers.required = True
+
+throughput_parser = subparsers.add_parser('throughput', help='images/sec of encode + decode at several resolutions')
+throughput_parser.add_argument('--checkpoint', type=str, default='', help='generator checkpoint, random weights if empty')
+throughput_parser.add_argument('--device', type=str, default='auto', help='auto, cpu or cuda')
+throughput_parser.add_argument('--num_threads', type=int, default=0, help='intra-op threads for CPU inference')
+throughput_parser.add_argument('--sizes', type=int, nargs='+', default=[256, 512, 1024])
+throughput_parser.add_argument('--iters', type=int, default=5)
+throughput_parser.set_defaults(func=benchmark_throughput)
+
+startup_parser = subparsers.add_parser('startup', help='cold-start time and memory of the full trainer vs. the inference generator')
+startup_parser.add_argument('--checkpoint', type=str, default='', help='generator checkpoint, random weights if empty')
+startup_parser.add_argument('--device', type=str, default='auto', help='auto, cpu or cuda')
+startup_parser.set_defaults(func=benchmark_startup)
+
+overhead_parser = subparsers.add_parser('overhead', help='per-request setup overhead removed by caching the translator')
+overhead_parser.add_argument('--checkpoint', type=str, default='', help='generator checkpoint, random weights if empty')
+overhead_parser.add_argument('--device', type=str, default='auto', help='auto, cpu or cuda')
+overhead_parser.add_argument('--size', type=int, default=512)
+overhead_parser.add_argument('--iters', type=int, default=100)
+overhead_parser.set_defaults(func=benchmark_overhead)
+
+restyle_parser = subparsers.add_parser('restyle', help='restyling one image with several seeds, with and without the content cache')
+restyle_parser.add_argument('--checkpoint', type=str, default='', help='generator checkpoint, random weights if empty')
+restyle_parser.add_argument('--device', type=str, default='auto', help='auto, cpu or cuda')
+restyle_parser.add_argument('--size', type=int, default=512)
+restyle_parser.add_argument('--styles', type=int, default=8)
+restyle_parser.add_argument('--iters', type=int, default=2)
+restyle_parser.set_defaults(func=benchmark_restyle)
+
+encode_parser = subparsers.add_parser('encode', help='FLOPs and latency saved by the content-only encode')
+encode_parser.add_argument('--device', type=str, default='auto', help='auto, cpu or cuda')
+encode_parser.add_argument('--sizes', type=int, nargs='+', default=[512, 1024])
+encode_parser.add_argument('--iters', type=int, default=3)
+encode_parser.set_defaults(func=benchmark_encode)
+
+adain_parser = subparsers.add_parser('adain', help='batch_norm-based vs. group_norm-based AdaIN at decoder shapes')
+adain_parser.add_argument('--device', type=str, default='auto', help='auto, cpu or cuda')
+adain_parser.add_argument('--sizes', type=int, nargs='+', default=[256, 512, 1024])
+adain_parser.add_argument('--batch_size', type=int, default=1)
+adain_parser.add_argument('--iters', type=int, default=20)
+adain_parser.set_defaults(func=benchmark_adain)
+
+layernorm_parser = subparsers.add_parser('layernorm', help='two-pass vs. single-pass LayerNorm at decoder upsampling shapes')
+layernorm_parser.add_argument('--device', type=str, default='auto', help='auto, cpu or cuda')
+layernorm_parser.add_argument('--size', type=int, default=1024)
+layernorm_parser.add_argument('--batch_size', type=int, default=1)
+layernorm_parser.add_argument('--iters', type=int, default=5)
+layernorm_parser.set_defaults(func=benchmark_layernorm)
+
+upsample_parser = subparsers.add_parser('upsample', help='decode latency and peak memory of upsample + conv vs. fused sub-pixel conv')
+upsample_parser.add_argument('--checkpoint', type=str, default='', help='generator checkpoint, random weights if empty')
+upsample_parser.add_argument('--device', type=str, default='auto', help='auto, cpu or cuda')
+upsample_parser.add_argument('--sizes', type=int, nargs='+', default=[512, 1024])
+upsample_parser.add_argument('--iters', type=int, default=2)
+upsample_parser.set_defaults(func=benchmark_upsample)
+
+tiled_parser = subparsers.add_parser('tiled', help='latency and peak memory of whole-image vs. tiled translation')
+tiled_parser.add_argument('--checkpoint', type=str, default='', help='generator checkpoint, random weights if empty')
+tiled_parser.add_argument('--device', type=str, default='auto', help='auto, cpu or cuda')
+tiled_parser.add_argument('--size', type=int, default=2048)
+tiled_parser.add_argument('--tile_size', type=int, default=512)
+tiled_parser.add_argument('--tile_overlap', type=int, default=64)
+tiled_parser.add_argument('--skip_whole', action='store_true', help='only run the tiled translation, e.g. when the whole image does not fit in memory')
+tiled_parser.add_argument('--iters', type=int, default=1)
+tiled_parser.set_defaults(func=benchmark_tiled)
+
+precision_parser = subparsers.add_parser('precision', help='throughput and PSNR/SSIM of fp32 vs. fp16/bf16 translation')
+precision_parser.add_argument('--checkpoint', type=str, default='', help='generator checkpoint, random weights if empty')
+precision_parser.add_argument('--device', type=str, default='auto', help='auto, cpu or cuda')
+precision_parser.add_argument('--image', type=str, default='tests/test_image.jpg')
+precision_parser.add_argument('--sizes', type=int, nargs='+', default=[256, 512, 1024])
+precision_parser.add_argument('--iters', type=int, default=2)
+precision_parser.set_defaults(func=benchmark_precision)
+
+onnx_parser = subparsers.add_parser('onnx', help='CPU latency of PyTorch vs. the ONNX export under onnxruntime')
+onnx_parser.add_argument('--checkpoint', type=str, default='', help='generator checkpoint, random weights if empty')
+onnx_parser.add_argument('--num_threads', type=int, default=0, help='intra-op threads of both backends')
+onnx_parser.add_argument('--sizes', type=int, nargs='+', default=[256, 512, 1024])
+onnx_parser.add_argument('--iters', type=int, default=3)
+onnx_parser.set_defaults(func=benchmark_onnx)
+
+interpolate_parser = subparsers.add_parser('interpolate', help='frames/sec of a style interpolation, frame by frame vs. encoded once and batch-decoded')
+interpolate_parser.add_argument('--checkpoint', type=str, default='', help='generator checkpoint, random weights if empty')
+interpolate_parser.add_argument('--device', type=str, default='auto', help='auto, cpu or cuda')
+interpolate_parser.add_argument('--size', type=int, default=512)
+interpolate_parser.add_argument('--frames', type=int, default=32)
+interpolate_parser.add_argument('--chunk_sizes', type=int, nargs='+', default=[1, 8])
+interpolate_parser.add_argument('--iters', type=int, default=1)
+interpolate_parser.set_defaults(func=benchmark_interpolate)
+
+layout_parser = subparsers.add_parser('layout', help='latency of the NCHW vs. channels_last generator')
+layout_parser.add_argument('--checkpoint', type=str, default='', help='generator checkpoint, random weights if empty')
+layout_parser.add_argument('--device', type=str, default='auto', help='auto, cpu or cuda')
+layout_parser.add_argument('--sizes', type=int, nargs='+', default=[256, 512, 1024])
+layout_parser.add_argument('--autotune', action='store_true', help='enable cudnn.benchmark')
+layout_parser.add_argument('--iters', type=int, default=3)
+layout_parser.set_defaults(func=benchmark_layout)
+
+buckets_parser = subparsers.add_parser('buckets', help='latency over random image sizes, exact vs. padded to warmed-up size buckets')
+buckets_parser.add_argument('--checkpoint', type=str, default='', help='generator checkpoint, random weights if empty')
+buckets_parser.add_argument('--device', type=str, default='auto', help='auto, cpu or cuda')
+buckets_parser.add_argument('--buckets', type=int, nargs='+', default=[256, 384, 512])
+buckets_parser.add_argument('--min_size', type=int, default=200)
+buckets_parser.add_argument('--max_size', type=int, default=512)
+buckets_parser.add_argument('--requests', type=int, default=20)
+buckets_parser.add_argument('--autotune', action='store_true', help='enable cudnn.benchmark')
+buckets_parser.set_defaults(func=benchmark_buckets)
+
+train_parser = subparsers.add_parser('train', help='training iterations/sec of separate vs. fused updates, in fp32 and amp, CUDA only')
+train_parser.add_argument('--size', type=int, default=256)
+train_parser.add_argument('--batch_size', type=int, default=1)
+train_parser.add_argument('--iters', type=int, default=10)
+train_parser.set_defaults(func=benchmark_train)
+
+sample_parser = subparsers.add_parser('sample', help='latency of the trainer display grid at several chunk sizes, CUDA only')
+sample_parser.add_argument('--size', type=int, default=400)
+sample_parser.add_argument('--chunk_sizes', type=int, nargs='+', default=[1, 4, 16])
+sample_parser.add_argument('--iters', type=int, default=3)
+sample_parser.set_defaults(func=benchmark_sample)
+
+if __name__ == '__main__':
+    opts = parser.parse_args()
+    opts.func(opts)
@@ -0,0 +1,98 @@
+"""
+Build a bank of precomputed style codes from a folder of reference images, for the runway model's
+generate_from_bank and generate_from_nearest_style commands.
+
+Every image is resized and center cropped, encoded by the style encoder of the target domain, and stored
+with a thumbnail in memory-mapped arrays (see inference.StyleBank), so applying a catalog style at serve time
+is a pure decode.
+
+Example usage:
+    python build_style_bank.py --checkpoint gen_01000000.pt --images datasets/ffhq2ladies/trainB --output style_bank
+"""
+from inference import DEFAULT_CONFIG, StyleBank, get_device, load_generator_checkpoint
+from networks import StyleEncoder
+from data import ImageFolder
+from torch.utils.data import DataLoader
+from torchvision import transforms
+import argparse
+import json
+import numpy as np
+import os
+import time
+import torch
+
+
+class BankTransform(object):
+    # PIL image -> (normalized tensor to encode, uint8 [T, T, 3] thumbnail)
+    def __init__(self, size, thumbnail_size):
+        self.encode = transforms.Compose([transforms.Resize(size), transforms.CenterCrop(size), transforms.ToTensor(),
+                                          transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))])
+        self.thumbnail = transforms.Compose([transforms.Resize(thumbnail_size), transforms.CenterCrop(thumbnail_size)])
+
+    def __call__(self, image):
+        return self.encode(image), torch.from_numpy(np.asarray(self.thumbnail(image), dtype=np.uint8).copy())
+
+
+def load_style_encoder(checkpoint_path, config, device, a2b=True):
+    # style encoder of the target domain of the a2b (domain b) or b2a (domain a) translation
+    dst = 'b' if a2b else 'a'
+    gen = config['gen']
+    encoder = StyleEncoder(4, config['input_dim_' + dst], gen['dim'], gen['style_dim'], norm='none', activ=gen['activ'],
+                           pad_type=gen['pad_type'])
+    state_dict = load_generator_checkpoint(checkpoint_path, device)[dst]
+    encoder.load_state_dict(dict((key[len('enc_style.'):], value) for key, value in state_dict.items()
+                                 if key.startswith('enc_style.')))
+    return encoder.to(device).eval()
+
+
+def build_style_bank(encoder, dataset, path, size, thumbnail_size, a2b=True, batch_size=16, num_workers=0):
+    # encode every image of an ImageFolder(..., transform=BankTransform(size, thumbnail_size), return_paths=True)
+    # and write the bank to the directory path. Codes and thumbnails are written batch by batch into memory-mapped
+    # arrays, so the catalog never has to fit in memory.
+    if not os.path.exists(path):
+        os.makedirs(path)
+    device = next(encoder.parameters()).device
+    style_dim = encoder.model[-1].out_channels
+    styles = np.lib.format.open_memmap(os.path.join(path, StyleBank.STYLES_FILE), mode='w+', dtype=np.float32,
+                                       shape=(len(dataset), style_dim))
+    thumbnails = np.lib.format.open_memmap(os.path.join(path, StyleBank.THUMBNAILS_FILE), mode='w+', dtype=np.uint8,
+                                           shape=(len(dataset), thumbnail_size, thumbnail_size, 3))
+    paths = []
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    with torch.no_grad():
+        for (images, thumbs), batch_paths in loader:
+            start = len(paths)
+            styles[start:start + len(batch_paths)] = encoder(images.to(device)).view(len(batch_paths), -1).cpu().numpy()
+            thumbnails[start:start + len(batch_paths)] = thumbs.numpy()
+            paths.extend(os.path.relpath(p, dataset.root) for p in batch_paths)
+    styles.flush()
+    thumbnails.flush()
+    with open(os.path.join(path, StyleBank.META_FILE), 'w') as f:
+        json.dump({'a2b': a2b, 'size': size, 'thumbnail_size': thumbnail_size, 'paths': paths}, f)
+    return len(paths)
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--checkpoint', type=str, required=True, help='gen_*.pt checkpoint whose style encoder is used')
+parser.add_argument('--images', type=str, required=True, help='folder of reference images of the target domain')
+parser.add_argument('--output', type=str, required=True, help='directory the bank is written to')
+parser.add_argument('--b2a', action='store_true', help='build a bank of domain a styles for b2a translation')
+parser.add_argument('--device', type=str, default='auto', help='auto, cpu or cuda')
+parser.add_argument('--size', type=int, default=256, help='images are resized and center cropped to this size before encoding')
+parser.add_argument('--thumbnail_size', type=int, default=64)
+parser.add_argument('--batch_size', type=int, default=16)
+parser.add_argument('--num_workers', type=int, default=4)
+
+
+if __name__ == '__main__':
+    opts = parser.parse_args()
+    device = get_device(opts.device)
+    a2b = not opts.b2a
+    encoder = load_style_encoder(opts.checkpoint, DEFAULT_CONFIG, device, a2b)
+    dataset = ImageFolder(opts.images, transform=BankTransform(opts.size, opts.thumbnail_size), return_paths=True)
+    start = time.time()
+    count = build_style_bank(encoder, dataset, opts.output, opts.size, opts.thumbnail_size, a2b, opts.batch_size,
+                             opts.num_workers)
+    seconds = time.time() - start
+    print('Encoded %d %s styles in %.2fs (%.1f images/sec) into %s' % (
+        count, 'b' if a2b else 'a', seconds, count / seconds, opts.output))
@@ -0,0 +1,166 @@
+"""
+Export one translation direction of a MUNIT generator checkpoint as a traced TorchScript module or as an
+ONNX model.
+
+The TorchScript module maps (images, styles) to translated images, and also exposes the
+encode_content(images) and decode(content, styles) halves. It runs with torch.jit.load alone, without
+networks.py or the generator config, and is served by runway_model.py with the 'torchscript' backend.
+The ONNX export is a directory holding the two halves as encoder.onnx, mapping 'images' to the content
+code 'content', and decoder.onnx, mapping 'content' and 'styles' to 'outputs', with dynamic batch, height
+and width. It is served under onnxruntime with the 'onnxruntime' backend. Traced sizes are not baked into
+either, so any batch size and image size that is a multiple of 4 works.
+
+Example usage:
+    python export.py --checkpoint gen_01000000.pt --output munit_a2b.torchscript.pt
+    python export.py --checkpoint gen_01000000.pt --format onnx --output munit_a2b_onnx
+"""
+from contextlib import contextmanager
+from inference import DEFAULT_CONFIG, ExportedTranslator, OnnxGenerator, get_device, load_inference_generator, \
+    load_onnx_generator, load_torchscript_generator
+from networks import AdaptiveInstanceNorm2d
+import argparse
+import inspect
+import json
+import os
+import time
+import torch
+import torch.nn.functional as F
+
+
+class OnnxAdaptiveInstanceNorm2d(AdaptiveInstanceNorm2d):
+    # AdaIN as an instance norm followed by the per-sample affine step. The fused group norm of
+    # AdaptiveInstanceNorm2d needs B * C groups, a constant in ONNX that would fix the batch size of the export.
+    def forward(self, x, adain_params=None):
+        if adain_params is None:
+            bias, weight = self.bias, self.weight
+        else:
+            bias, weight = adain_params
+        b, c = x.size(0), x.size(1)
+        out = F.instance_norm(x.float(), eps=self.eps)
+        return (out * weight.float().reshape(b, c, 1, 1) + bias.float().reshape(b, c, 1, 1)).to(x.dtype)
+
+
+@contextmanager
+def onnx_exportable(module):
+    # swap the AdaIN layers of module for OnnxAdaptiveInstanceNorm2d while it is exported
+    layers = [m for m in module.modules() if type(m) is AdaptiveInstanceNorm2d]
+    for m in layers:
+        m.__class__ = OnnxAdaptiveInstanceNorm2d
+    try:
+        yield module
+    finally:
+        for m in layers:
+            m.__class__ = AdaptiveInstanceNorm2d
+
+
+class OnnxEntryPoint(torch.nn.Module):
+    # encode_content or decode as the forward of its own module, since an ONNX model has a single entry point
+    def __init__(self, module, name):
+        super(OnnxEntryPoint, self).__init__()
+        self.module = module
+        self.name = name
+
+    def forward(self, *inputs):
+        return getattr(self.module, self.name)(*inputs)
+
+
+def export_onnx(module, images, styles, path, opset_version=17, a2b=True):
+    # export images -> content and (content, styles) -> outputs with dynamic batch and spatial axes as
+    # encoder.onnx and decoder.onnx in the directory path, recording the direction in the model metadata
+    import onnx
+    if not os.path.exists(path):
+        os.makedirs(path)
+    kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        # the TorchScript-based exporter, which supports dynamic_axes
+        kwargs['dynamo'] = False
+    with torch.no_grad():
+        # a first decode also caches the folded upsampling convs, so they are exported as constants
+        content = module.encode_content(images)
+        module.decode(content, styles)
+    def axes(name):
+        return {0: name + '_batch', 2: name + '_height', 3: name + '_width'}
+    exports = [('encode_content', OnnxGenerator.ENCODER_FILE, (images,), ['images'], ['content'],
+                {'images': axes('images'), 'content': axes('content')}),
+               ('decode', OnnxGenerator.DECODER_FILE, (content, styles), ['content', 'styles'], ['outputs'],
+                {'content': axes('content'), 'styles': {0: 'content_batch'}, 'outputs': axes('outputs')})]
+    for name, filename, inputs, input_names, output_names, dynamic_axes in exports:
+        filename = os.path.join(path, filename)
+        with onnx_exportable(module):
+            torch.onnx.export(OnnxEntryPoint(module, name), inputs, filename, input_names=input_names,
+                              output_names=output_names, dynamic_axes=dynamic_axes, opset_version=opset_version,
+                              **kwargs)
+        model = onnx.load(filename)
+        onnx.helper.set_model_props(model, {'direction': 'a2b' if a2b else 'b2a'})
+        onnx.save(model, filename)
+
+
+def export_torchscript(module, images, styles, path, config, a2b):
+    with torch.no_grad():
+        # a first run caches the folded upsampling convs, so they are traced as constants
+        module(images, styles)
+        traced = torch.jit.trace_module(module, {'forward': (images, styles), 'encode_content': (images,),
+                                                 'decode': (module.encode_content(images), styles)})
+    torch.jit.save(traced, path, _extra_files={'config.json': json.dumps({'gen': config['gen'], 'a2b': a2b})})
+
+
+def mean_time(fn, iters):
+    fn()
+    start = time.time()
+    for _ in range(iters):
+        fn()
+    return (time.time() - start) / iters
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--checkpoint', type=str, required=True, help='gen_*.pt checkpoint to export')
+parser.add_argument('--output', type=str, required=True, help='path of the exported artifact, a directory for ONNX')
+parser.add_argument('--format', type=str, default='torchscript', choices=['torchscript', 'onnx'])
+parser.add_argument('--opset', type=int, default=17, help='ONNX opset version')
+parser.add_argument('--b2a', action='store_true', help='export the b2a instead of the a2b translator')
+parser.add_argument('--device', type=str, default='cpu', help='device to trace on, TorchScript artifacts can be loaded on any device')
+parser.add_argument('--size', type=int, default=256, help='image size of the example inputs used for tracing')
+parser.add_argument('--iters', type=int, default=3)
+
+
+if __name__ == '__main__':
+    opts = parser.parse_args()
+    device = get_device(opts.device)
+    config = DEFAULT_CONFIG
+    a2b = not opts.b2a
+    start = time.time()
+    module = ExportedTranslator(load_inference_generator(opts.checkpoint, config, device, a2b=a2b)).to(device).eval()
+    eager_load = time.time() - start
+
+    images = torch.randn(1, config['input_dim_' + ('a' if a2b else 'b')], opts.size, opts.size, device=device)
+    styles = torch.randn(1, config['gen']['style_dim'], 1, 1, device=device)
+    if opts.format == 'onnx':
+        export_onnx(module, images, styles, opts.output, opts.opset, a2b)
+    else:
+        export_torchscript(module, images, styles, opts.output, config, a2b)
+
+    start = time.time()
+    if opts.format == 'onnx':
+        loaded = load_onnx_generator(opts.output, device)
+    else:
+        loaded = load_torchscript_generator(opts.output, device)
+    exported_load = time.time() - start
+
+    # check the artifact at another batch and image size than it was traced with
+    check_images = torch.randn(2, images.size(1), opts.size + 64, opts.size - 32, device=device)
+    check_styles = torch.randn(2, styles.size(1), 1, 1, device=device)
+    with torch.no_grad():
+        error = (loaded.decode(loaded.encode_content(check_images), check_styles).to(device) -
+                 module(check_images, check_styles)).abs().max().item()
+        eager = mean_time(lambda: module(images, styles), opts.iters)
+        exported = mean_time(lambda: loaded.decode(loaded.encode_content(images), styles), opts.iters)
+
+    if opts.format == 'onnx':
+        size = sum(os.path.getsize(os.path.join(opts.output, name))
+                   for name in [OnnxGenerator.ENCODER_FILE, OnnxGenerator.DECODER_FILE])
+    else:
+        size = os.path.getsize(opts.output)
+    print('Saved %s (%.1f MB)' % (opts.output, size / 2. ** 20))
+    print('load   : checkpoint %.2fs | %s %.2fs' % (eager_load, opts.format, exported_load))
+    print('latency: eager %.2f ms | %s %.2f ms at %d px' % (eager * 1000, opts.format, exported * 1000, opts.size))
+    print('max abs diff at batch 2, %dx%d px: %.2e' % (check_images.size(2), check_images.size(3), error))
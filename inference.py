@@ -0,0 +1,811 @@
+"""
+Inference helpers shared by the runway model server and the benchmark script.
+"""
+from networks import AdaINGen, AdaptiveInstanceNorm2d, Conv2dBlock, InstanceNorm2d, LayerNorm
+from runway.exceptions import InvalidArgumentError
+from torch import nn
+from torchvision import transforms
+from PIL import Image
+from collections import OrderedDict
+from contextlib import contextmanager
+import copy
+import hashlib
+import json
+import numpy as np
+import os
+import resource
+import threading
+import time
+import torch
+import torch.nn.functional as F
+import warnings
+try:
+    from torch.ao import quantization
+except ImportError:  # torch < 1.10
+    from torch import quantization
+try:
+    import onnxruntime
+except ImportError:  # only needed by the onnxruntime backend
+    onnxruntime = None
+
+# Experiment settings of the generator checkpoint served by runway_model.py
+DEFAULT_CONFIG = {'image_save_iter': 10000, 'image_display_iter': 100, 'display_size': 16, 'snapshot_save_iter': 10000, 'log_iter': 100, 'max_iter': 1000000, 'batch_size': 1, 'weight_decay': 0.0001, 'beta1': 0.5, 'beta2': 0.999, 'init': 'kaiming', 'lr': 0.0001, 'lr_policy': 'step', 'step_size': 100000, 'gamma': 0.5, 'gan_w': 1, 'recon_x_w': 10, 'recon_s_w': 1, 'recon_c_w': 1, 'recon_x_cyc_w': 10, 'vgg_w': 0, 'gen': {'dim': 64, 'mlp_dim': 256, 'style_dim': 8, 'activ': 'relu', 'n_downsample': 2, 'n_res': 4, 'pad_type': 'reflect'}, 'dis': {'dim': 64, 'norm': 'none', 'activ': 'lrelu', 'n_layer': 4, 'gan_type': 'lsgan', 'num_scales': 3, 'pad_type': 'reflect'}, 'input_dim_a': 3, 'input_dim_b': 3, 'num_workers': 8, 'new_size': 1024, 'crop_image_height': 400, 'crop_image_width': 400, 'data_root': './datasets/ffhq2ladies/'}
+
+
+def get_device(name='auto'):
+    # resolve 'auto', 'cpu' or 'cuda[:n]' to a torch.device, MUNIT_DEVICE takes precedence
+    name = os.environ.get('MUNIT_DEVICE', name)
+    if name == 'auto':
+        name = 'cuda' if torch.cuda.is_available() else 'cpu'
+    device = torch.device(name)
+    if device.type == 'cuda' and not torch.cuda.is_available():
+        assert 0, "CUDA device requested but CUDA is not available"
+    return device
+
+
+def configure_threads(device, num_threads=0):
+    # set the intra-op thread pool used by CPU convolutions, MUNIT_NUM_THREADS takes precedence.
+    # 0 keeps the torch default (one thread per physical core).
+    num_threads = int(os.environ.get('MUNIT_NUM_THREADS', num_threads))
+    if device.type == 'cpu' and num_threads > 0:
+        torch.set_num_threads(num_threads)
+    return torch.get_num_threads()
+
+
+def load_generator_checkpoint(checkpoint_path, device):
+    # load a gen_*.pt checkpoint directly onto device, so CPU-only hosts can read GPU checkpoints
+    return torch.load(checkpoint_path, map_location=device)
+
+
+class InferenceGenerator(AdaINGen):
+    # Inference-only translator built from the halves of two AdaINGen auto-encoders that translation
+    # actually uses: the content encoder of the source domain and the decoder + MLP of the target domain,
+    # plus optionally the style encoder of the target domain to take style codes from reference images.
+    # Parameter names match AdaINGen, so checkpoint entries load without renaming.
+    def __init__(self, input_dim, output_dim, params, style_encoder=False):
+        nn.Module.__init__(self)
+        self.build(input_dim, output_dim, params, style_encoder=style_encoder, fused_upsample=True)
+        self.style_dim = params['style_dim']
+        # the group norm kernel for the content encoder's instance norms, which hold no parameters or buffers
+        for m in list(self.modules()):
+            if isinstance(m, Conv2dBlock) and type(m.norm) is nn.InstanceNorm2d:
+                m.norm = InstanceNorm2d(m.norm.num_features, eps=m.norm.eps)
+
+
+def prepare_quantization(generator, backend='fbgemm'):
+    # Wrap every Conv2d of the generator's Conv2dBlocks in QuantStub -> conv -> DeQuantStub and attach observers,
+    # so that only the convolutions run in int8 and the normalization layers between them stay fp32
+    torch.backends.quantized.engine = backend
+    for m in list(generator.modules()):
+        if isinstance(m, Conv2dBlock) and isinstance(m.conv, nn.Conv2d):
+            m.conv.qconfig = quantization.get_default_qconfig(backend)
+            m.conv = quantization.QuantWrapper(m.conv)
+    return quantization.prepare(generator, inplace=True)
+
+
+def convert_quantization(generator):
+    # swap the observed convs for int8 ones and dynamically quantize the Linear layers of the MLP
+    quantization.convert(generator, inplace=True)
+    quantization.quantize_dynamic(generator.mlp, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    return generator
+
+
+def quantize_generator(generator, calibration_batches, backend='fbgemm'):
+    # int8 variant of an InferenceGenerator for CPU serving. The conv activation ranges are observed while
+    # translating calibration_batches, an iterable of (images, styles) tensor pairs.
+    generator = prepare_quantization(generator.cpu().eval(), backend)
+    with torch.no_grad():
+        for images, styles in calibration_batches:
+            generator.decode(generator.encode_content(images), styles)
+    return convert_quantization(generator)
+
+
+def load_quantized_generator(checkpoint, device):
+    # rebuild the int8 generator saved by quantize.py. The observers are never run here: the quantization
+    # parameters come from the state dict.
+    if device.type != 'cpu':
+        assert 0, "Quantized generators only run on the CPU"
+    config = checkpoint['config']
+    src, dst = ('a', 'b') if checkpoint['a2b'] else ('b', 'a')
+    generator = InferenceGenerator(config['input_dim_' + src], config['input_dim_' + dst], config['gen']).eval()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        convert_quantization(prepare_quantization(generator, checkpoint['quantization']['backend']))
+    generator.load_state_dict(checkpoint['state_dict'])
+    return generator
+
+
+def build_inference_generator(state_dict, config, a2b=True, style_encoder=False):
+    # InferenceGenerator of one direction from the 'a' and 'b' entries of a gen_*.pt checkpoint
+    src, dst = ('a', 'b') if a2b else ('b', 'a')
+    generator = InferenceGenerator(config['input_dim_' + src], config['input_dim_' + dst], config['gen'], style_encoder)
+    generator_state = {}
+    for key, value in state_dict[src].items():
+        if key.startswith('enc_content.'):
+            generator_state[key] = value
+    for key, value in state_dict[dst].items():
+        if key.startswith(('dec.', 'mlp.', 'enc_style.') if style_encoder else ('dec.', 'mlp.')):
+            generator_state[key] = value
+    generator.load_state_dict(generator_state)
+    return generator
+
+
+def load_inference_generators(checkpoint_path, config, device, directions=('a2b', 'b2a'), style_encoder=False):
+    # build the InferenceGenerators of several directions from a single read of a gen_*.pt checkpoint, and
+    # report their cold-start cost. The directions share no weights: a2b holds the content encoder of domain a
+    # and the decoder, MLP and style encoder of domain b, b2a the other halves. An int8 artifact written by
+    # quantize.py carries its own config and a single direction, which is returned instead.
+    start = time.time()
+    state_dict = load_generator_checkpoint(checkpoint_path, device)
+    generators = OrderedDict()
+    if 'quantization' in state_dict:
+        generators['a2b' if state_dict['a2b'] else 'b2a'] = load_quantized_generator(state_dict, device)
+    else:
+        for direction in directions:
+            generators[direction] = build_inference_generator(state_dict, config, direction == 'a2b', style_encoder)
+    del state_dict
+    for direction, generator in generators.items():
+        generator.a2b = direction == 'a2b'
+        generator.to(device)
+    param_mb = sum(tensor_nbytes(v) for generator in generators.values() for v in generator.state_dict().values()) / 2. ** 20
+    # ru_maxrss is reported in kilobytes on Linux
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    print('Loaded %s generator%s in %.2fs (%.1f MB parameters, %.1f MB peak resident memory)' % (
+        ' + '.join(generators), 's' if len(generators) > 1 else '', time.time() - start, param_mb, rss_mb))
+    return generators
+
+
+def load_inference_generator(checkpoint_path, config, device, a2b=True):
+    # build the InferenceGenerator of one direction from a gen_*.pt checkpoint, or an int8 artifact written by
+    # quantize.py
+    generators = load_inference_generators(checkpoint_path, config, device, ['a2b' if a2b else 'b2a'])
+    return list(generators.values())[0]
+
+
+class ExportedTranslator(nn.Module):
+    # One translation direction as a module with a plain forward(images, styles) -> images, plus the
+    # encode_content and decode halves that Translator uses, for tracing by export.py
+    def __init__(self, generator):
+        super(ExportedTranslator, self).__init__()
+        self.generator = generator
+
+    def forward(self, images, styles):
+        return self.generator.decode(self.generator.encode_content(images), styles)
+
+    def encode_content(self, images):
+        return self.generator.encode_content(images)
+
+    def decode(self, content, styles):
+        return self.generator.decode(content, styles)
+
+
+def load_torchscript_generator(checkpoint_path, device):
+    # load a traced translator written by export.py, which needs neither the networks nor the config to run
+    start = time.time()
+    extra_files = {'config.json': ''}
+    generator = torch.jit.load(checkpoint_path, map_location=device, _extra_files=extra_files)
+    config = json.loads(extra_files['config.json'])
+    generator.style_dim = config['gen']['style_dim']
+    generator.a2b = config['a2b']
+    print('Loaded %s TorchScript generator in %.2fs' % ('a2b' if config['a2b'] else 'b2a', time.time() - start))
+    return generator
+
+
+class OnnxGenerator(nn.Module):
+    # Runs a translator exported by export.py --format onnx under onnxruntime on the CPU. The export is a directory
+    # holding the encoder, images -> content, and the decoder, (content, styles) -> outputs, as two models with
+    # a session each, so that decoding a cached content code only runs the decoder.
+    ENCODER_FILE = 'encoder.onnx'
+    DECODER_FILE = 'decoder.onnx'
+
+    def __init__(self, model_dir, num_threads=0):
+        super(OnnxGenerator, self).__init__()
+        if onnxruntime is None:
+            assert 0, "The onnxruntime backend needs the onnxruntime package"
+        if not os.path.isfile(os.path.join(model_dir, self.DECODER_FILE)):
+            assert 0, "%s is not a directory written by export.py --format onnx, export it again" % model_dir
+        options = onnxruntime.SessionOptions()
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        self.encoder = onnxruntime.InferenceSession(os.path.join(model_dir, self.ENCODER_FILE), options,
+                                                    providers=['CPUExecutionProvider'])
+        self.decoder = onnxruntime.InferenceSession(os.path.join(model_dir, self.DECODER_FILE), options,
+                                                    providers=['CPUExecutionProvider'])
+        self.style_dim = {input.name: input.shape for input in self.decoder.get_inputs()}['styles'][1]
+        # direction recorded by export.py
+        self.a2b = self.decoder.get_modelmeta().custom_metadata_map.get('direction', 'a2b') == 'a2b'
+
+    def encode_content(self, images):
+        return torch.from_numpy(self.encoder.run(['content'], {'images': images.cpu().contiguous().numpy()})[0])
+
+    def decode(self, content, styles):
+        feed = {'content': content.cpu().contiguous().numpy(), 'styles': styles.cpu().contiguous().numpy()}
+        return torch.from_numpy(self.decoder.run(['outputs'], feed)[0])
+
+
+def load_onnx_generator(model_dir, device, num_threads=0):
+    start = time.time()
+    if device.type != 'cpu':
+        assert 0, "The onnxruntime backend only runs on the CPU"
+    generator = OnnxGenerator(model_dir, num_threads)
+    print('Loaded %s ONNX generator in %.2fs' % ('a2b' if generator.a2b else 'b2a', time.time() - start))
+    return generator
+
+
+def tensor_nbytes(value):
+    # memory held by a tensor or a tuple/list of tensors, other values count as 0
+    if isinstance(value, (tuple, list)):
+        return sum(tensor_nbytes(v) for v in value)
+    return value.nelement() * value.element_size() if torch.is_tensor(value) else 0
+
+
+def image_key(image, size=None):
+    # content hash of a decoded PIL image and the size it is resized to before encoding
+    digest = hashlib.blake2b(image.tobytes(), digest_size=16)
+    digest.update(('%s %s %s' % (image.mode, image.size, size or image.size)).encode())
+    return digest.hexdigest()
+
+
+class LRUCache(object):
+    # Thread-safe least-recently-used cache of tensors, bounded by entry count and, optionally, bytes
+    def __init__(self, max_items=128, max_bytes=None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return value[0]
+
+    def put(self, key, value):
+        nbytes = tensor_nbytes(value)
+        if self.max_items <= 0 or (self.max_bytes is not None and nbytes > self.max_bytes):
+            return
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while len(self.entries) > self.max_items or (self.max_bytes is not None and self.nbytes > self.max_bytes):
+                _, (_, evicted_nbytes) = self.entries.popitem(last=False)
+                self.nbytes -= evicted_nbytes
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'items': len(self.entries), 'bytes': self.nbytes, 'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': float(self.hits) / lookups if lookups else 0.}
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class StyleBank(object):
+    # Style codes of a catalog of reference images of one domain, with a thumbnail of each, written by
+    # build_style_bank.py into a directory holding styles.npy ([N, style_dim] float32), thumbnails.npy
+    # ([N, T, T, 3] uint8) and bank.json. Both arrays are memory-mapped: thumbnails are only read when returned,
+    # and the codes, a few bytes per image, are copied once to the inference device for vectorized lookups.
+    STYLES_FILE = 'styles.npy'
+    THUMBNAILS_FILE = 'thumbnails.npy'
+    META_FILE = 'bank.json'
+
+    def __init__(self, path, device):
+        with open(os.path.join(path, self.META_FILE)) as f:
+            meta = json.load(f)
+        self.a2b = meta['a2b']
+        self.size = meta['size']
+        self.paths = meta['paths']
+        self.thumbnails = np.load(os.path.join(path, self.THUMBNAILS_FILE), mmap_mode='r')
+        self.styles = torch.from_numpy(np.array(np.load(os.path.join(path, self.STYLES_FILE), mmap_mode='r'))).to(device)
+        # queries are resized and center cropped like the catalog images were
+        self.fit = transforms.Compose([transforms.Resize(self.size), transforms.CenterCrop(self.size)])
+
+    def __len__(self):
+        return self.styles.size(0)
+
+    def has_index(self, index):
+        return int(index) == index and 0 <= index < len(self)
+
+    def check_index(self, index):
+        if not self.has_index(index):
+            raise IndexError("Style index {} out of range, the bank holds {} styles".format(index, len(self)))
+        return int(index)
+
+    def styles_at(self, indices):
+        # stacked [N, style_dim, 1, 1] style codes of the given bank entries
+        indices = torch.tensor([self.check_index(index) for index in indices], device=self.styles.device)
+        return self.styles[indices].view(len(indices), -1, 1, 1)
+
+    def nearest(self, styles):
+        # index of the closest bank style, in euclidean distance, of each of N [N, style_dim, 1, 1] style codes
+        distances = torch.cdist(styles.view(styles.size(0), -1).float(), self.styles)
+        return distances.argmin(1).tolist()
+
+    def thumbnail(self, index):
+        return Image.fromarray(np.asarray(self.thumbnails[self.check_index(index)]))
+
+
+# the NormStatistics hooks active in each thread, see NormStatistics
+active_norm_hooks = threading.local()
+
+
+def dispatch_norm_hook(m, inputs, output):
+    # forward hook installed once on every norm layer by NormStatistics, running the hook of the statistics active
+    # in the calling thread, if they cover the layer
+    statistics, hook = getattr(active_norm_hooks, 'current', (None, None))
+    if statistics is None or m not in statistics.layer_set:
+        return None
+    return hook(m, inputs, output)
+
+
+def crop_fraction(x, height_fraction, width_fraction):
+    # top-left height_fraction x width_fraction of a [N, C, H, W] tensor, at least one pixel
+    return x[:, :, :max(int(x.size(2) * height_fraction), 1), :max(int(x.size(3) * width_fraction), 1)]
+
+
+class NormStatistics(object):
+    # Records the statistics of a module's InstanceNorm2d, AdaptiveInstanceNorm2d and LayerNorm layers in one
+    # forward pass and normalizes with them in later passes, so that tiles of a large image are normalized
+    # with the statistics of the whole image instead of their own. The layers still run; their outputs are
+    # replaced by forward hooks, which leaves the networks themselves untouched. region() records and applies
+    # the statistics of part of each input in a single pass. The hooks are installed once and only act for the
+    # statistics active in the calling thread, so concurrent forward passes of the same module are unaffected.
+    def __init__(self, module):
+        self.layers = [m for m in module.modules() if isinstance(m, (nn.InstanceNorm2d, AdaptiveInstanceNorm2d, LayerNorm))]
+        self.layer_set = set(self.layers)
+        self.stats = {}
+        for m in self.layers:
+            if dispatch_norm_hook not in m._forward_hooks.values():
+                m.register_forward_hook(dispatch_norm_hook)
+
+    @contextmanager
+    def active(self, hook):
+        previous = getattr(active_norm_hooks, 'current', (None, None))
+        active_norm_hooks.current = (self, hook)
+        try:
+            yield self
+        finally:
+            active_norm_hooks.current = previous
+
+    def record(self):
+        return self.active(self._record_hook)
+
+    def apply(self):
+        return self.active(self._apply_hook)
+
+    def empty_copy(self):
+        # statistics of the same layers with nothing recorded yet, without walking the module again
+        statistics = copy.copy(self)
+        statistics.stats = {}
+        return statistics
+
+    def region(self, height_fraction, width_fraction):
+        # normalize every layer with the statistics of the top-left height_fraction x width_fraction of its
+        # input, in the same pass, e.g. the unpadded part of an image padded at the right and bottom. Lists of
+        # fractions give each sample of the batch its own region.
+        return self.active(lambda m, inputs, output: self._region_hook(m, inputs, output, height_fraction, width_fraction))
+
+    def _region_hook(self, m, inputs, output, height_fraction, width_fraction):
+        # the statistics of the region are used right away and not stored, so one NormStatistics can serve
+        # region() in concurrent threads
+        x = inputs[0]
+        if isinstance(height_fraction, (list, tuple)):
+            stats = [self._statistics(m, crop_fraction(x[i:i + 1], h, w))
+                     for i, (h, w) in enumerate(zip(height_fraction, width_fraction))]
+            stats = tuple(torch.cat(s) for s in zip(*stats))
+        else:
+            stats = self._statistics(m, crop_fraction(x, height_fraction, width_fraction))
+        return self._normalize(m, inputs, output, stats)
+
+    def _record_hook(self, m, inputs, output):
+        self.stats[m] = self._statistics(m, inputs[0])
+
+    def _apply_hook(self, m, inputs, output):
+        return self._normalize(m, inputs, output, self.stats[m])
+
+    def _statistics(self, m, x):
+        x = x.float()
+        if isinstance(m, LayerNorm):
+            # unbiased std of each sample, eps added to the std
+            std, mean = torch.std_mean(x.reshape(x.size(0), -1), dim=1)
+            return mean.view(-1, 1, 1, 1), std.view(-1, 1, 1, 1)
+        var, mean = torch.var_mean(x, dim=(2, 3), unbiased=False, keepdim=True)
+        return mean, var
+
+    def _normalize(self, m, inputs, output, stats):
+        x = inputs[0].float()
+        mean, spread = stats
+        if isinstance(m, LayerNorm):
+            x = (x - mean) / (spread + m.eps)
+            if m.affine:
+                x = x * m.gamma.view(1, -1, 1, 1) + m.beta.view(1, -1, 1, 1)
+            return x.to(output.dtype)
+        x = (x - mean) * torch.rsqrt(spread + m.eps)
+        if isinstance(m, AdaptiveInstanceNorm2d):
+            bias, weight = inputs[1] if len(inputs) > 1 and inputs[1] is not None else (m.bias, m.weight)
+            x = x * weight.reshape(x.size(0), -1, 1, 1) + bias.reshape(x.size(0), -1, 1, 1)
+        elif m.affine:
+            x = x * m.weight.view(1, -1, 1, 1) + m.bias.view(1, -1, 1, 1)
+        return x.to(output.dtype)
+
+
+def reduced_precision_dtype(device):
+    # fp16 on CUDA; bf16 on CPU, where it keeps the fp32 exponent range and has fast kernels
+    return torch.float16 if device.type == 'cuda' else torch.bfloat16
+
+
+def psnr(outputs, targets, data_range=2.):
+    # peak signal-to-noise ratio in dB of each image in a [N, C, H, W] batch, for values in [-1, 1] by default
+    mse = (outputs.float() - targets.float()).pow(2).flatten(1).mean(1)
+    return 10 * torch.log10(data_range ** 2 / mse.clamp(min=1e-12))
+
+
+def ssim(outputs, targets, data_range=2., window_size=11, sigma=1.5):
+    # mean structural similarity of each image in a [N, C, H, W] batch, with the usual 11 x 11 gaussian window
+    outputs, targets = outputs.float(), targets.float()
+    coords = torch.arange(window_size, dtype=torch.float32, device=outputs.device) - window_size // 2
+    gauss = torch.exp(-coords ** 2 / (2 * sigma ** 2))
+    gauss = gauss / gauss.sum()
+    window = (gauss.view(-1, 1) * gauss.view(1, -1)).expand(outputs.size(1), 1, window_size, window_size)
+
+    def filter(x):
+        return F.conv2d(x, window, groups=x.size(1))
+
+    c1, c2 = (0.01 * data_range) ** 2, (0.03 * data_range) ** 2
+    mu_x, mu_y = filter(outputs), filter(targets)
+    var_x = filter(outputs * outputs) - mu_x ** 2
+    var_y = filter(targets * targets) - mu_y ** 2
+    cov = filter(outputs * targets) - mu_x * mu_y
+    ssim_map = ((2 * mu_x * mu_y + c1) * (2 * cov + c2)) / ((mu_x ** 2 + mu_y ** 2 + c1) * (var_x + var_y + c2))
+    return ssim_map.flatten(1).mean(1)
+
+
+def slerp(val, low, high, eps=1e-7):
+    # spherical interpolation of [..., style_dim] codes low and high at val, a scalar or a tensor that broadcasts
+    # against their leading dimensions. Parallel codes are interpolated linearly.
+    val = torch.as_tensor(val, dtype=low.dtype, device=low.device).unsqueeze(-1)
+    cos = (F.normalize(low, dim=-1) * F.normalize(high, dim=-1)).sum(-1, keepdim=True)
+    omega = torch.acos(cos.clamp(-1, 1))
+    so = torch.sin(omega)
+    linear = so < eps
+    so = torch.where(linear, torch.ones_like(so), so)
+    return torch.where(linear, (1 - val) * low + val * high,
+                       torch.sin((1 - val) * omega) / so * low + torch.sin(val * omega) / so * high)
+
+
+def interpolation_path(keyframes, steps):
+    # [(K - 1) * steps + 1, style_dim, 1, 1] style codes moving along great circles through K keyframe codes,
+    # steps frames per transition, computed for all transitions at once
+    codes = keyframes.view(keyframes.size(0), -1)
+    vals = torch.arange(steps, dtype=codes.dtype, device=codes.device) / steps
+    path = slerp(vals.unsqueeze(0), codes[:-1].unsqueeze(1), codes[1:].unsqueeze(1)).reshape(-1, codes.size(1))
+    return torch.cat([path, codes[-1:]]).view(-1, codes.size(1), 1, 1)
+
+
+def tile_starts(length, tile_size, stride):
+    # start offsets of tiles of tile_size covering [0, length) with at most tile_size - stride overlap
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size, stride))
+    return starts + [length - tile_size]
+
+
+def feather_window(length, overlap, ramp_start, ramp_end, device):
+    # 1-d blending weights of a tile, ramping linearly over the overlap at edges shared with another tile
+    window = torch.ones(length, device=device)
+    if overlap > 0:
+        ramp = (torch.arange(overlap, device=device, dtype=torch.float32) + 0.5) / overlap
+        if ramp_start:
+            window[:overlap] = ramp
+        if ramp_end:
+            window[-overlap:] = ramp.flip(0)
+    return window
+
+
+class Translator(object):
+    # Frozen, ready-to-run inference pipeline. Device placement, eval mode, requires_grad=False and the
+    # input/output transforms are done once here instead of on every request. These, channels_last, the padding
+    # folding and the NormStatistics hooks are applied to the generator in place, so Translators sharing a
+    # generator share them too: pass a copy.deepcopy of it to keep the generator unchanged. autotune turns on
+    # the process-wide cudnn.benchmark flag, for every CUDA model in the process.
+    def __init__(self, generator, device, style_cache_size=1024, content_cache_size=32, content_cache_mb=512,
+                 tile_size=0, tile_overlap=64, precision='fp32', channels_last=False, autotune=False, size_buckets=(),
+                 content_cache=None):
+        if isinstance(generator, (torch.jit.ScriptModule, OnnxGenerator)) and channels_last:
+            assert 0, "channels_last needs the PyTorch generator, not an exported one"
+        # channels_last keeps activations in NHWC, the native layout of the cuDNN and oneDNN conv kernels, so that
+        # no layout conversion happens around each conv. Inputs are converted once in preprocess.
+        self.memory_format = torch.channels_last if channels_last else torch.contiguous_format
+        self.generator = generator.to(device, memory_format=self.memory_format) if channels_last else generator.to(device)
+        self.generator.eval()
+        for param in self.generator.parameters():
+            param.requires_grad = False
+        for m in self.generator.modules():
+            if isinstance(m, Conv2dBlock):
+                m.fold_padding()
+        # cuDNN benchmarks the conv algorithms of every new input shape once and reuses the fastest, see warmup.
+        # The flag is global and stays on for the rest of the process.
+        if autotune and device.type == 'cuda':
+            torch.backends.cudnn.benchmark = True
+        self.device = device
+        self.style_dim = generator.style_dim
+        self.transform = transforms.Compose([transforms.ToTensor(),
+                                             transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))])
+        self.to_pil = transforms.ToPILImage()
+        # style codes drawn from seeds and encoded from reference images
+        self.style_cache = LRUCache(style_cache_size)
+        # content codes of recently seen images, so restyling the same image only runs the decoder. An LRUCache
+        # passed as content_cache is shared with other Translators, under keys that include the direction.
+        if content_cache is None:
+            content_cache = LRUCache(content_cache_size, int(content_cache_mb * 2 ** 20))
+        self.content_cache = content_cache
+        self.direction = 'a2b' if getattr(generator, 'a2b', True) else 'b2a'
+        # images larger than tile_size are translated in overlapping tiles, 0 disables tiling. Both are rounded
+        # down to multiples of 4 so that tiles line up with the content code.
+        self.tile_size = int(tile_size) // 4 * 4
+        self.tile_overlap = min(int(tile_overlap) // 4 * 4, self.tile_size // 2)
+        # (width, height) buckets, rounded up to multiples of 4: inputs are padded to the smallest bucket that
+        # fits them and the outputs cropped back, so the generator only sees a few shapes that can be warmed up
+        self.size_buckets = sorted(set((-(-int(w) // 4) * 4, -(-int(h) // 4) * 4) for w, h in size_buckets),
+                                   key=lambda size: (size[0] * size[1], size))
+        # 'reduced' runs the convolutions of the encoder and decoder under autocast, fp16 on CUDA and bf16 on
+        # CPU. The normalization layers and the MLP that produces the AdaIN parameters stay in fp32.
+        if isinstance(generator, (torch.jit.ScriptModule, OnnxGenerator)) and \
+                (self.tile_size or precision != 'fp32' or self.size_buckets):
+            assert 0, "Tiling, size buckets and reduced precision need the PyTorch generator, not an exported one"
+        # padded images and tiles are normalized with statistics taken from elsewhere, see unpadded_statistics and
+        # translate_tiled. The norm layers are listed and their hooks installed here, once.
+        self.norm_statistics = NormStatistics(self.generator) if self.size_buckets or self.tile_size else None
+        if precision == 'fp32':
+            self.compute_dtype = torch.float32
+        elif precision == 'reduced':
+            self.compute_dtype = reduced_precision_dtype(device)
+        else:
+            assert 0, "Unsupported precision: {}".format(precision)
+
+    def preprocess(self, image):
+        # PIL image -> normalized [1, 3, H, W] tensor on the inference device
+        return self.transform(image.convert('RGB')).unsqueeze(0).to(self.device, memory_format=self.memory_format)
+
+    def postprocess(self, outputs):
+        # [1, 3, H, W] generator output in [-1, 1] -> PIL image
+        return self.postprocess_batch(outputs)[0]
+
+    def postprocess_batch(self, outputs, sizes=None):
+        # [N, 3, H, W] generator output in [-1, 1] -> list of N PIL images, cropped to the (width, height) of
+        # each input image when sizes is given, which undoes the padding to a size bucket
+        outputs = ((outputs + 1) / 2.).cpu()
+        if sizes is not None:
+            return [self.to_pil(output[:, :height, :width]).convert('RGB') for output, (width, height) in zip(outputs, sizes)]
+        return [self.to_pil(output).convert('RGB') for output in outputs]
+
+    def bucket(self, width, height):
+        # smallest size bucket that fits a width x height image, None when there is none
+        for size in self.size_buckets:
+            if size[0] >= width and size[1] >= height:
+                return size
+        return None
+
+    def pad_to_bucket(self, images):
+        # pad the right and bottom of a [N, C, H, W] batch to its size bucket, mirroring the image where it is
+        # large enough and repeating its border otherwise
+        height, width = images.size(2), images.size(3)
+        size = self.bucket(width, height)
+        if size is None or size == (width, height):
+            return images
+        pad_width, pad_height = size[0] - width, size[1] - height
+        mode = 'reflect' if pad_width < width and pad_height < height else 'replicate'
+        return F.pad(images, (0, pad_width, 0, pad_height), mode=mode)
+
+    def batch_key(self, image):
+        # images with equal keys can be translated in one batch: those padded to the same size bucket, otherwise
+        # those of the same size. Images that need tiling are translated one by one, see translate_batch.
+        if self.needs_tiling(image):
+            return 'tiled', image.size
+        return self.bucket(*image.size) or image.size
+
+    @contextmanager
+    def unpadded_statistics(self, sizes):
+        # While images padded to their size bucket are encoded or decoded, the norm layers take their statistics
+        # from the unpadded region of each image only, so the padding does not shift the normalization of the
+        # whole image. Pixels near the padded edges still differ from an unpadded translation, since the
+        # convolutions there see the mirrored padding instead of their own. sizes is the (width, height) of each
+        # image of the batch, or a single size shared by the whole batch. A no-op when no image is padded.
+        single = sizes is not None and not isinstance(sizes[0], (list, tuple))
+        fractions = []
+        for width, height in ([sizes] if single else sizes or []):
+            bucket = self.bucket(width, height) or (width, height)
+            fractions.append((float(height) / bucket[1], float(width) / bucket[0]))
+        if all(fraction == (1., 1.) for fraction in fractions):
+            yield
+        elif single:
+            with self.norm_statistics.region(*fractions[0]):
+                yield
+        else:
+            with self.norm_statistics.region([h for h, _ in fractions], [w for _, w in fractions]):
+                yield
+
+    def style_from_seed(self, seed):
+        # draw exactly one [1, style_dim, 1, 1] style code from a dedicated generator seeded per request,
+        # so concurrent requests never touch the global torch RNG. Drawn on CPU, the code for a seed is
+        # the same on every device. Seed 1 keeps the style it had when generate drew randn(seed, ...)[0]
+        # from the global RNG, other seeds map to other styles, pinned in tests/test_inference.py.
+        seed = int(seed)
+        style = self.style_cache.get(seed)
+        if style is None:
+            rng = torch.Generator()
+            rng.manual_seed(seed)
+            style = torch.randn(1, self.style_dim, 1, 1, generator=rng).to(self.device)
+            self.style_cache.put(seed, style)
+        return style
+
+    def styles_from_seeds(self, seeds):
+        # stacked [N, style_dim, 1, 1] style codes, one per seed
+        return torch.cat([self.style_from_seed(seed) for seed in seeds])
+
+    def has_style_encoder(self):
+        return hasattr(self.generator, 'enc_style')
+
+    def style_from_image(self, image):
+        # [1, style_dim, 1, 1] style code of a reference PIL image of the target domain, encoded by the style
+        # encoder of the target domain and cached by image content, so reusing a reference costs a hash
+        if not self.has_style_encoder():
+            # a request error, not a setup error: the other commands of the model still work
+            raise InvalidArgumentError('style_image', 'style reference images need a PyTorch generator built with its style encoder')
+        image = image.convert('RGB')
+        key = 'image ' + image_key(image)
+        style = self.style_cache.get(key)
+        if style is None:
+            with torch.no_grad():
+                with self.autocast():
+                    style = self.generator.encode_style(self.preprocess(image))
+            style = style.float()
+            self.style_cache.put(key, style)
+        return style
+
+    def styles_from_images(self, images):
+        # stacked [N, style_dim, 1, 1] style codes, one per reference image
+        return torch.cat([self.style_from_image(image) for image in images])
+
+    def encode_image(self, image):
+        # PIL image -> content code, served from the content cache when the same image was seen before
+        return self.encode_images([image])
+
+    def encode_images(self, images):
+        # list of PIL images of the same batch_key -> [N, C, H, W] content codes. Cache misses are encoded
+        # together in one batch, each padded to the size bucket.
+        images = [image.convert('RGB') for image in images]
+        keys = [(self.direction, image_key(image)) for image in images]
+        cached = {}
+        for key in keys:
+            if key not in cached:
+                cached[key] = self.content_cache.get(key)
+        missing = [key for key in cached if cached[key] is None]
+        if missing:
+            first_index = dict((key, keys.index(key)) for key in missing)
+            missing_images = [images[first_index[key]] for key in missing]
+            with torch.no_grad(), self.unpadded_statistics([image.size for image in missing_images]):
+                encoded = self._encode(torch.cat([self.pad_to_bucket(self.preprocess(image)) for image in missing_images]))
+            for j, key in enumerate(missing):
+                # clone slices of a batch so a cached entry does not keep the whole batch alive
+                cached[key] = encoded[j:j + 1] if len(missing) == 1 else encoded[j:j + 1].clone()
+                self.content_cache.put(key, cached[key])
+        return torch.cat([cached[key] for key in keys]) if len(keys) > 1 else cached[keys[0]]
+
+    def autocast(self):
+        return torch.autocast(self.device.type, dtype=self.compute_dtype, enabled=self.compute_dtype != torch.float32)
+
+    def _encode(self, images):
+        with self.autocast():
+            return self.generator.encode_content(images)
+
+    def _decode(self, content, style):
+        if self.compute_dtype == torch.float32:
+            return self.generator.decode(content, style)
+        adain_params = self.generator.split_adain_params(self.generator.mlp(style))
+        with self.autocast():
+            images = self.generator.dec(content, adain_params)
+        return images.float()
+
+    def decode(self, content, style, sizes=None):
+        # sizes is the (width, height) of each encoded image, or one size for all, needed when they were padded
+        # to a size bucket
+        with torch.no_grad(), self.unpadded_statistics(sizes):
+            return self._decode(content, style)
+
+    def iter_decode_styles(self, content, styles, chunk_size=16, size=None):
+        # decode one [1, C, H, W] content code against N style codes, batching up to chunk_size styles
+        # per forward pass, and yield the outputs of each batch as soon as it is decoded
+        for i in range(0, styles.size(0), chunk_size):
+            chunk = styles[i:i + chunk_size]
+            with torch.no_grad(), self.unpadded_statistics(size):
+                outputs = self._decode(content.expand(chunk.size(0), -1, -1, -1), chunk)
+            yield outputs
+
+    def decode_styles(self, content, styles, chunk_size=16, size=None):
+        return torch.cat(list(self.iter_decode_styles(content, styles, chunk_size, size)))
+
+    def iter_translate_styles(self, image, styles, chunk_size=16):
+        # translate one PIL image with N style codes and yield the outputs of each forward pass as soon as it is done:
+        # the content is encoded once and decoded against up to chunk_size styles per pass, or, for an image that
+        # needs tiling, the image is translated tile by tile once per style
+        if self.needs_tiling(image):
+            for i in range(styles.size(0)):
+                yield self.translate_tiled(image, styles[i:i + 1])
+        else:
+            for outputs in self.iter_decode_styles(self.encode_image(image), styles, chunk_size, image.size):
+                yield outputs
+
+    def translate(self, images, style):
+        with torch.no_grad():
+            return self._decode(self._encode(images), style)
+
+    def warmup(self, sizes, batch_size=1):
+        # Translate blank batches at each (width, height) in sizes, so that the first requests at these sizes do
+        # not pay for CUDA context creation, conv algorithm selection (cudnn.benchmark), oneDNN primitive creation
+        # or allocator growth. Sizes are mapped to the shape the generator will see: their size bucket, or the
+        # tile size for images that would be tiled. Returns the (width, height, seconds) of each shape warmed up.
+        style = torch.zeros(batch_size, self.style_dim, 1, 1, device=self.device)
+        shapes = []
+        for width, height in sizes:
+            if self.tile_size and max(width, height) > self.tile_size:
+                shape = (self.tile_size, self.tile_size)
+            else:
+                shape = self.bucket(width, height) or (width, height)
+            if shape not in shapes:
+                shapes.append(shape)
+        timings = []
+        for width, height in shapes:
+            start = time.time()
+            images = torch.zeros(batch_size, 3, height, width, device=self.device).contiguous(memory_format=self.memory_format)
+            self.translate(images, style)
+            if self.device.type == 'cuda':
+                torch.cuda.synchronize(self.device)
+            timings.append((width, height, time.time() - start))
+        return timings
+
+    def needs_tiling(self, image):
+        return self.tile_size > 0 and max(image.size) > self.tile_size
+
+    def translate_tiled(self, image, style):
+        # Translate a PIL image of any size with peak memory bounded by the tile size. The normalization
+        # statistics of the whole image are taken from a first pass over a copy downscaled to at most two tiles
+        # on a side (statistics of a copy downscaled to one tile drift visibly from those of the whole image),
+        # then every tile is encoded and decoded with them and the overlapping outputs are blended with
+        # feathered weights, so that no seams appear. Pixels still differ from an untiled translation where
+        # the convolutions of a tile see less context than in the whole image, mostly with small overlaps.
+        # Returns a [1, 3, H, W] output with H and W rounded down to multiples of 4, like the untiled path.
+        # Tiles bypass the content cache.
+        images = self.preprocess(image)
+        height, width = images.size(2) // 4 * 4, images.size(3) // 4 * 4
+        images = images[:, :, :height, :width]
+        scale = min(2. * self.tile_size / max(height, width), 1.)
+        low_res = F.interpolate(images, size=(max(int(round(height * scale)), 4), max(int(round(width * scale)), 4)), mode='area')
+        statistics = self.norm_statistics.empty_copy()
+        outputs = torch.zeros_like(images)
+        weights = torch.zeros(1, 1, height, width, device=self.device)
+        stride = self.tile_size - self.tile_overlap
+        with torch.no_grad():
+            with statistics.record():
+                self.translate(low_res, style)
+            with statistics.apply():
+                ys, xs = tile_starts(height, self.tile_size, stride), tile_starts(width, self.tile_size, stride)
+                for y in ys:
+                    for x in xs:
+                        tile = images[:, :, y:y + self.tile_size, x:x + self.tile_size]
+                        output = self.translate(tile, style)
+                        window = feather_window(tile.size(2), self.tile_overlap, y > 0, y < ys[-1], self.device).view(-1, 1) * \
+                            feather_window(tile.size(3), self.tile_overlap, x > 0, x < xs[-1], self.device).view(1, -1)
+                        outputs[:, :, y:y + tile.size(2), x:x + tile.size(3)] += output * window
+                        weights[:, :, y:y + tile.size(2), x:x + tile.size(3)] += window
+        return outputs / weights
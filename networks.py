@@ -60,10 +60,11 @@ class MsImageDis(nn.Module):
             if self.gan_type == 'lsgan':
                 loss += torch.mean((out0 - 0)**2) + torch.mean((out1 - 1)**2)
             elif self.gan_type == 'nsgan':
+                # sigmoid + BCE on the logits, which is also safe under autocast
                 all0 = Variable(torch.zeros_like(out0.data).cuda(), requires_grad=False)
                 all1 = Variable(torch.ones_like(out1.data).cuda(), requires_grad=False)
-                loss += torch.mean(F.binary_cross_entropy(F.sigmoid(out0), all0) +
-                                   F.binary_cross_entropy(F.sigmoid(out1), all1))
+                loss += torch.mean(F.binary_cross_entropy_with_logits(out0, all0) +
+                                   F.binary_cross_entropy_with_logits(out1, all1))
             else:
                 assert 0, "Unsupported GAN type: {}".format(self.gan_type)
         return loss
@@ -77,7 +78,7 @@ class MsImageDis(nn.Module):
                 loss += torch.mean((out0 - 1)**2) # LSGAN
             elif self.gan_type == 'nsgan':
                 all1 = Variable(torch.ones_like(out0.data).cuda(), requires_grad=False)
-                loss += torch.mean(F.binary_cross_entropy(F.sigmoid(out0), all1))
+                loss += torch.mean(F.binary_cross_entropy_with_logits(out0, all1))
             else:
                 assert 0, "Unsupported GAN type: {}".format(self.gan_type)
         return loss
@@ -90,6 +91,11 @@ class AdaINGen(nn.Module):
     # AdaIN auto-encoder architecture
     def __init__(self, input_dim, params):
         super(AdaINGen, self).__init__()
+        self.build(input_dim, input_dim, params)
+
+    def build(self, input_dim, output_dim, params, style_encoder=True, fused_upsample=False):
+        # build the style encoder and decoder of output_dim images and the content encoder of input_dim images.
+        # The auto-encoder has input_dim == output_dim, the inference generators map one domain to the other.
         dim = params['dim']
         style_dim = params['style_dim']
         n_downsample = params['n_downsample']
@@ -99,14 +105,17 @@ class AdaINGen(nn.Module):
         mlp_dim = params['mlp_dim']
 
         # style encoder
-        self.enc_style = StyleEncoder(4, input_dim, dim, style_dim, norm='none', activ=activ, pad_type=pad_type)
+        if style_encoder:
+            self.enc_style = StyleEncoder(4, output_dim, dim, style_dim, norm='none', activ=activ, pad_type=pad_type)
 
         # content encoder
         self.enc_content = ContentEncoder(n_downsample, n_res, input_dim, dim, 'in', activ, pad_type=pad_type)
-        self.dec = Decoder(n_downsample, n_res, self.enc_content.output_dim, input_dim, res_norm='adain', activ=activ, pad_type=pad_type)
+        self.dec = Decoder(n_downsample, n_res, self.enc_content.output_dim, output_dim, res_norm='adain', activ=activ, pad_type=pad_type,
+                           fused_upsample=fused_upsample)
 
         # MLP to generate AdaIN parameters
         self.mlp = MLP(style_dim, self.get_num_adain_params(self.dec), mlp_dim, 3, norm='none', activ=activ)
+        self.index_adain_layers()
 
     def forward(self, images):
         # reconstruct an image
@@ -116,27 +125,46 @@ class AdaINGen(nn.Module):
 
     def encode(self, images):
         # encode an image to its content and style codes
-        style_fake = self.enc_style(images)
-        content = self.enc_content(images)
+        style_fake = self.encode_style(images)
+        content = self.encode_content(images)
         return content, style_fake
 
+    def encode_content(self, images):
+        # encode an image to its content code only, skipping the style encoder
+        return self.enc_content(images)
+
+    def encode_style(self, images):
+        # encode an image to its style code only, skipping the content encoder
+        return self.enc_style(images)
+
     def decode(self, content, style):
-        # decode content and style codes to an image
-        adain_params = self.mlp(style)
-        self.assign_adain_params(adain_params, self.dec)
-        images = self.dec(content)
+        # decode content and style codes to an image. The AdaIN parameters are passed to the decoder
+        # explicitly instead of being stored on its layers, so one decoder can serve concurrent and
+        # batched decodes with a different style per sample.
+        adain_params = self.split_adain_params(self.mlp(style))
+        images = self.dec(content, adain_params)
         return images
 
+    def split_adain_params(self, adain_params):
+        # slice the MLP output into one (mean, std) pair of [B, C] tensors per AdaIN layer, in decoder order
+        chunks = torch.split(adain_params, self.adain_splits, dim=1)
+        return [(chunks[i], chunks[i + 1]) for i in range(0, len(chunks), 2)]
+
     def assign_adain_params(self, adain_params, model):
-        # assign the adain_params to the AdaIN layers in model
-        for m in model.modules():
-            if m.__class__.__name__ == "AdaptiveInstanceNorm2d":
-                mean = adain_params[:, :m.num_features]
-                std = adain_params[:, m.num_features:2*m.num_features]
-                m.bias = mean.contiguous().view(-1)
-                m.weight = std.contiguous().view(-1)
-                if adain_params.size(1) > 2*m.num_features:
-                    adain_params = adain_params[:, 2*m.num_features:]
+        # assign the adain_params to the AdaIN layers in model as module state
+        layers = self.adain_layers if model is self.dec else \
+            [m for m in model.modules() if isinstance(m, AdaptiveInstanceNorm2d)]
+        for m, (mean, std) in zip(layers, self.split_adain_params(adain_params)):
+            m.bias = mean.contiguous().view(-1)
+            m.weight = std.contiguous().view(-1)
+
+    def index_adain_layers(self):
+        # list the decoder's AdaIN layers and the widths of their (mean, std) slices of the MLP output
+        # once, in the order they are applied. A plain list, so the layers are not registered twice.
+        self.adain_layers = [m for m in self.dec.modules() if isinstance(m, AdaptiveInstanceNorm2d)]
+        self.adain_splits = []
+        for m in self.adain_layers:
+            self.adain_splits += [m.num_features, m.num_features]
 
     def get_num_adain_params(self, model):
         # return the number of AdaIN parameters needed by the model
@@ -221,8 +249,11 @@ class ContentEncoder(nn.Module):
         return self.model(x)
 
 class Decoder(nn.Module):
-    def __init__(self, n_upsample, n_res, dim, output_dim, res_norm='adain', activ='relu', pad_type='zero'):
+    def __init__(self, n_upsample, n_res, dim, output_dim, res_norm='adain', activ='relu', pad_type='zero', fused_upsample=False):
         super(Decoder, self).__init__()
+        # run each upsample + conv pair as one sub-pixel conv that never materializes the upsampled activation.
+        # Same layers and parameter names either way, so checkpoints load unchanged.
+        self.fused_upsample = fused_upsample
 
         self.model = []
         # AdaIN residual blocks
@@ -236,8 +267,18 @@ class Decoder(nn.Module):
         self.model += [Conv2dBlock(dim, output_dim, 7, 1, 3, norm='none', activation='tanh', pad_type=pad_type)]
         self.model = nn.Sequential(*self.model)
 
-    def forward(self, x):
-        return self.model(x)
+    def forward(self, x, adain_params=None):
+        if adain_params is None and not self.fused_upsample:
+            return self.model(x)
+        # the AdaIN layers all live in the residual blocks at the head of the decoder
+        x = self.model[0](x, adain_params)
+        layers = iter(self.model[1:])
+        for layer in layers:
+            if self.fused_upsample and isinstance(layer, nn.Upsample):
+                x = next(layers).forward_upsampled(x)
+            else:
+                x = layer(x)
+        return x
 
 ##################################################################################
 # Sequential Models
@@ -250,8 +291,13 @@ class ResBlocks(nn.Module):
             self.model += [ResBlock(dim, norm=norm, activation=activation, pad_type=pad_type)]
         self.model = nn.Sequential(*self.model)
 
-    def forward(self, x):
-        return self.model(x)
+    def forward(self, x, adain_params=None):
+        if adain_params is None:
+            return self.model(x)
+        # two AdaIN layers per residual block
+        for i, block in enumerate(self.model):
+            x = block(x, adain_params[2 * i:2 * i + 2])
+        return x
 
 class MLP(nn.Module):
     def __init__(self, input_dim, output_dim, dim, n_blk, norm='none', activ='relu'):
@@ -279,9 +325,13 @@ class ResBlock(nn.Module):
         model += [Conv2dBlock(dim ,dim, 3, 1, 1, norm=norm, activation='none', pad_type=pad_type)]
         self.model = nn.Sequential(*model)
 
-    def forward(self, x):
+    def forward(self, x, adain_params=None):
         residual = x
-        out = self.model(x)
+        if adain_params is None:
+            out = self.model(x)
+        else:
+            out = self.model[0](x, adain_params[0])
+            out = self.model[1](out, adain_params[1])
         out += residual
         return out
 
@@ -290,6 +340,9 @@ class Conv2dBlock(nn.Module):
                  padding=0, norm='none', activation='relu', pad_type='zero'):
         super(Conv2dBlock, self).__init__()
         self.use_bias = True
+        self.padding = padding
+        # (key, weight, bias) of the conv folded for forward_upsampled, see upsampled_weight
+        self.upsampled_cache = None
         # initialize padding
         if pad_type == 'reflect':
             self.pad = nn.ReflectionPad2d(padding)
@@ -338,14 +391,73 @@ class Conv2dBlock(nn.Module):
         else:
             self.conv = nn.Conv2d(input_dim, output_dim, kernel_size, stride, bias=self.use_bias)
 
-    def forward(self, x):
+    def forward(self, x, adain_params=None):
         x = self.conv(self.pad(x))
+        if self.norm:
+            x = self.norm(x) if adain_params is None else self.norm(x, adain_params)
+        if self.activation:
+            x = self.activation(x)
+        return x
+
+    def fold_padding(self):
+        # Let the conv pad its input instead of a separate padding module. Zero padding is then done inside the
+        # conv kernels of cuDNN and oneDNN, without a padded copy of the input. Reflection and replication
+        # padding stay separate: no conv backend implements them, and nn.Conv2d would run the same F.pad copy.
+        if isinstance(self.pad, nn.ZeroPad2d) and isinstance(self.conv, nn.Conv2d):
+            self.conv.padding = (self.padding, self.padding)
+            self.pad = nn.Identity()
+
+    def forward_upsampled(self, x):
+        # self(F.interpolate(x, scale_factor=2)) as a sub-pixel conv over x, with the padded border recomputed exactly
+        if not isinstance(self.conv, nn.Conv2d):
+            # convs replaced by other modules, e.g. quantized ones, take the unfused path
+            return self(F.interpolate(x, scale_factor=2))
+        p = self.padding
+        k = self.conv.kernel_size[0]
+        if self.conv.stride[0] != 1 or k != 2 * p + 1 or min(x.size(2), x.size(3)) <= p:
+            return self(F.interpolate(x, scale_factor=2))
+        weight, bias, padding = self.upsampled_weight()
+        out = F.pixel_shuffle(F.conv2d(x, weight, bias, padding=padding), 2)
+        if p > 0:
+            m = p + 1
+            out[:, :, :p] = self.conv(self.pad(F.interpolate(x[:, :, :m], scale_factor=2)))[:, :, :p]
+            out[:, :, -p:] = self.conv(self.pad(F.interpolate(x[:, :, -m:], scale_factor=2)))[:, :, -p:]
+            out[:, :, :, :p] = self.conv(self.pad(F.interpolate(x[:, :, :, :m], scale_factor=2)))[:, :, :, :p]
+            out[:, :, :, -p:] = self.conv(self.pad(F.interpolate(x[:, :, :, -m:], scale_factor=2)))[:, :, :, -p:]
+        x = out
         if self.norm:
             x = self.norm(x)
         if self.activation:
             x = self.activation(x)
         return x
 
+    def upsampled_weight(self):
+        # folded weight, bias and padding for forward_upsampled, cached until the conv parameters change
+        weight, bias = self.conv.weight, self.conv.bias
+        key = [(t.data_ptr(), t._version, t.dtype, t.device) for t in (weight, bias) if t is not None]
+        training = torch.is_grad_enabled() and any(t.requires_grad for t in (weight, bias) if t is not None)
+        if not training and self.upsampled_cache is not None and self.upsampled_cache[0] == key:
+            return self.upsampled_cache[1:]
+        folded, padding = upsampled_conv_weight(weight, self.padding)
+        folded = (folded, bias.repeat_interleave(4) if bias is not None else None, padding)
+        if not training and not torch.jit.is_tracing():
+            self.upsampled_cache = (key,) + folded
+        return folded
+
+
+def upsampled_conv_weight(weight, padding):
+    # fold a stride-1 conv after nearest x2 upsampling into a [4 * Cout, Cin, n, n] conv in pixel_shuffle order, and its padding
+    k = weight.size(2)
+    lo = (-padding) // 2
+    n = (k - padding) // 2 - lo + 1
+    taps = weight.new_zeros(2, n, k)
+    for r in range(2):
+        for a in range(k):
+            taps[r, (r + a - padding) // 2 - lo, a] = 1
+    weight = torch.einsum('rya,oiab,sxb->orsiyx', taps, weight, taps)
+    return weight.reshape(-1, weight.size(3), n, n), -lo
+
+
 class LinearBlock(nn.Module):
     def __init__(self, input_dim, output_dim, norm='none', activation='relu'):
         super(LinearBlock, self).__init__()
@@ -459,29 +571,46 @@ class AdaptiveInstanceNorm2d(nn.Module):
         # weight and bias are dynamically assigned
         self.weight = None
         self.bias = None
-        # just dummy buffers, not used
+        # just dummy buffers, not used. Kept so existing checkpoints load unchanged.
         self.register_buffer('running_mean', torch.zeros(num_features))
         self.register_buffer('running_var', torch.ones(num_features))
 
-    def forward(self, x):
-        assert self.weight is not None and self.bias is not None, "Please assign weight and bias before calling AdaIN!"
+    def forward(self, x, adain_params=None):
+        # adain_params is an optional (mean, std) pair of [B, C] tensors used instead of the assigned bias and weight
+        if adain_params is None:
+            assert self.weight is not None and self.bias is not None, "Please assign weight and bias before calling AdaIN!"
+            bias, weight = self.bias, self.weight
+        else:
+            bias, weight = adain_params
         b, c = x.size(0), x.size(1)
-        running_mean = self.running_mean.repeat(b)
-        running_var = self.running_var.repeat(b)
-
-        # Apply instance norm
-        x_reshaped = x.contiguous().view(1, b * c, *x.size()[2:])
 
-        out = F.batch_norm(
-            x_reshaped, running_mean, running_var, self.weight, self.bias,
-            True, self.momentum, self.eps)
+        if x.is_contiguous(memory_format=torch.channels_last) and not x.is_contiguous():
+            # channels_last inputs keep their layout: one group per channel instead of a (1, B * C, H, W) view
+            if b == 1:
+                return F.group_norm(x.float(), c, weight.float().reshape(-1), bias.float().reshape(-1), self.eps).to(x.dtype)
+            out = F.group_norm(x.float(), c, eps=self.eps)
+            return torch.addcmul(bias.float().reshape(b, c, 1, 1), out, weight.float().reshape(b, c, 1, 1)).to(x.dtype)
 
-        return out.view(b, c, *x.size()[2:])
+        # instance norm and the per-sample affine step as one fused group norm kernel, in fp32
+        out = F.group_norm(x.float().reshape(1, b * c, *x.size()[2:]), b * c,
+                           weight.float().reshape(-1), bias.float().reshape(-1), self.eps)
+        return out.view(b, c, *x.size()[2:]).to(x.dtype)
 
     def __repr__(self):
         return self.__class__.__name__ + '(' + str(self.num_features) + ')'
 
 
+class InstanceNorm2d(nn.InstanceNorm2d):
+    # nn.InstanceNorm2d computed as group norm with one group per channel when no running statistics are
+    # tracked: the same statistics over H x W, in a faster kernel that also keeps channels_last inputs in
+    # channels_last. Computed in fp32 for reduced-precision inputs. Used by the inference generator only,
+    # training keeps nn.InstanceNorm2d.
+    def forward(self, x):
+        if self.track_running_stats or x.dim() != 4:
+            return super(InstanceNorm2d, self).forward(x)
+        return F.group_norm(x.float(), self.num_features, self.weight, self.bias, self.eps).to(x.dtype)
+
+
 class LayerNorm(nn.Module):
     def __init__(self, num_features, eps=1e-5, affine=True):
         super(LayerNorm, self).__init__()
@@ -495,21 +624,19 @@ class LayerNorm(nn.Module):
 
     def forward(self, x):
         shape = [-1] + [1] * (x.dim() - 1)
-        # print(x.size())
-        if x.size(0) == 1:
-            # These two lines run much faster in pytorch 0.4 than the two lines listed below.
-            mean = x.view(-1).mean().view(*shape)
-            std = x.view(-1).std().view(*shape)
-        else:
-            mean = x.view(x.size(0), -1).mean(1).view(*shape)
-            std = x.view(x.size(0), -1).std(1).view(*shape)
-
-        x = (x - mean) / (std + self.eps)
+        # unbiased std and mean of each sample in one pass, in fp32 for reduced-precision inputs. Reducing over
+        # the non-batch dims instead of a flattened view avoids a copy of channels_last inputs.
+        std, mean = torch.std_mean(x.float(), dim=tuple(range(1, x.dim())))
+        scale = (std + self.eps).reciprocal().view(*shape)
+        shift = -mean.view(*shape) * scale
 
         if self.affine:
-            shape = [1, -1] + [1] * (x.dim() - 2)
-            x = x * self.gamma.view(*shape) + self.beta.view(*shape)
-        return x
+            # fold the affine step into the per-sample scale and shift, so that
+            # (x - mean) / (std + eps) * gamma + beta is a single multiply-add over x
+            affine_shape = [1, -1] + [1] * (x.dim() - 2)
+            scale = scale * self.gamma.view(*affine_shape)
+            shift = shift * self.gamma.view(*affine_shape) + self.beta.view(*affine_shape)
+        return torch.addcmul(shift, x, scale).to(x.dtype)
 
 def l2normalize(v, eps=1e-12):
     return v / (v.norm() + eps)
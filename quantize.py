@@ -0,0 +1,91 @@
+"""
+Build an int8 variant of the inference generator for CPU serving.
+
+The convolutions of the content encoder and decoder are statically quantized, with activation ranges
+calibrated on a folder of images, and the Linear layers of the MLP are dynamically quantized. The result is
+saved as its own artifact, which runway_model.py loads like a regular checkpoint.
+
+Example usage:
+    python quantize.py --checkpoint gen_01000000.pt --images datasets/ffhq2ladies/testA --output gen_int8.pt
+"""
+from inference import DEFAULT_CONFIG, Translator, get_device, load_inference_generator, psnr, quantize_generator, ssim
+from data import ImageFolder
+from torchvision import transforms
+import argparse
+import copy
+import io
+import time
+import torch
+
+
+def serialized_mb(obj):
+    buffer = io.BytesIO()
+    torch.save(obj, buffer)
+    return buffer.tell() / 2. ** 20
+
+
+def style_batches(images, style_dim, seed=0):
+    # pair each [1, 3, H, W] image with a style code drawn from a seeded generator
+    rng = torch.Generator()
+    rng.manual_seed(seed)
+    for image in images:
+        yield image.unsqueeze(0), torch.randn(1, style_dim, 1, 1, generator=rng)
+
+
+def mean_time(fn, iters):
+    fn()
+    start = time.time()
+    for _ in range(iters):
+        fn()
+    return (time.time() - start) / iters
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--checkpoint', type=str, required=True, help='gen_*.pt checkpoint to quantize')
+parser.add_argument('--images', type=str, required=True, help='folder of images of the source domain, used for calibration and evaluation')
+parser.add_argument('--output', type=str, required=True, help='path of the quantized artifact')
+parser.add_argument('--b2a', action='store_true', help='quantize the b2a instead of the a2b translator')
+parser.add_argument('--backend', type=str, default='fbgemm', help='quantized engine: fbgemm for x86 CPUs, x86 on torch >= 1.13, or qnnpack for ARM')
+parser.add_argument('--size', type=int, default=512, help='images are resized and center cropped to this size')
+parser.add_argument('--num_calibration', type=int, default=32)
+parser.add_argument('--num_eval', type=int, default=8, help='held-out images used to measure the output drift')
+parser.add_argument('--iters', type=int, default=3)
+
+
+if __name__ == '__main__':
+    opts = parser.parse_args()
+    device = get_device('cpu')
+    config = DEFAULT_CONFIG
+    style_dim = config['gen']['style_dim']
+    dataset = ImageFolder(opts.images, transform=transforms.Compose([
+        transforms.Resize(opts.size), transforms.CenterCrop(opts.size), transforms.ToTensor(),
+        transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))]))
+    calibration = [dataset[i] for i in range(min(opts.num_calibration, len(dataset)))]
+    evaluation = [dataset[i] for i in range(len(calibration), min(len(calibration) + opts.num_eval, len(dataset)))]
+    if not evaluation:
+        print('No held-out images left, measuring drift on the calibration images')
+        evaluation = calibration[:opts.num_eval]
+
+    generator = load_inference_generator(opts.checkpoint, config, device, a2b=not opts.b2a)
+    quantized = quantize_generator(copy.deepcopy(generator), style_batches(calibration, style_dim), opts.backend)
+    checkpoint = {'config': config, 'a2b': not opts.b2a, 'state_dict': quantized.state_dict(),
+                  'quantization': {'backend': opts.backend, 'calibration_images': len(calibration), 'size': opts.size}}
+    torch.save(checkpoint, opts.output)
+
+    fp32, int8 = Translator(generator, device), Translator(quantized, device)
+    psnrs, ssims = [], []
+    for images, styles in style_batches(evaluation, style_dim, seed=1):
+        expected, outputs = fp32.translate(images, styles), int8.translate(images, styles)
+        psnrs.append(psnr(outputs, expected).item())
+        ssims.append(ssim(outputs, expected).item())
+    images, styles = next(style_batches(evaluation, style_dim))
+    before = mean_time(lambda: fp32.translate(images, styles), opts.iters)
+    after = mean_time(lambda: int8.translate(images, styles), opts.iters)
+
+    before_mb, after_mb = serialized_mb(generator.state_dict()), serialized_mb(checkpoint)
+    print('Saved %s' % opts.output)
+    print('size   : fp32 %7.1f MB | int8 %7.1f MB | %.2fx smaller' % (before_mb, after_mb, before_mb / after_mb))
+    print('latency: fp32 %7.1f ms | int8 %7.1f ms | %.2fx faster at %d px, %d intra-op threads' % (
+        before * 1000, after * 1000, before / after, opts.size, torch.get_num_threads()))
+    print('drift  : PSNR %.2f dB (min %.2f) | SSIM %.4f (min %.4f) over %d held-out images' % (
+        sum(psnrs) / len(psnrs), min(psnrs), sum(ssims) / len(ssims), min(ssims), len(psnrs)))
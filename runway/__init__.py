@@ -5,4 +5,5 @@ from .__version__ import __version__
 __defaultmodel__ = RunwayModel()
 setup = __defaultmodel__.setup
 command = __defaultmodel__.command
+metrics = __defaultmodel__.metrics
 run = __defaultmodel__.run
\ No newline at end of file
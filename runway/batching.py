@@ -0,0 +1,117 @@
+import gevent
+from gevent.event import AsyncResult
+
+class _Batch(object):
+    def __init__(self, key):
+        self.key = key
+        self.items = []
+        self.timer = None
+
+class BatchScheduler(object):
+    """Collects concurrent calls to a batched command and runs them together.
+
+    Calls are grouped by ``batch_key(model, inputs)``. A group is run as soon as it
+    holds ``max_batch_size`` items, or ``max_batch_latency`` milliseconds after
+    its first item arrived, whichever comes first. The wrapped function
+    receives the model and a list of input dictionaries and must return a list
+    of outputs of the same length and order. When a batch of several calls
+    raises, its calls are run again one at a time, so that an error only fails
+    the calls that raise it.
+
+    The model server is a single-threaded gevent server, so waiting callers
+    are parked greenlets and the scheduler uses gevent primitives rather than
+    OS threads.
+
+    :param fn: The batched command function, called as ``fn(model, inputs_list)``
+    :type fn: function
+    :param max_batch_size: The largest number of calls run together, defaults to 1
+    :type max_batch_size: int, optional
+    :param max_batch_latency: The longest time in milliseconds the first call of
+        a batch waits for more calls to arrive, defaults to 0
+    :type max_batch_latency: float, optional
+    :param batch_key: A function mapping the model and a call's inputs to a
+        hashable key. Only calls with equal keys are batched together, defaults
+        to None (all calls share one key)
+    :type batch_key: function, optional
+    """
+
+    def __init__(self, fn, max_batch_size=1, max_batch_latency=0, batch_key=None):
+        self.fn = fn
+        self.max_batch_size = max(int(max_batch_size), 1)
+        self.max_batch_latency = max(float(max_batch_latency), 0)
+        self.batch_key = batch_key
+        self.pending = {}
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.batches_run = 0
+        self.items_run = 0
+
+    def submit(self, model, inputs):
+        """Queue a call and block the calling greenlet until its batch has run.
+
+        :param model: The model returned by the ``@runway.setup()`` function
+        :param inputs: The deserialized inputs of this call
+        :type inputs: dict
+        :return: The output of this call
+        """
+        if self.max_batch_size == 1:
+            return self._run(model, [inputs])[0]
+        key = self.batch_key(model, inputs) if self.batch_key else None
+        batch = self.pending.get(key)
+        if batch is None:
+            batch = self.pending[key] = _Batch(key)
+            batch.timer = gevent.spawn_later(self.max_batch_latency / 1000.0, self._flush, model, batch)
+        result = AsyncResult()
+        batch.items.append((inputs, result))
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        if len(batch.items) >= self.max_batch_size:
+            batch.timer.kill(block=False)
+            self._flush(model, batch)
+        return result.get()
+
+    def _flush(self, model, batch):
+        if self.pending.get(batch.key) is not batch:
+            return
+        del self.pending[batch.key]
+        self.queue_depth -= len(batch.items)
+        try:
+            outputs = self._run(model, [inputs for inputs, _ in batch.items])
+            if len(outputs) != len(batch.items):
+                raise Exception('Batched command returned %d outputs for %d inputs' % (len(outputs), len(batch.items)))
+        except Exception as err:
+            if len(batch.items) == 1:
+                batch.items[0][1].set_exception(err)
+                return
+            # rerun the calls one by one, so that a bad input only fails its own call
+            for inputs, result in batch.items:
+                try:
+                    result.set(self._run(model, [inputs])[0])
+                except Exception as item_err:
+                    result.set_exception(item_err)
+            return
+        for (_, result), output in zip(batch.items, outputs):
+            result.set(output)
+
+    def _run(self, model, inputs_list):
+        self.batches_run += 1
+        self.items_run += len(inputs_list)
+        return self.fn(model, inputs_list)
+
+    def metrics(self):
+        """Get the queue-depth and batch-size metrics of this scheduler.
+
+        :return: An object with "queueDepth", "maxQueueDepth", "batchesRun",
+            "itemsRun" and "meanBatchSize" keys, plus the configured
+            "maxBatchSize" and "maxBatchLatency".
+        :rtype: dict
+        """
+        return dict(
+            maxBatchSize=self.max_batch_size,
+            maxBatchLatency=self.max_batch_latency,
+            queueDepth=self.queue_depth,
+            maxQueueDepth=self.max_queue_depth,
+            batchesRun=self.batches_run,
+            itemsRun=self.items_run,
+            meanBatchSize=float(self.items_run) / self.batches_run if self.batches_run else 0
+        )
@@ -213,7 +213,7 @@ class image(BaseType):
 
     def deserialize(self, value):
         image = value[value.find(",")+1:]
-        image = base64.decodestring(image.encode('utf8'))
+        image = base64.decodebytes(image.encode('utf8'))
         buffer = IO(image)
         deserialized_image = Image.open(buffer)
         if deserialized_image.mode != self.get_pil_mode():
@@ -637,7 +637,7 @@ class segmentation(BaseType):
     def deserialize(self, value):
         try:
             image = value[value.find(",")+1:]
-            image = base64.decodestring(image.encode('utf8'))
+            image = base64.decodebytes(image.encode('utf8'))
             buffer = IO(image)
             img = Image.open(buffer)
             if img.mode.startswith('RGB'):
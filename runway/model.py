@@ -17,6 +17,7 @@ from geventwebsocket.handler import WebSocketHandler
 from flask_compress import Compress
 from .exceptions import RunwayError, MissingInputError, MissingOptionError, \
     InferenceError, UnknownCommandError, SetupError
+from .batching import BatchScheduler
 from .data_types import *
 from .utils import gzipped, parse_output_formats_from_header, serialize_command, cast_to_obj, timestamp_millis, \
         validate_post_request_body_is_json, get_json_or_none_if_invalid, argspec, \
@@ -35,6 +36,8 @@ class RunwayModel(object):
         self.setup_fn = None
         self.commands = {}
         self.command_fns = {}
+        self.batch_schedulers = {}
+        self.metrics_fn = None
         self.jobs = {}
         self.model = None
         self.running_status = 'STARTING'
@@ -135,7 +138,9 @@ class RunwayModel(object):
                 deserialized_inputs = deserialize_data(input_dict, inputs)
                 self.millis_last_command = timestamp_millis()
                 try:
-                    if inspect.isgeneratorfunction(command_fn):
+                    if command_name in self.batch_schedulers:
+                        output_data = self.batch_schedulers[command_name].submit(self.model, deserialized_inputs)
+                    elif inspect.isgeneratorfunction(command_fn):
                         g = command_fn(self.model, deserialized_inputs)
                         try:
                             while True:
@@ -145,6 +150,8 @@ class RunwayModel(object):
                                 output_data = err.value
                     else:
                         output_data = command_fn(self.model, deserialized_inputs)
+                except RunwayError:
+                    raise
                 except Exception as err:
                     raise reraise(InferenceError, InferenceError(repr(err)), sys.exc_info()[2])
                 if type(output_data) == tuple:
@@ -184,7 +191,16 @@ class RunwayModel(object):
                             to_send['progress'] = progress
                         send_message(job_id, 'output', to_send)
 
-                    if inspect.isgeneratorfunction(command_fn):
+                    if command_name in self.batch_schedulers:
+                        # each job runs in its own process, so there is nothing to batch it with
+                        try:
+                            output = command_fn(self.model, [deserialized_inputs])[0]
+                            send_output(output)
+                        except RunwayError:
+                            raise
+                        except Exception as err:
+                            raise reraise(InferenceError, InferenceError(repr(err)), sys.exc_info()[2])
+                    elif inspect.isgeneratorfunction(command_fn):
                         g = command_fn(self.model, deserialized_inputs)
                         try:
                             while True:
@@ -193,12 +209,16 @@ class RunwayModel(object):
                         except StopIteration as err:
                             if hasattr(err, 'value') and err.value is not None:
                                 send_output(err.value)
+                        except RunwayError:
+                            raise
                         except Exception as err:
                             raise reraise(InferenceError, InferenceError(repr(err)), sys.exc_info()[2])
                     else:
                         try:
                             output = command_fn(self.model, deserialized_inputs)
                             send_output(output)
+                        except RunwayError:
+                            raise
                         except Exception as err:
                             raise reraise(InferenceError, InferenceError(repr(err)), sys.exc_info()[2])
 
@@ -245,6 +265,15 @@ class RunwayModel(object):
             for job in jobs_for_session.values():
                 job.terminate()
 
+        @self.app.route('/metrics', methods=['GET'])
+        def metrics_route():
+            metrics = dict(
+                batching={name: scheduler.metrics() for name, scheduler in self.batch_schedulers.items()}
+            )
+            if self.metrics_fn is not None and self.model is not None:
+                metrics['model'] = self.metrics_fn(self.model)
+            return jsonify(metrics)
+
         @self.app.route('/<command_name>', methods=['GET'])
         def usage_route(command_name):
             try:
@@ -324,7 +353,8 @@ class RunwayModel(object):
                 return fn
             return decorator
 
-    def command(self, name, inputs={}, outputs={}, description=None):
+    def command(self, name, inputs={}, outputs={}, description=None, batched=False,
+                max_batch_size=1, max_batch_latency=0, batch_key=None):
         """This decorator function is used to define the interface for your
         model. All functions that are wrapped by this decorator become exposed
         via HTTP requests to ``/<command_name>``. Each command that you define
@@ -394,6 +424,26 @@ class RunwayModel(object):
             If this parameter is present its value will be rendered as a tooltip
             in Runway. Defaults to None.
         :type description: string, optional
+        :param batched: Whether the wrapped function processes a batch of calls
+            at once. A batched function is called as ``fn(model, inputs_list)``
+            with a list of input dictionaries and must return a list of outputs
+            in the same order. Concurrent HTTP requests to the command are
+            collected into micro-batches (see ``max_batch_size`` and
+            ``max_batch_latency``). Defaults to False.
+        :type batched: bool, optional
+        :param max_batch_size: The largest number of requests run together by a
+            batched command. A value of 1 runs every request on its own
+            immediately. Defaults to 1.
+        :type max_batch_size: int, optional
+        :param max_batch_latency: The longest time in milliseconds a request to
+            a batched command waits for other requests to join its batch,
+            defaults to 0.
+        :type max_batch_latency: float, optional
+        :param batch_key: A function mapping the model returned by the
+            ``@runway.setup()`` function and the inputs of a request to a
+            hashable key. Only requests with equal keys are batched together
+            (e.g. images of the same size). Defaults to None.
+        :type batch_key: function, optional
         :raises Exception: An exception if there isn't at least one key value
             pair for both inputs and outputs dictionaries
         :return: A decorated function
@@ -428,10 +478,39 @@ class RunwayModel(object):
 
         def decorator(fn):
             self.command_fns[name] = fn
+            if batched:
+                if inspect.isgeneratorfunction(fn):
+                    raise Exception('Batched commands can not be generator functions')
+                self.batch_schedulers[name] = BatchScheduler(fn, max_batch_size, max_batch_latency, batch_key)
+            else:
+                self.batch_schedulers.pop(name, None)
             return fn
 
         return decorator
 
+    def metrics(self, fn):
+        """This decorator is used to wrap a function that reports metrics of
+        the model returned by the ``@runway.setup()`` function, e.g. cache hit
+        rates. Its return value is included under the ``"model"`` key of the
+        ``/metrics`` route once the model has been set up.
+
+        .. code-block:: python
+
+            import runway
+
+            @runway.metrics
+            def metrics(model):
+                return { "cache_hits": model.cache_hits }
+
+        :param fn: A function called as ``fn(model)`` that returns a JSON
+            serializable dictionary
+        :type fn: function
+        :return: The function, unchanged
+        :rtype: function
+        """
+        self.metrics_fn = fn
+        return fn
+
     def setup_model(self, opts):
         self.running_status = 'STARTING'
         if self.setup_fn and self.options:
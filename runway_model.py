@@ -1,81 +1,255 @@
 import runway
-from runway.data_types import number, file, image
-from trainer import MUNIT_Trainer
-from torch.autograd import Variable
-import torchvision.utils as vutils
+from runway.data_types import number, file, image, category, text, array, boolean
+from runway.exceptions import InvalidArgumentError
+from inference import DEFAULT_CONFIG, LRUCache, StyleBank, Translator, get_device, configure_threads, interpolation_path, \
+	load_inference_generators, load_onnx_generator, load_torchscript_generator
 import sys
+import time
 import torch
 import os
-from torchvision import transforms
-from PIL import Image
 
-a2b = 1
-
-@runway.setup(options={'generator_checkpoint': runway.file(description="Checkpoint for the generator", extension='.pt')})
+# opt-in micro-batching of concurrent generate requests
+max_batch_size = int(os.environ.get('MUNIT_MAX_BATCH_SIZE', 1))
+max_batch_latency = float(os.environ.get('MUNIT_MAX_BATCH_LATENCY', 10))
+
+setup_options = {
+	'generator_checkpoint': runway.file(description="Checkpoint for the generator (.pt), an int8 CPU artifact written by quantize.py, or a generator exported by export.py for the chosen backend, a directory for onnxruntime"),
+	'backend': category(choices=['pytorch', 'torchscript', 'onnxruntime'], default='pytorch', description="'torchscript' serves a traced generator and 'onnxruntime' an ONNX generator directory on the CPU, both written by export.py."),
+	'device': category(choices=['auto', 'cpu', 'cuda'], default='auto', description="Device to run inference on. 'auto' picks CUDA when available. Overridden by the MUNIT_DEVICE environment variable."),
+	'num_threads': number(default=0, min=0, step=1, description="Intra-op threads for CPU inference, 0 keeps the torch default. Overridden by the MUNIT_NUM_THREADS environment variable."),
+	'content_cache_items': number(default=32, min=0, step=1, description="Number of encoded input images kept so that restyling the same image only runs the decoder. Both directions share one cache, so this bounds their entries together. 0 disables the cache."),
+	'content_cache_mb': number(default=512, min=0, step=64, description="Memory budget in MB of the content cache, shared by both directions."),
+	'tile_size': number(default=0, min=0, step=64, description="Translate images larger than this many pixels on a side in overlapping tiles, so peak memory is bounded by the tile size (the statistics pass over a copy downscaled to two tiles on a side takes about four times the memory of a tile). 0 disables tiling."),
+	'tile_overlap': number(default=64, min=0, step=16, description="Overlap in pixels between neighbouring tiles, blended to hide seams. Larger overlaps give tiles more context and outputs closer to an untiled translation, at the cost of more tiles."),
+	'channels_last': boolean(default=False, description="Run the generator convolutions in the channels_last (NHWC) memory format, the native layout of the cuDNN and oneDNN kernels."),
+	'autotune': boolean(default=False, description="Let cuDNN benchmark the convolution algorithms of each input shape and keep the fastest. Best combined with warmup_sizes when request sizes are known. This sets the process-wide torch.backends.cudnn.benchmark flag, which also applies to any other CUDA model in the process."),
+	'size_buckets': text(default='', description='Comma separated WIDTHxHEIGHT or SIZE buckets, e.g. "512, 768, 1024x768". Inputs are padded to the smallest bucket that fits them and the outputs cropped back, so that only these shapes reach the generator. Buckets are warmed up at startup. Normalization uses the statistics of the unpadded image, but pixels near the padded right and bottom edges still differ slightly from an unpadded translation. Needs the pytorch backend.'),
+	'warmup_sizes': text(default='', description='Comma separated image sizes translated once at startup, as WIDTHxHEIGHT or SIZE for squares, e.g. "512, 1024x768".'),
+	'style_bank': file(is_directory=True, description="Optional style bank written by build_style_bank.py, served by the generate_from_bank and generate_from_nearest_style commands."),
+	'precision': category(choices=['fp32', 'reduced'], default='fp32', description="'reduced' runs the encoder and decoder convolutions in fp16 on CUDA and bf16 on CPU, with normalization layers kept in fp32."),
+}
+
+@runway.setup(options=setup_options)
 def setup(opts):
 	generator_checkpoint_path = opts['generator_checkpoint']
 	# generator_checkpoint_path = './checkpoints/ffhq2ladiescrop.pt'
+	device = get_device(opts['device'])
+	num_threads = configure_threads(device, int(opts['num_threads']))
+	print('Running inference on %s (%d intra-op threads)' % (device, num_threads))
 
 	# Load experiment settings
-	config = {'image_save_iter': 10000, 'image_display_iter': 100, 'display_size': 16, 'snapshot_save_iter': 10000, 'log_iter': 100, 'max_iter': 1000000, 'batch_size': 1, 'weight_decay': 0.0001, 'beta1': 0.5, 'beta2': 0.999, 'init': 'kaiming', 'lr': 0.0001, 'lr_policy': 'step', 'step_size': 100000, 'gamma': 0.5, 'gan_w': 1, 'recon_x_w': 10, 'recon_s_w': 1, 'recon_c_w': 1, 'recon_x_cyc_w': 10, 'vgg_w': 0, 'gen': {'dim': 64, 'mlp_dim': 256, 'style_dim': 8, 'activ': 'relu', 'n_downsample': 2, 'n_res': 4, 'pad_type': 'reflect'}, 'dis': {'dim': 64, 'norm': 'none', 'activ': 'lrelu', 'n_layer': 4, 'gan_type': 'lsgan', 'num_scales': 3, 'pad_type': 'reflect'}, 'input_dim_a': 3, 'input_dim_b': 3, 'num_workers': 8, 'new_size': 1024, 'crop_image_height': 400, 'crop_image_width': 400, 'data_root': './datasets/ffhq2ladies/'}
-
-	# Setup model and data loader
-	trainer = MUNIT_Trainer(config)
-
-	state_dict = torch.load(generator_checkpoint_path)
-	trainer.gen_a.load_state_dict(state_dict['a'])
-	trainer.gen_b.load_state_dict(state_dict['b'])
-
-	return {'model': trainer, 'config': config}
+	config = DEFAULT_CONFIG
+
+	# Setup the inference-only generators, one per direction: content encoder of the source domain, decoder,
+	# MLP and style encoder of the target domain. The two directions use disjoint halves of the checkpoint, so
+	# serving both loads every weight once. Exported and quantized generators serve the direction they were built for.
+	if opts['backend'] == 'torchscript':
+		generators = [load_torchscript_generator(generator_checkpoint_path, device)]
+	elif opts['backend'] == 'onnxruntime':
+		generators = [load_onnx_generator(generator_checkpoint_path, device, num_threads)]
+	else:
+		# runway.file(extension='.pt') checks a single extension, exported generators have their own
+		if not generator_checkpoint_path.endswith('.pt'):
+			raise InvalidArgumentError('generator_checkpoint', 'file path does not have expected extension')
+		generators = load_inference_generators(generator_checkpoint_path, config, device, style_encoder=True).values()
+	# device placement, eval mode, frozen parameters and transforms are all set up once here
+	size_buckets = parse_sizes(opts['size_buckets'])
+	translators = {}
+	# one content cache for both directions, so the options bound the memory of the whole model
+	content_cache = LRUCache(int(opts['content_cache_items']), int(opts['content_cache_mb'] * 2 ** 20))
+	for generator in generators:
+		translators['a2b' if generator.a2b else 'b2a'] = Translator(generator, device,
+		                                                            content_cache=content_cache,
+		                                                            tile_size=int(opts['tile_size']),
+		                                                            tile_overlap=int(opts['tile_overlap']),
+		                                                            precision=opts['precision'],
+		                                                            channels_last=opts['channels_last'],
+		                                                            autotune=opts['autotune'],
+		                                                            size_buckets=size_buckets)
+	# run every bucket and warmup size once, so the first requests at these shapes pay no one-off costs
+	warmup_sizes = size_buckets + parse_sizes(opts['warmup_sizes'])
+	if warmup_sizes:
+		start = time.time()
+		for direction, translator in sorted(translators.items()):
+			for batch_size in sorted(set([1, max_batch_size])):
+				for width, height, seconds in translator.warmup(warmup_sizes, batch_size):
+					print('Warmed up %s %dx%d, batch of %d in %.2fs' % (direction, width, height, batch_size, seconds))
+		print('Warmup done in %.2fs' % (time.time() - start))
+
+	style_bank = StyleBank(opts['style_bank'], device) if opts['style_bank'] else None
+	if style_bank is not None:
+		print('Loaded %d %s styles from %s' % (len(style_bank), 'b' if style_bank.a2b else 'a', opts['style_bank']))
+
+	return {'translators': translators, 'style_bank': style_bank, 'config': config, 'device': device}
+
+@runway.metrics
+def metrics(model):
+	# hit rates and memory of the content cache, shared by both directions, and of the style cache of each direction
+	translators = model['translators']
+	return {'content_cache': list(translators.values())[0].content_cache.stats(),
+	        'style_caches': {direction: translator.style_cache.stats() for direction, translator in translators.items()}}
+
+def parse_sizes(sizes):
+	# comma separated WIDTHxHEIGHT or SIZE entries -> list of (width, height)
+	parsed = []
+	for size in sizes.split(','):
+		if size.strip():
+			width, _, height = size.strip().lower().partition('x')
+			parsed.append((int(width), int(height or width)))
+	return parsed
+
+def get_translator(model, direction):
+	if direction not in model['translators']:
+		raise InvalidArgumentError('direction', 'the loaded generator does not translate {}'.format(direction))
+	return model['translators'][direction]
+
+def get_style_bank(model):
+	# the style bank and the translator its styles are meant for
+	style_bank = model['style_bank']
+	if style_bank is None:
+		raise InvalidArgumentError('style_bank', 'no style bank was given at setup, the bank commands are unavailable')
+	return style_bank, get_translator(model, 'a2b' if style_bank.a2b else 'b2a')
+
+def parse_seeds(seeds):
+	# comma separated style seeds, e.g. "1, 7, 42"
+	return [int(seed) for seed in seeds.split(',') if seed.strip()]
+
+def translate_batch(translator, images, styles):
+	# translate PIL images of the same batch_key with one [1, style_dim, 1, 1] style code each
+	if translator.needs_tiling(images[0]):
+		# images larger than tile_size are translated one at a time, tile by tile
+		outputs = torch.cat([translator.translate_tiled(image, styles[i:i + 1]) for i, image in enumerate(images)])
+	else:
+		content = translator.encode_images(images)
+		outputs = translator.decode(content, styles, [image.size for image in images])
+
+	return [
+        { 'image': image } for image in translator.postprocess_batch(outputs, [image.size for image in images])
+    ]
 
 @runway.command(name='generate',
                 inputs={ 'image': image(description='Input image'), 'style': number(default=1, min=0, max=1000, description='Style Seed') },
                 outputs={ 'image': image(description='Output image') },
-                description='Image translation with style seeding')
-def generate(model, args):
-	#start command here?
-	trainer = model['model']
-	config = model['config']
-	style_dim = config['gen']['style_dim']
-
-	image_in = args['image'].convert('RGB')
-
-	# replace this
-	num_style_start = args['style']
-	torch.manual_seed(num_style_start)
-	torch.cuda.manual_seed(num_style_start)
-	height,width = image_in.size
-	new_size = min(height,width)
-	# print(new_size)
-
-	trainer.cuda()
-	trainer.eval()
-	encode = trainer.gen_a.encode if a2b else trainer.gen_b.encode # encode function
-	# style_encode = trainer.gen_b.encode if a2b else trainer.gen_a.encode # encode function
-	decode = trainer.gen_b.decode if a2b else trainer.gen_a.decode # decode function
-
-	with torch.no_grad():
-	    transform = transforms.Compose([transforms.Resize(new_size),
-	                                    transforms.ToTensor(),
-	                                    transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))])
-	    image = Variable(transform(image_in).unsqueeze(0).cuda())
-	    #maybe for a future version?
-	    # style_image = Variable(transform(Image.open(style).convert('RGB')).unsqueeze(0).cuda()) if opts.style != '' else None
-
-	    # Start testing
-	    content, _ = encode(image)
-
-	    style_rand = Variable(torch.randn(num_style_start, style_dim, 1, 1).cuda())
-	    style = style_rand
-
-	    s = style[0].unsqueeze(0)
-	    outputs = decode(content, s)
-	    outputs = (outputs + 1) / 2.
+                description='Image translation with style seeding',
+                batched=True, max_batch_size=max_batch_size, max_batch_latency=max_batch_latency,
+                batch_key=lambda model, args: get_translator(model, 'a2b').batch_key(args['image']))
+def generate(model, args_list):
+	# concurrent requests for images of the same size, or padded to the same size bucket, arrive here together
+	# (see MUNIT_MAX_BATCH_SIZE)
+	translator = get_translator(model, 'a2b')
+	styles = translator.styles_from_seeds([args['style'] for args in args_list])
+	return translate_batch(translator, [args['image'] for args in args_list], styles)
+
+@runway.command(name='generate_b2a',
+                inputs={ 'image': image(description='Input image of domain B'), 'style': number(default=1, min=0, max=1000, description='Style Seed') },
+                outputs={ 'image': image(description='Output image') },
+                description='B to A image translation with style seeding',
+                batched=True, max_batch_size=max_batch_size, max_batch_latency=max_batch_latency,
+                batch_key=lambda model, args: get_translator(model, 'b2a').batch_key(args['image']))
+def generate_b2a(model, args_list):
+	translator = get_translator(model, 'b2a')
+	styles = translator.styles_from_seeds([args['style'] for args in args_list])
+	return translate_batch(translator, [args['image'] for args in args_list], styles)
+
+@runway.command(name='generate_from_style',
+                inputs={ 'image': image(description='Input image'),
+                         'style_image': image(description='Reference image of the target domain, whose style is applied to the input image'),
+                         'direction': category(choices=['a2b', 'b2a'], default='a2b', description='Translation direction') },
+                outputs={ 'image': image(description='Output image') },
+                description='Image translation with the style of a reference image',
+                batched=True, max_batch_size=max_batch_size, max_batch_latency=max_batch_latency,
+                batch_key=lambda model, args: (args['direction'], get_translator(model, args['direction']).batch_key(args['image'])))
+def generate_from_style(model, args_list):
+	# style codes of reference images are cached, so reusing a reference only runs the content encoder and decoder
+	translator = get_translator(model, args_list[0]['direction'])
+	styles = translator.styles_from_images([args['style_image'] for args in args_list])
+	return translate_batch(translator, [args['image'] for args in args_list], styles)
+
+@runway.command(name='generate_from_bank',
+                inputs={ 'image': image(description='Input image'), 'style_index': number(default=0, min=0, step=1, description='Index of a style of the style bank') },
+                outputs={ 'image': image(description='Output image'), 'style_thumbnail': image(description='Thumbnail of the reference image of the style') },
+                description='Image translation with a precomputed style of the style bank',
+                batched=True, max_batch_size=max_batch_size, max_batch_latency=max_batch_latency,
+                batch_key=lambda model, args: get_style_bank(model)[1].batch_key(args['image']))
+def generate_from_bank(model, args_list):
+	# bank styles are precomputed, so this only runs the content encoder and decoder
+	style_bank, translator = get_style_bank(model)
+	indices = [args['style_index'] for args in args_list]
+	# every index is checked before decoding; a batch that fails is rerun request by request, so a bad index
+	# only fails its own request
+	for index in indices:
+		if not style_bank.has_index(index):
+			raise InvalidArgumentError('style_index', 'the style bank holds {} styles, indexed from 0 to {}'.format(len(style_bank), len(style_bank) - 1))
+	outputs = translate_batch(translator, [args['image'] for args in args_list], style_bank.styles_at(indices))
+	for output, index in zip(outputs, indices):
+		output['style_thumbnail'] = style_bank.thumbnail(index)
+	return outputs
+
+@runway.command(name='generate_from_nearest_style',
+                inputs={ 'image': image(description='Input image'), 'query_image': image(description='Image whose closest style of the style bank is applied') },
+                outputs={ 'image': image(description='Output image'), 'style_index': number(description='Index of the closest bank style'),
+                          'style_thumbnail': image(description='Thumbnail of the reference image of the closest style') },
+                description='Image translation with the style bank entry closest to the style of a query image',
+                batched=True, max_batch_size=max_batch_size, max_batch_latency=max_batch_latency,
+                batch_key=lambda model, args: get_style_bank(model)[1].batch_key(args['image']))
+def generate_from_nearest_style(model, args_list):
+	# queries are encoded like the bank images were, then matched against all bank styles in one distance computation
+	style_bank, translator = get_style_bank(model)
+	queries = translator.styles_from_images([style_bank.fit(args['query_image'].convert('RGB')) for args in args_list])
+	indices = style_bank.nearest(queries)
+	outputs = translate_batch(translator, [args['image'] for args in args_list], style_bank.styles_at(indices))
+	for output, index in zip(outputs, indices):
+		output['style_index'] = index
+		output['style_thumbnail'] = style_bank.thumbnail(index)
+	return outputs
+
+@runway.command(name='generate_styles',
+                inputs={ 'image': image(description='Input image'),
+                         'seeds': text(default='', description='Comma separated style seeds, e.g. "1, 7, 42". Overrides style and count when set.'),
+                         'style': number(default=1, min=0, max=1000, description='First style seed when no seeds are given'),
+                         'count': number(default=4, min=1, max=16, step=1, description='Number of consecutive style seeds when no seeds are given') ,
+                         'direction': category(choices=['a2b', 'b2a'], default='a2b', description='Translation direction') },
+                outputs={ 'images': array(item_type=image, description='One output image per style seed') },
+                description='Image translation of one image with several style seeds in a single batched pass')
+def generate_styles(model, args):
+	translator = get_translator(model, args['direction'])
+
+	if args['seeds'].strip():
+		seeds = parse_seeds(args['seeds'])
+	else:
+		seeds = range(int(args['style']), int(args['style']) + int(args['count']))
+
+	# encode the content once, decode it against all style codes in one batch. Images larger than tile_size are
+	# translated tile by tile, once per style
+	styles = translator.styles_from_seeds(seeds)
+	outputs = torch.cat(list(translator.iter_translate_styles(args['image'], styles)))
 
 	return {
-        'image': transforms.ToPILImage()(outputs.cpu().squeeze_(0)).convert("RGB")
-    }  
+        'images': translator.postprocess_batch(outputs, [args['image'].size] * len(outputs))
+    }
+
+@runway.command(name='interpolate',
+                inputs={ 'image': image(description='Input image'),
+                         'seeds': text(default='1, 2', description='Comma separated style seeds of the keyframes, at least two, e.g. "1, 7, 42, 1" for a loop'),
+                         'frames_per_transition': number(default=16, min=1, max=120, step=1, description='Frames from one keyframe to the next'),
+                         'chunk_size': number(default=8, min=1, max=64, step=1, description='Frames decoded per batch'),
+                         'direction': category(choices=['a2b', 'b2a'], default='a2b', description='Translation direction') },
+                outputs={ 'image': image(description='Frame of the interpolation sequence'), 'frame': number(description='Index of the frame') },
+                description='Streams the frames of a style interpolation of one image, slerping between keyframe style seeds')
+def interpolate(model, args):
+	translator = get_translator(model, args['direction'])
+	seeds = parse_seeds(args['seeds'])
+	if len(seeds) < 2:
+		raise InvalidArgumentError('seeds', 'interpolation needs at least two keyframe seeds')
+
+	# encode the content once, then decode the frames in batches and stream each frame as soon as its batch is done.
+	# Images larger than tile_size are translated tile by tile, one frame at a time.
+	styles = interpolation_path(translator.styles_from_seeds(seeds), int(args['frames_per_transition']))
+	frame = 0
+	for outputs in translator.iter_translate_styles(args['image'], styles, int(args['chunk_size'])):
+		for output in translator.postprocess_batch(outputs, [args['image'].size] * len(outputs)):
+			frame += 1
+			yield { 'image': output, 'frame': frame - 1 }, float(frame) / styles.size(0)
 
 if __name__ == '__main__':
     runway.run(host='0.0.0.0', port=8000, debug=True)  
-
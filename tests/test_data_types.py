@@ -404,7 +404,7 @@ def test_image_serialize_and_deserialize():
 
     serialize_np_img = image(channels=1).serialize(np.asarray(img))
     img = serialize_np_img[serialize_np_img.find(",")+1:]
-    img = base64.decodestring(img.encode('utf8'))
+    img = base64.decodebytes(img.encode('utf8'))
     buffer = IO(img)
     deserialized_image = Image.open(buffer)
     assert(deserialized_image.mode == 'L')
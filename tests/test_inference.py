@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+# Ensure that the local version of the MUNIT modules is used
+import sys
+sys.path.insert(0, '..')
+sys.path.insert(0, '.')
+
+import io
+import json
+import numpy as np
+import os
+import pytest
+import threading
+import torch
+import torch.nn.functional as F
+from PIL import Image
+from torch import nn
+from runway.exceptions import InvalidArgumentError
+from networks import AdaINGen, AdaptiveInstanceNorm2d, Conv2dBlock, InstanceNorm2d
+from inference import ExportedTranslator, InferenceGenerator, LRUCache, NormStatistics, StyleBank, Translator, \
+    interpolation_path, load_inference_generators, load_quantized_generator, load_torchscript_generator, psnr, \
+    quantize_generator, slerp, ssim, tile_starts
+
+DIRECTORY = os.path.dirname(os.path.realpath(__file__))
+
+GEN_PARAMS = {'dim': 16, 'mlp_dim': 32, 'style_dim': 8, 'activ': 'relu', 'n_downsample': 2, 'n_res': 2, 'pad_type': 'reflect'}
+
+def make_translator(**kwargs):
+    torch.manual_seed(0)
+    return Translator(InferenceGenerator(3, 3, GEN_PARAMS), torch.device('cpu'), **kwargs)
+
+def test_norm_statistics_replay_matches_forward():
+    translator = make_translator()
+    images = torch.randn(1, 3, 32, 48)
+    style = torch.randn(1, 8, 1, 1)
+    statistics = NormStatistics(translator.generator)
+    with torch.no_grad():
+        expected = translator.translate(images, style)
+        with statistics.record():
+            translator.translate(images, style)
+        with statistics.apply():
+            replayed = translator.translate(images, style)
+    assert len(statistics.stats) == len(statistics.layers)
+    assert torch.allclose(replayed, expected, atol=1e-5)
+
+def test_tile_starts_cover_the_image():
+    assert tile_starts(100, 128, 96) == [0]
+    assert tile_starts(300, 128, 96) == [0, 96, 172]
+
+def test_translate_tiled_single_tile_matches_translate():
+    translator = make_translator(tile_size=64, tile_overlap=16)
+    image = Image.open(os.path.join(DIRECTORY, 'test_image.jpg')).resize((64, 48))
+    style = translator.style_from_seed(1)
+    assert not translator.needs_tiling(image)
+    expected = translator.translate(translator.preprocess(image), style)
+    assert torch.allclose(translator.translate_tiled(image, style), expected, atol=1e-5)
+
+def test_translate_tiled_output_size():
+    translator = make_translator(tile_size=64, tile_overlap=16)
+    image = Image.open(os.path.join(DIRECTORY, 'test_image.jpg')).resize((150, 101))
+    assert translator.needs_tiling(image)
+    outputs = translator.translate_tiled(image, translator.style_from_seed(1))
+    assert outputs.shape == (1, 3, 100, 148)
+    assert outputs.abs().max() <= 1
+
+def test_translate_tiled_multi_tile_stays_close_to_translate():
+    image = Image.open(os.path.join(DIRECTORY, 'test_image.jpg')).resize((200, 160))
+    results = []
+    for overlap in [16, 32]:
+        translator = make_translator(tile_size=64, tile_overlap=overlap)
+        style = translator.style_from_seed(1)
+        expected = translator.translate(translator.preprocess(image), style)
+        outputs = translator.translate_tiled(image, style)
+        results.append((psnr(outputs, expected).item(), ssim(outputs, expected).item()))
+        if overlap == 16:
+            # no seams: the error where neighbouring tiles are blended is not much above the error inside tiles
+            error = (outputs - expected).abs().mean(1)[0]
+            seams = torch.zeros(200, dtype=torch.bool)
+            for x in tile_starts(200, 64, 48)[1:]:
+                seams[x:x + 16] = True
+            assert error[:, seams].mean() < 1.5 * error[:, ~seams].mean()
+    assert results[0][0] > 31 and results[0][1] > 0.8
+    assert results[1][0] > results[0][0] and results[1][1] > 0.85
+
+def test_translate_styles_tiles_large_images():
+    translator = make_translator(tile_size=64, tile_overlap=16)
+    styles = translator.styles_from_seeds([1, 2, 3])
+    large = Image.fromarray(np.random.RandomState(0).randint(0, 256, (80, 100, 3), dtype=np.uint8))
+    outputs = list(translator.iter_translate_styles(large, styles, chunk_size=2))
+    # one tiled pass per style, which never puts the whole image through the generator
+    assert [output.shape for output in outputs] == [(1, 3, 80, 100)] * 3
+    for i, output in enumerate(outputs):
+        assert torch.equal(output, translator.translate_tiled(large, styles[i:i + 1]))
+    small = large.resize((48, 40))
+    outputs = list(translator.iter_translate_styles(small, styles, chunk_size=2))
+    assert [output.size(0) for output in outputs] == [2, 1]
+    assert torch.allclose(torch.cat(outputs), translator.decode_styles(translator.encode_image(small), styles), atol=1e-6)
+
+def test_psnr_and_ssim_of_identical_and_noisy_images():
+    torch.manual_seed(0)
+    images = torch.rand(2, 3, 32, 32) * 2 - 1
+    noisy = images + 0.1 * torch.randn_like(images)
+    assert torch.all(ssim(images, images) > 0.999)
+    assert torch.all(psnr(noisy, images) < psnr(images + 0.01 * torch.randn_like(images), images))
+    assert torch.all(ssim(noisy, images) < 1)
+
+def test_reduced_precision_matches_fp32():
+    # make_translator seeds the weights, so both translators share them
+    fp32 = make_translator()
+    reduced = make_translator(precision='reduced')
+    for path in ['test_image.jpg', 'test_segmentation_colormap.png']:
+        image = Image.open(os.path.join(DIRECTORY, path)).resize((64, 64))
+        images = fp32.preprocess(image)
+        style = fp32.style_from_seed(1)
+        expected = fp32.translate(images, style)
+        outputs = reduced.translate(images, style)
+        assert outputs.dtype == torch.float32
+        assert psnr(outputs, expected).item() > 35
+        assert ssim(outputs, expected).item() > 0.98
+
+@pytest.mark.skipif(not set(['x86', 'fbgemm']) & set(torch.backends.quantized.supported_engines),
+                    reason='no x86 quantized engine')
+def test_quantized_generator_roundtrip():
+    backend = 'x86' if 'x86' in torch.backends.quantized.supported_engines else 'fbgemm'
+    fp32 = make_translator()
+    images = torch.stack([fp32.preprocess(Image.open(os.path.join(DIRECTORY, path)).resize((64, 64)))[0]
+                          for path in ['test_image.jpg', 'test_segmentation_colormap.png']])
+    styles = fp32.styles_from_seeds([1, 2])
+    quantized = quantize_generator(make_translator().generator, [(images, styles)], backend)
+    buffer = io.BytesIO()
+    torch.save({'config': {'input_dim_a': 3, 'input_dim_b': 3, 'gen': GEN_PARAMS}, 'a2b': True,
+                'state_dict': quantized.state_dict(), 'quantization': {'backend': backend}}, buffer)
+    buffer.seek(0)
+    loaded = load_quantized_generator(torch.load(buffer), torch.device('cpu'))
+    with torch.no_grad():
+        outputs = quantized.decode(quantized.encode_content(images), styles)
+        assert torch.equal(loaded.decode(loaded.encode_content(images), styles), outputs)
+    assert torch.all(psnr(outputs, fp32.translate(images, styles)) > 20)
+
+def test_torchscript_export_matches_eager(tmp_path):
+    module = ExportedTranslator(make_translator().generator)
+    images, styles = torch.randn(1, 3, 32, 32), torch.randn(1, 8, 1, 1)
+    with torch.no_grad():
+        traced = torch.jit.trace_module(module, {'forward': (images, styles), 'encode_content': (images,),
+                                                 'decode': (module.encode_content(images), styles)})
+    path = str(tmp_path / 'a2b.pt')
+    torch.jit.save(traced, path, _extra_files={'config.json': json.dumps({'gen': GEN_PARAMS, 'a2b': True})})
+    translator = Translator(load_torchscript_generator(path, torch.device('cpu')), torch.device('cpu'))
+    images, styles = torch.randn(2, 3, 48, 40), torch.randn(2, 8, 1, 1)
+    with torch.no_grad():
+        assert torch.allclose(translator.translate(images, styles), module(images, styles), atol=1e-6)
+    assert translator.style_dim == 8
+
+def test_onnx_export_matches_pytorch(tmp_path):
+    pytest.importorskip('onnxruntime')
+    from export import export_onnx
+    from inference import load_onnx_generator
+    module = ExportedTranslator(make_translator().generator).eval()
+    path = str(tmp_path / 'a2b')
+    export_onnx(module, torch.randn(1, 3, 32, 32), torch.randn(1, 8, 1, 1), path)
+    assert sorted(p.name for p in (tmp_path / 'a2b').iterdir()) == ['decoder.onnx', 'encoder.onnx']
+    # the export-only AdaIN layers are swapped back
+    assert all(type(m) is AdaptiveInstanceNorm2d for m in module.modules() if isinstance(m, AdaptiveInstanceNorm2d))
+    translator = Translator(load_onnx_generator(path, torch.device('cpu')), torch.device('cpu'))
+    assert translator.style_dim == 8
+    for shape in [(1, 3, 32, 32), (3, 3, 56, 40)]:
+        images, styles = torch.randn(*shape), torch.randn(shape[0], 8, 1, 1)
+        with torch.no_grad():
+            content = translator.generator.encode_content(images)
+            assert torch.allclose(content, module.encode_content(images), atol=1e-5)
+            assert torch.allclose(translator.generator.decode(content, styles), module(images, styles), atol=1e-5)
+            assert torch.allclose(translator.translate(images, styles), module(images, styles), atol=1e-5)
+
+def test_onnx_content_cache_skips_the_encoder(tmp_path):
+    pytest.importorskip('onnxruntime')
+    from export import export_onnx
+    from inference import load_onnx_generator
+    module = ExportedTranslator(make_translator().generator).eval()
+    path = str(tmp_path / 'a2b')
+    export_onnx(module, torch.randn(1, 3, 32, 32), torch.randn(1, 8, 1, 1), path)
+    translator = Translator(load_onnx_generator(path, torch.device('cpu')), torch.device('cpu'))
+    image = Image.new('RGB', (40, 32), (200, 30, 90))
+    content = translator.encode_image(image)
+    # the cached code is the content code, not the image
+    with torch.no_grad():
+        assert torch.allclose(content, module.encode_content(translator.preprocess(image)), atol=1e-5)
+    translator.generator.encode_content = None
+    assert torch.equal(translator.encode_image(image), content)
+
+def test_bidirectional_generators_match_adain_gens_without_sharing_weights(tmp_path):
+    torch.manual_seed(0)
+    gen_a, gen_b = AdaINGen(3, GEN_PARAMS).eval(), AdaINGen(3, GEN_PARAMS).eval()
+    path = str(tmp_path / 'gen.pt')
+    torch.save({'a': gen_a.state_dict(), 'b': gen_b.state_dict()}, path)
+    config = {'input_dim_a': 3, 'input_dim_b': 3, 'gen': GEN_PARAMS}
+    generators = load_inference_generators(path, config, torch.device('cpu'), style_encoder=True)
+    assert list(generators) == ['a2b', 'b2a']
+    pointers = [set(p.data_ptr() for p in generator.parameters()) for generator in generators.values()]
+    assert not pointers[0] & pointers[1]
+    images, references = torch.randn(2, 3, 32, 32), torch.randn(2, 3, 40, 24)
+    with torch.no_grad():
+        for (direction, generator), (src, dst) in zip(generators.items(), [(gen_a, gen_b), (gen_b, gen_a)]):
+            assert generator.a2b == (direction == 'a2b')
+            styles = generator.encode_style(references)
+            assert torch.equal(styles, dst.encode_style(references))
+            expected = dst.decode(src.encode_content(images), styles)
+            assert torch.allclose(generator.decode(generator.encode_content(images), styles), expected, atol=1e-6)
+
+def test_inference_generator_holds_the_halves_of_two_domains():
+    # a 1-channel source and a 3-channel target: each part is built for its own domain, with AdaINGen's names
+    generator = InferenceGenerator(1, 3, GEN_PARAMS, style_encoder=True)
+    assert set(generator.state_dict()) <= set(AdaINGen(3, GEN_PARAMS).state_dict())
+    assert generator.dec.fused_upsample
+    with torch.no_grad():
+        styles = generator.encode_style(torch.randn(2, 3, 32, 32))
+        assert generator.decode(generator.encode_content(torch.randn(2, 1, 32, 32)), styles).shape == (2, 3, 32, 32)
+    assert not hasattr(InferenceGenerator(1, 3, GEN_PARAMS), 'enc_style')
+
+def test_group_norm_kernel_is_scoped_to_the_inference_generator():
+    def content_norms(generator):
+        return [type(m.norm) for m in generator.enc_content.modules() if isinstance(m, Conv2dBlock) and m.norm is not None]
+    # training keeps nn.InstanceNorm2d, only the inference generator swaps in the group norm kernel
+    assert set(content_norms(AdaINGen(3, GEN_PARAMS))) == {nn.InstanceNorm2d}
+    assert set(content_norms(make_translator().generator)) == {InstanceNorm2d}
+
+def test_lru_cache_evicts_by_count():
+    cache = LRUCache(max_items=2)
+    a, b, c = torch.zeros(1), torch.ones(1), torch.ones(2)
+    cache.put('a', a)
+    cache.put('b', b)
+    # reading a makes b the least recently used entry
+    assert cache.get('a') is a
+    cache.put('c', c)
+    assert cache.get('b') is None and cache.get('a') is a and cache.get('c') is c
+    assert cache.stats() == {'items': 2, 'bytes': 12, 'hits': 3, 'misses': 1, 'hit_rate': 0.75}
+
+def test_lru_cache_evicts_by_bytes_and_skips_oversize_items():
+    cache = LRUCache(max_items=8, max_bytes=40)
+    for key in range(4):
+        cache.put(key, torch.zeros(3))
+    # 4 x 12 bytes do not fit in 40, so the oldest entry is evicted
+    assert len(cache) == 3 and cache.get(0) is None and cache.stats()['bytes'] == 36
+    # replacing an entry releases its bytes first
+    cache.put(3, torch.zeros(2))
+    assert len(cache) == 3 and cache.stats()['bytes'] == 32
+    # an item larger than the whole budget is not cached and evicts nothing
+    cache.put('large', torch.zeros(11))
+    assert cache.get('large') is None and len(cache) == 3 and cache.stats()['bytes'] == 32
+    assert LRUCache(max_items=0).stats()['hit_rate'] == 0.
+    disabled = LRUCache(max_items=0)
+    disabled.put('a', torch.zeros(1))
+    assert len(disabled) == 0
+
+def test_directions_share_one_content_cache():
+    torch.manual_seed(0)
+    cache = LRUCache(max_items=4)
+    translators = []
+    for a2b in [True, False]:
+        generator = InferenceGenerator(3, 3, GEN_PARAMS)
+        generator.a2b = a2b
+        translators.append(Translator(generator, torch.device('cpu'), content_cache=cache))
+    image = Image.fromarray(np.random.RandomState(0).randint(0, 256, (32, 32, 3), dtype=np.uint8))
+    contents = [translator.encode_image(image) for translator in translators]
+    # the same image gets an entry per direction, each encoded by its own content encoder
+    assert len(cache) == 2 and not torch.equal(contents[0], contents[1])
+    assert [translator.encode_image(image) is content for translator, content in zip(translators, contents)] == [True, True]
+    assert cache.stats()['hits'] == 2
+
+def test_style_from_seed_mapping_is_pinned():
+    # a seed maps to the first randn row of a CPU generator seeded with it; seed 1 keeps its old style
+    pinned = {0: [1.5410, -0.2934, -2.1788, 0.5684, -1.0845, -1.3986, 0.4033, 0.8380],
+              1: [0.6614, 0.2669, 0.0617, 0.6213, -0.4519, -0.1661, -1.5228, 0.3817],
+              2: [0.3923, -0.2236, -0.3195, -1.2050, 1.0445, -0.6332, 0.5731, 0.5409],
+              42: [0.3367, 0.1288, 0.2345, 0.2303, -1.1229, -0.1863, 2.2082, -0.6380],
+              1000: [-1.1720, -0.3929, 0.5265, 1.1065, 0.9273, -1.7421, -0.7699, 0.7864]}
+    translator = make_translator()
+    for seed, style in pinned.items():
+        assert torch.allclose(translator.style_from_seed(seed).view(-1), torch.tensor(style), atol=1e-4)
+
+def test_style_from_seed_is_deterministic_and_isolated_from_the_global_rng():
+    styles = [make_translator().style_from_seed(seed) for seed in [0, 1, 7]]
+    translator = make_translator(style_cache_size=0)
+    torch.manual_seed(123)
+    state = torch.get_rng_state()
+    for seed, style in zip([0, 1, 7], styles):
+        assert torch.equal(translator.style_from_seed(seed), style)
+    # drawing styles neither reads nor advances the global RNG
+    assert torch.equal(torch.get_rng_state(), state)
+    assert not torch.equal(styles[1], styles[2])
+
+def test_decode_styles_matches_per_seed_translate():
+    # what generate_styles returns for a list of seeds, against one generate call per seed
+    translator = make_translator()
+    image = Image.fromarray(np.random.RandomState(0).randint(0, 256, (40, 56, 3), dtype=np.uint8))
+    seeds = [1, 7, 42, 3, 1000]
+    content = translator.encode_image(image)
+    outputs = translator.decode_styles(content, translator.styles_from_seeds(seeds), chunk_size=2, size=image.size)
+    assert outputs.shape == (len(seeds), 3, 40, 56)
+    for output, seed in zip(outputs, seeds):
+        expected = translator.translate(translator.preprocess(image), translator.style_from_seed(seed))
+        assert torch.allclose(output, expected[0], atol=1e-5)
+
+def test_style_from_image_is_cached():
+    torch.manual_seed(0)
+    translator = Translator(InferenceGenerator(3, 3, GEN_PARAMS, style_encoder=True), torch.device('cpu'))
+    reference = Image.new('RGB', (40, 24), (10, 200, 30))
+    style = translator.style_from_image(reference)
+    assert style.shape == (1, 8, 1, 1)
+    with torch.no_grad():
+        assert torch.allclose(style, translator.generator.encode_style(translator.preprocess(reference)))
+    assert translator.style_from_image(reference.copy()) is style
+    assert translator.style_cache.stats()['hits'] == 1
+    assert not make_translator().has_style_encoder()
+    with pytest.raises(InvalidArgumentError) as error:
+        make_translator().style_from_image(reference)
+    assert error.value.code == 400
+
+def test_style_bank_roundtrip_and_nearest_lookup(tmp_path):
+    from build_style_bank import BankTransform, build_style_bank
+    from data import ImageFolder
+    torch.manual_seed(0)
+    translator = Translator(InferenceGenerator(3, 3, GEN_PARAMS, style_encoder=True), torch.device('cpu'))
+    folder = tmp_path / 'images'
+    folder.mkdir()
+    images = [Image.new('RGB', (48 + 8 * i, 40), (40 * i, 255 - 60 * i, 90)) for i in range(4)]
+    for i, image in enumerate(images):
+        image.save(str(folder / ('%d.png' % i)))
+    dataset = ImageFolder(str(folder), transform=BankTransform(32, 16), return_paths=True)
+    assert build_style_bank(translator.generator.enc_style, dataset, str(tmp_path / 'bank'), 32, 16, batch_size=3) == 4
+    bank = StyleBank(str(tmp_path / 'bank'), torch.device('cpu'))
+    assert len(bank) == 4 and bank.a2b and bank.paths == ['0.png', '1.png', '2.png', '3.png']
+    queries = translator.styles_from_images([bank.fit(image) for image in images])
+    assert torch.allclose(bank.styles_at(range(4)), queries, atol=1e-6)
+    assert bank.nearest(queries[[2, 0]]) == [2, 0]
+    assert bank.thumbnail(1).size == (16, 16)
+    assert [bank.has_index(index) for index in [0, 3, 4, -1, 1.5]] == [True, True, False, False, False]
+    with pytest.raises(IndexError):
+        bank.styles_at([4])
+
+def test_slerp_is_vectorized_and_keeps_unit_norm():
+    torch.manual_seed(0)
+    low, high = F.normalize(torch.randn(3, 8), dim=-1), F.normalize(torch.randn(3, 8), dim=-1)
+    vals = torch.linspace(0, 1, 5)
+    grid = slerp(vals.unsqueeze(1), low, high)
+    assert grid.shape == (5, 3, 8)
+    assert torch.allclose(grid[0], low, atol=1e-6) and torch.allclose(grid[-1], high, atol=1e-6)
+    assert torch.allclose(grid.norm(dim=-1), torch.ones(5, 3), atol=1e-5)
+    assert torch.allclose(grid[2, 1], slerp(0.5, low[1], high[1]))
+    assert torch.allclose(slerp(0.25, low[0], 2 * low[0]), 1.25 * low[0])
+
+def test_interpolation_path_passes_through_keyframes():
+    keyframes = torch.randn(3, 8, 1, 1)
+    path = interpolation_path(keyframes, 4)
+    assert path.shape == (9, 8, 1, 1)
+    assert torch.allclose(path[[0, 4, 8]], keyframes, atol=1e-5)
+
+def test_channels_last_translator_matches_contiguous():
+    translator = make_translator()
+    images, styles = torch.randn(2, 3, 40, 48), torch.randn(2, 8, 1, 1)
+    expected = translator.translate(images, styles)
+    channels_last = Translator(translator.generator, torch.device('cpu'), channels_last=True)
+    outputs = channels_last.translate(images.contiguous(memory_format=torch.channels_last), styles)
+    assert outputs.is_contiguous(memory_format=torch.channels_last)
+    assert torch.allclose(outputs, expected, atol=1e-5)
+    assert channels_last.preprocess(Image.new('RGB', (8, 8))).is_contiguous(memory_format=torch.channels_last)
+    channels_last.warmup([(32, 32), (48, 40)], batch_size=2)
+
+def test_size_buckets_pad_and_crop_back():
+    translator = make_translator(size_buckets=[(64, 64), (48, 30), (96, 64)])
+    assert translator.size_buckets == [(48, 32), (64, 64), (96, 64)]
+    assert translator.bucket(40, 32) == (48, 32)
+    assert translator.bucket(50, 20) == (64, 64)
+    assert translator.bucket(100, 10) is None
+    images = torch.randn(2, 3, 30, 41)
+    padded = translator.pad_to_bucket(images)
+    assert padded.shape == (2, 3, 32, 48)
+    assert torch.equal(padded[:, :, :30, :41], images)
+    assert translator.pad_to_bucket(torch.randn(1, 3, 8, 8)).shape == (1, 3, 32, 48)
+    image = Image.new('RGB', (41, 30), (200, 30, 90))
+    outputs = translator.decode(translator.encode_image(image), torch.randn(1, 8, 1, 1))
+    assert outputs.shape == (1, 3, 32, 48)
+    assert translator.postprocess_batch(outputs, [image.size])[0].size == (41, 30)
+    assert [(w, h) for w, h, _ in translator.warmup([(40, 30), (45, 20), (200, 12)])] == [(48, 32), (200, 12)]
+
+def test_images_of_one_bucket_share_a_batch():
+    translator = make_translator(size_buckets=[(64, 64)], tile_size=96)
+    small, large = Image.new('RGB', (41, 30), (200, 30, 90)), Image.open(os.path.join(DIRECTORY, 'test_image.jpg')).resize((60, 52))
+    assert translator.batch_key(small) == translator.batch_key(large) == (64, 64)
+    assert translator.batch_key(Image.new('RGB', (70, 40))) == (70, 40)
+    assert translator.batch_key(Image.new('RGB', (100, 40))) == ('tiled', (100, 40))
+    styles = translator.styles_from_seeds([1, 2])
+    # each image of the batch is normalized with the statistics of its own unpadded region
+    outputs = translator.decode(translator.encode_images([small, large]), styles, [small.size, large.size])
+    alone = Translator(translator.generator, torch.device('cpu'), size_buckets=[(64, 64)])
+    for i, image in enumerate([small, large]):
+        expected = alone.decode(alone.encode_image(image), styles[i:i + 1], image.size)
+        assert torch.allclose(outputs[i:i + 1], expected, atol=1e-5)
+
+def test_norm_statistics_only_act_in_their_own_thread():
+    translator = make_translator(size_buckets=[(48, 48)])
+    hooks = [len(m._forward_hooks) for m in translator.generator.modules()]
+    images, style = torch.randn(1, 3, 48, 48), translator.style_from_seed(1)
+    expected = translator.translate(images, style)
+    outputs = {}
+    with NormStatistics(translator.generator).region(0.5, 0.5):
+        # a translation of another thread meanwhile uses the plain norm layers
+        thread = threading.Thread(target=lambda: outputs.update(other=translator.translate(images, style)))
+        thread.start()
+        thread.join()
+        outputs['region'] = translator.translate(images, style)
+    assert torch.equal(outputs['other'], expected)
+    assert not torch.allclose(outputs['region'], expected, atol=1e-3)
+    assert torch.equal(translator.translate(images, style), expected)
+    # bucketed encodes and decodes do not register hooks of their own
+    image = Image.new('RGB', (41, 30), (200, 30, 90))
+    translator.decode(translator.encode_image(image), style, image.size)
+    assert [len(m._forward_hooks) for m in translator.generator.modules()] == hooks
+
+def test_size_buckets_stay_close_to_unbucketed_translation():
+    # the padding reaches the pixels near the padded edges through the convolutions, but not the norm statistics
+    translator = make_translator(size_buckets=[(64, 64)])
+    unbucketed = Translator(translator.generator, torch.device('cpu'))
+    image = Image.open(os.path.join(DIRECTORY, 'test_image.jpg')).resize((44, 40))
+    style = translator.style_from_seed(1)
+    expected = unbucketed.translate(unbucketed.preprocess(image), style)
+    outputs = translator.decode(translator.encode_image(image), style, image.size)[:, :, :40, :44]
+    padded = translator.translate(translator.pad_to_bucket(translator.preprocess(image)), style)[:, :, :40, :44]
+    assert psnr(outputs, expected).item() > 27.5 and ssim(outputs, expected).item() > 0.78
+    assert ssim(outputs, expected).item() > ssim(padded, expected).item() + 0.1
+    # every request reuses the statistics built with the translator, which keep no per-request state
+    assert not translator.norm_statistics.stats
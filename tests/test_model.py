@@ -21,6 +21,7 @@ from deepdiff import DeepDiff
 from flask import abort
 from multiprocessing import Process
 from io import BytesIO as IO
+import gevent
 
 from pytest_cov.embed import cleanup_on_sigterm
 cleanup_on_sigterm()
@@ -1016,3 +1017,209 @@ def test_gpu_in_manifest_gpu_env_false():
 
     os.environ['GPU'] = '0'
     assert get_manifest(client)['GPU'] == False
+
+def test_batched_command_collects_concurrent_requests():
+
+    rw = RunwayModel()
+    batches = []
+
+    @rw.command('test_command', inputs={ 'input': text }, outputs = { 'output': text },
+                batched=True, max_batch_size=3, max_batch_latency=1000)
+    def test_command(model, inputs_list):
+        batches.append([inputs['input'] for inputs in inputs_list])
+        return [{ 'output': inputs['input'].upper() } for inputs in inputs_list]
+
+    rw.run(debug=True)
+
+    client = get_test_client(rw)
+
+    # the batch is full before the 1 second latency budget runs out
+    start = time.time()
+    jobs = [gevent.spawn(client.post, '/test_command', json={ 'input': value }) for value in ['a', 'b', 'c']]
+    gevent.joinall(jobs)
+    assert time.time() - start < 1
+    assert batches == [['a', 'b', 'c']]
+    assert [job.value.json['output'] for job in jobs] == ['A', 'B', 'C']
+
+def test_batched_command_flushes_after_max_latency():
+
+    rw = RunwayModel()
+    batches = []
+
+    @rw.command('test_command', inputs={ 'input': text }, outputs = { 'output': text },
+                batched=True, max_batch_size=8, max_batch_latency=20)
+    def test_command(model, inputs_list):
+        batches.append(len(inputs_list))
+        return [{ 'output': inputs['input'] } for inputs in inputs_list]
+
+    rw.run(debug=True)
+
+    client = get_test_client(rw)
+
+    jobs = [gevent.spawn(client.post, '/test_command', json={ 'input': value }) for value in ['a', 'b']]
+    gevent.joinall(jobs)
+    assert batches == [2]
+    assert [job.value.json['output'] for job in jobs] == ['a', 'b']
+
+def test_batched_command_groups_by_batch_key():
+
+    rw = RunwayModel()
+    batches = []
+
+    @rw.command('test_command', inputs={ 'input': text }, outputs = { 'output': text },
+                batched=True, max_batch_size=2, max_batch_latency=1000, batch_key=lambda model, inputs: len(inputs['input']))
+    def test_command(model, inputs_list):
+        batches.append([inputs['input'] for inputs in inputs_list])
+        return [{ 'output': inputs['input'] } for inputs in inputs_list]
+
+    rw.run(debug=True)
+
+    client = get_test_client(rw)
+
+    jobs = [gevent.spawn(client.post, '/test_command', json={ 'input': value }) for value in ['a', 'bb', 'c', 'dd']]
+    gevent.joinall(jobs)
+    assert sorted(batches) == [['a', 'c'], ['bb', 'dd']]
+    assert [job.value.json['output'] for job in jobs] == ['a', 'bb', 'c', 'dd']
+
+def test_batched_command_max_batch_size_one():
+
+    rw = RunwayModel()
+    batches = []
+
+    @rw.command('test_command', inputs={ 'input': text }, outputs = { 'output': text }, batched=True)
+    def test_command(model, inputs_list):
+        batches.append(len(inputs_list))
+        return [{ 'output': inputs['input'] } for inputs in inputs_list]
+
+    rw.run(debug=True)
+
+    client = get_test_client(rw)
+
+    for value in ['a', 'b']:
+        response = client.post('/test_command', json={ 'input': value })
+        assert response.json['output'] == value
+    assert batches == [1, 1]
+
+def test_batched_command_error():
+
+    rw = RunwayModel()
+
+    @rw.command('test_command', inputs={ 'input': text }, outputs = { 'output': text },
+                batched=True, max_batch_size=2, max_batch_latency=1000)
+    def test_command(model, inputs_list):
+        raise Exception('test exception, thrown from inside a batched command() function')
+
+    rw.run(debug=True)
+
+    client = get_test_client(rw)
+
+    jobs = [gevent.spawn(client.post, '/test_command', json={ 'input': value }) for value in ['a', 'b']]
+    gevent.joinall(jobs)
+    for job in jobs:
+        assert job.value.is_json
+        assert 'InferenceError' in str(job.value.data)
+
+def test_batched_command_error_only_fails_bad_inputs():
+
+    rw = RunwayModel()
+    batches = []
+
+    @rw.command('test_command', inputs={ 'input': text }, outputs = { 'output': text },
+                batched=True, max_batch_size=3, max_batch_latency=1000)
+    def test_command(model, inputs_list):
+        batches.append([inputs['input'] for inputs in inputs_list])
+        for inputs in inputs_list:
+            if inputs['input'] == 'bad':
+                raise InvalidArgumentError('input', 'bad input')
+        return [{ 'output': inputs['input'].upper() } for inputs in inputs_list]
+
+    rw.run(debug=True)
+
+    client = get_test_client(rw)
+
+    jobs = [gevent.spawn(client.post, '/test_command', json={ 'input': value }) for value in ['a', 'bad', 'c']]
+    gevent.joinall(jobs)
+    # the failed batch is run again one call at a time
+    assert batches == [['a', 'bad', 'c'], ['a'], ['bad'], ['c']]
+    assert [job.value.status_code for job in jobs] == [200, 400, 200]
+    assert jobs[0].value.json['output'] == 'A' and jobs[2].value.json['output'] == 'C'
+    assert jobs[1].value.json['error'] == 'Invalid argument: input. bad input'
+
+def test_command_invalid_argument_error():
+
+    rw = RunwayModel()
+
+    @rw.command('test_command', inputs={ 'input': number }, outputs = { 'output': number })
+    def test_command(model, inputs):
+        raise InvalidArgumentError('input', 'out of range')
+
+    rw.run(debug=True)
+
+    client = get_test_client(rw)
+    response = client.post('/test_command', json={ 'input': 5 })
+    assert response.status_code == 400
+    assert response.json['error'] == 'Invalid argument: input. out of range'
+
+def test_batched_command_generator_function():
+
+    rw = RunwayModel()
+
+    with pytest.raises(Exception):
+        @rw.command('test_command', inputs={ 'input': text }, outputs = { 'output': text }, batched=True)
+        def test_command(model, inputs_list):
+            yield [{ 'output': 'hello' }]
+
+def test_metrics():
+
+    rw = RunwayModel()
+
+    @rw.command('batched_command', inputs={ 'input': text }, outputs = { 'output': text },
+                batched=True, max_batch_size=2, max_batch_latency=1000)
+    def batched_command(model, inputs_list):
+        return [{ 'output': inputs['input'] } for inputs in inputs_list]
+
+    @rw.command('test_command', inputs={ 'input': text }, outputs = { 'output': text })
+    def test_command(model, inputs):
+        return { 'output': inputs['input'] }
+
+    rw.run(debug=True)
+
+    client = get_test_client(rw)
+
+    jobs = [gevent.spawn(client.post, '/batched_command', json={ 'input': value }) for value in ['a', 'b', 'c', 'd']]
+    gevent.joinall(jobs)
+
+    response = client.get('/metrics')
+    assert response.is_json
+    assert response.json == {
+        'batching': {
+            'batched_command': {
+                'maxBatchSize': 2,
+                'maxBatchLatency': 1000,
+                'queueDepth': 0,
+                'maxQueueDepth': 2,
+                'batchesRun': 2,
+                'itemsRun': 4,
+                'meanBatchSize': 2
+            }
+        }
+    }
+
+def test_metrics_of_the_model():
+
+    rw = RunwayModel()
+
+    @rw.setup
+    def setup():
+        return { 'hits': 3 }
+
+    @rw.metrics
+    def metrics(model):
+        return { 'cache_hits': model['hits'] }
+
+    rw.run(debug=True)
+
+    client = get_test_client(rw)
+    response = client.get('/metrics')
+    assert response.is_json
+    assert response.json == { 'batching': {}, 'model': { 'cache_hits': 3 } }
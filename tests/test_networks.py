@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# Ensure that the local version of the MUNIT modules is used
+import sys
+sys.path.insert(0, '..')
+sys.path.insert(0, '.')
+
+import torch
+import torch.nn.functional as F
+import torch.nn as nn
+from networks import AdaINGen, AdaptiveInstanceNorm2d, Conv2dBlock, InstanceNorm2d, LayerNorm
+
+GEN_PARAMS = {'dim': 16, 'mlp_dim': 32, 'style_dim': 8, 'activ': 'relu', 'n_downsample': 2, 'n_res': 2, 'pad_type': 'reflect'}
+
+def test_batched_decode_uses_a_style_per_sample():
+    torch.manual_seed(0)
+    gen = AdaINGen(3, GEN_PARAMS).eval()
+    content = torch.randn(3, gen.enc_content.output_dim, 8, 8)
+    style = torch.randn(3, 8, 1, 1)
+    with torch.no_grad():
+        batched = gen.decode(content, style)
+        single = torch.cat([gen.decode(content[i:i + 1], style[i:i + 1]) for i in range(3)])
+    assert torch.allclose(batched, single, atol=1e-5)
+
+def test_decode_does_not_assign_adain_params():
+    torch.manual_seed(0)
+    gen = AdaINGen(3, GEN_PARAMS).eval()
+    content = torch.randn(1, gen.enc_content.output_dim, 8, 8)
+    with torch.no_grad():
+        gen.decode(content, torch.randn(1, 8, 1, 1))
+    assert all(m.weight is None and m.bias is None for m in gen.adain_layers)
+
+def test_decode_matches_assigned_adain_params():
+    torch.manual_seed(0)
+    gen = AdaINGen(3, GEN_PARAMS).eval()
+    content = torch.randn(2, gen.enc_content.output_dim, 8, 8)
+    style = torch.randn(2, 8, 1, 1)
+    with torch.no_grad():
+        gen.assign_adain_params(gen.mlp(style), gen.dec)
+        assigned = gen.dec(content)
+        functional = gen.decode(content, style)
+    assert torch.equal(assigned, functional)
+    assert sum(gen.adain_splits) == gen.get_num_adain_params(gen.dec)
+
+def batch_norm_adain(x, weight, bias, eps=1e-5):
+    # the original AdaIN implementation: instance norm as batch norm over a (1, B * C, H, W) view
+    b, c = x.size(0), x.size(1)
+    out = F.batch_norm(x.contiguous().view(1, b * c, *x.size()[2:]), torch.zeros(b * c), torch.ones(b * c),
+                       weight.contiguous().view(-1), bias.contiguous().view(-1), True, 0.1, eps)
+    return out.view(b, c, *x.size()[2:])
+
+def test_adain_matches_batch_norm_implementation():
+    torch.manual_seed(0)
+    norm = AdaptiveInstanceNorm2d(16)
+    for shape in [(1, 16, 32, 32), (4, 16, 17, 9)]:
+        x = torch.randn(*shape) * 3 + 1
+        mean, std = torch.randn(shape[0], 16), torch.randn(shape[0], 16)
+        expected = batch_norm_adain(x, std, mean)
+        assert torch.allclose(norm(x, (mean, std)), expected, atol=1e-5)
+        norm.bias, norm.weight = mean.view(-1), std.view(-1)
+        assert torch.allclose(norm(x), expected, atol=1e-5)
+
+def test_adain_leaves_dummy_buffers_untouched():
+    norm = AdaptiveInstanceNorm2d(8)
+    norm(torch.randn(2, 8, 4, 4) + 5, (torch.zeros(2, 8), torch.ones(2, 8)))
+    assert torch.equal(norm.running_mean, torch.zeros(8))
+    assert torch.equal(norm.running_var, torch.ones(8))
+
+def two_pass_layer_norm(x, gamma, beta, eps=1e-5):
+    # the original LayerNorm implementation: separate mean and unbiased std passes, eps added to the std
+    shape = [-1] + [1] * (x.dim() - 1)
+    mean = x.view(x.size(0), -1).mean(1).view(*shape)
+    std = x.view(x.size(0), -1).std(1).view(*shape)
+    x = (x - mean) / (std + eps)
+    shape = [1, -1] + [1] * (x.dim() - 2)
+    return x * gamma.view(*shape) + beta.view(*shape)
+
+def test_layer_norm_matches_two_pass_implementation():
+    torch.manual_seed(0)
+    norm = LayerNorm(16)
+    norm.beta.data.normal_()
+    for shape in [(1, 16, 32, 32), (3, 16, 9, 17)]:
+        x = torch.randn(*shape) * 2 + 0.5
+        assert torch.allclose(norm(x), two_pass_layer_norm(x, norm.gamma, norm.beta), atol=1e-5)
+
+def test_layer_norm_without_affine():
+    torch.manual_seed(0)
+    norm = LayerNorm(4, affine=False)
+    x = torch.randn(2, 4, 5, 5)
+    assert torch.allclose(norm(x), two_pass_layer_norm(x, torch.ones(4), torch.zeros(4)), atol=1e-5)
+
+def test_fused_upsample_conv_matches_upsample_then_conv():
+    torch.manual_seed(0)
+    for pad_type in ['reflect', 'zero', 'replicate']:
+        block = Conv2dBlock(6, 4, 5, 1, 2, norm='ln', activation='relu', pad_type=pad_type)
+        x = torch.randn(2, 6, 7, 9)
+        with torch.no_grad():
+            expected = block(F.interpolate(x, scale_factor=2))
+            assert torch.allclose(block.forward_upsampled(x), expected, atol=1e-5)
+
+def test_fused_upsample_caches_the_folded_weight_until_the_conv_changes():
+    torch.manual_seed(0)
+    block = Conv2dBlock(6, 4, 3, 1, 1, norm='none', activation='none', pad_type='reflect')
+    other = Conv2dBlock(6, 4, 3, 1, 1, norm='none', activation='none', pad_type='reflect')
+    x = torch.randn(2, 6, 7, 9)
+    with torch.no_grad():
+        weight = block.upsampled_weight()[0]
+        assert block.upsampled_weight()[0] is weight
+        block.load_state_dict(other.state_dict())
+        assert block.upsampled_weight()[0] is not weight
+        assert torch.allclose(block.forward_upsampled(x), other(F.interpolate(x, scale_factor=2)), atol=1e-5)
+        block.conv.bias.add_(1)
+        assert torch.allclose(block.forward_upsampled(x), other(F.interpolate(x, scale_factor=2)) + 1, atol=1e-5)
+    # while training, gradients reach the conv parameters
+    block.forward_upsampled(x).sum().backward()
+    assert block.conv.weight.grad is not None and block.conv.bias.grad is not None
+
+def test_fused_upsample_decoder_loads_checkpoint_and_matches():
+    torch.manual_seed(0)
+    gen = AdaINGen(3, GEN_PARAMS).eval()
+    fused = AdaINGen(3, GEN_PARAMS).eval()
+    fused.dec.fused_upsample = True
+    fused.load_state_dict(gen.state_dict())
+    content = torch.randn(2, gen.enc_content.output_dim, 8, 8)
+    style = torch.randn(2, 8, 1, 1)
+    with torch.no_grad():
+        assert torch.allclose(fused.decode(content, style), gen.decode(content, style), atol=1e-5)
+
+def test_instance_norm_matches_torch_and_keeps_channels_last():
+    torch.manual_seed(0)
+    x = torch.randn(3, 8, 9, 17) * 2 + 1
+    expected = nn.InstanceNorm2d(8)(x)
+    assert torch.allclose(InstanceNorm2d(8)(x), expected, atol=1e-5)
+    out = InstanceNorm2d(8)(x.contiguous(memory_format=torch.channels_last))
+    assert out.is_contiguous(memory_format=torch.channels_last)
+    assert torch.allclose(out, expected, atol=1e-5)
+
+def test_norms_keep_channels_last_batches():
+    torch.manual_seed(0)
+    for b in [1, 3]:
+        x = torch.randn(b, 16, 12, 10) * 3 + 1
+        xc = x.contiguous(memory_format=torch.channels_last)
+        mean, std = torch.randn(b, 16), torch.randn(b, 16)
+        norm = AdaptiveInstanceNorm2d(16)
+        out = norm(xc, (mean, std))
+        assert out.is_contiguous(memory_format=torch.channels_last)
+        assert torch.allclose(out, norm(x, (mean, std)), atol=1e-5)
+        layer_norm = LayerNorm(16)
+        out = layer_norm(xc)
+        assert out.is_contiguous(memory_format=torch.channels_last)
+        assert torch.allclose(out, layer_norm(x), atol=1e-5)
+
+def test_fold_padding_matches_padding_module():
+    torch.manual_seed(0)
+    for pad_type in ['zero', 'reflect']:
+        block = Conv2dBlock(6, 4, 5, 1, 2, norm='ln', activation='relu', pad_type=pad_type)
+        x = torch.randn(2, 6, 7, 9)
+        with torch.no_grad():
+            expected, upsampled = block(x), block.forward_upsampled(x)
+            block.fold_padding()
+            assert isinstance(block.pad, nn.Identity if pad_type == 'zero' else nn.ReflectionPad2d)
+            assert torch.allclose(block(x), expected, atol=1e-6)
+            assert torch.allclose(block.forward_upsampled(x), upsampled, atol=1e-6)
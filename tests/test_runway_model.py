@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# Ensure that the local version of the MUNIT modules is used
+import sys
+sys.path.insert(0, '..')
+sys.path.insert(0, '.')
+
+import copy
+import os
+import pytest
+import torch
+from PIL import Image
+from runway.data_types import image
+from networks import AdaINGen
+from inference import DEFAULT_CONFIG, Translator
+
+os.environ['RW_NO_SERVE'] = '1'
+
+import runway
+import runway_model
+
+CONFIG = copy.deepcopy(DEFAULT_CONFIG)
+CONFIG['gen'] = {'dim': 16, 'mlp_dim': 32, 'style_dim': 8, 'activ': 'relu', 'n_downsample': 2, 'n_res': 2, 'pad_type': 'reflect'}
+
+def encode(pil_image):
+    return image().serialize(pil_image)
+
+def decode(data):
+    return image().deserialize(data)
+
+@pytest.fixture(scope='module')
+def client(tmp_path_factory):
+    # runway_model.py served from a small random-weight checkpoint and a style bank built from its b style encoder
+    from build_style_bank import BankTransform, build_style_bank
+    from data import ImageFolder
+    tmp_path = tmp_path_factory.mktemp('runway_model')
+    torch.manual_seed(0)
+    gen_a, gen_b = AdaINGen(3, CONFIG['gen']).eval(), AdaINGen(3, CONFIG['gen']).eval()
+    torch.save({'a': gen_a.state_dict(), 'b': gen_b.state_dict()}, str(tmp_path / 'gen.pt'))
+    folder = tmp_path / 'images'
+    folder.mkdir()
+    for i in range(3):
+        Image.new('RGB', (40, 32), (60 * i, 200 - 50 * i, 90)).save(str(folder / ('%d.png' % i)))
+    dataset = ImageFolder(str(folder), transform=BankTransform(32, 16), return_paths=True)
+    with torch.no_grad():
+        build_style_bank(gen_b.enc_style, dataset, str(tmp_path / 'bank'), 32, 16)
+
+    default_config = runway_model.DEFAULT_CONFIG
+    runway_model.DEFAULT_CONFIG = CONFIG
+    rw = runway.__defaultmodel__
+    try:
+        rw.run(model_options={'generator_checkpoint': str(tmp_path / 'gen.pt'), 'device': 'cpu',
+                              'style_bank': str(tmp_path / 'bank')})
+    finally:
+        runway_model.DEFAULT_CONFIG = default_config
+    # the Flask test client, as in tests/utils.py, which the MUNIT utils.py shadows when run from the repo root
+    rw.app.config['TESTING'] = True
+    yield rw.app.test_client()
+
+def test_every_command_runs(client):
+    picture = Image.new('RGB', (44, 36), (200, 30, 90))
+    reference = Image.new('RGB', (40, 32), (10, 200, 30))
+    for command in ['generate', 'generate_b2a']:
+        response = client.post('/' + command, json={'image': encode(picture), 'style': 3})
+        assert response.status_code == 200
+        assert decode(response.json['image']).size == (44, 36)
+    for direction in ['a2b', 'b2a']:
+        response = client.post('/generate_from_style', json={'image': encode(picture), 'style_image': encode(reference),
+                                                             'direction': direction})
+        assert response.status_code == 200
+        assert decode(response.json['image']).size == (44, 36)
+    response = client.post('/generate_from_bank', json={'image': encode(picture), 'style_index': 2})
+    assert response.status_code == 200
+    assert decode(response.json['style_thumbnail']).size == (16, 16)
+    response = client.post('/generate_from_nearest_style', json={'image': encode(picture), 'query_image': encode(reference)})
+    assert response.status_code == 200
+    assert response.json['style_index'] in [0, 1, 2]
+    response = client.post('/generate_styles', json={'image': encode(picture), 'seeds': '1, 7, 42'})
+    assert response.status_code == 200
+    assert [decode(output).size for output in response.json['images']] == [(44, 36)] * 3
+    # the route returns the last frame of the stream
+    response = client.post('/interpolate', json={'image': encode(picture), 'seeds': '1, 2', 'frames_per_transition': 2})
+    assert response.status_code == 200
+    assert response.json['frame'] == 2
+
+def test_bad_requests_are_400_and_failures_are_500(client, monkeypatch):
+    picture = encode(Image.new('RGB', (44, 36), (200, 30, 90)))
+    model = runway.__defaultmodel__.model
+    assert client.post('/generate_from_bank', json={'image': picture, 'style_index': 3}).status_code == 400
+    assert client.post('/interpolate', json={'image': picture, 'seeds': '1'}).status_code == 400
+    # a direction or a style bank the model was not set up with
+    monkeypatch.delitem(model['translators'], 'b2a')
+    assert client.post('/generate_b2a', json={'image': picture}).status_code == 400
+    monkeypatch.setitem(model, 'style_bank', None)
+    assert client.post('/generate_from_bank', json={'image': picture}).status_code == 400
+    # errors raised while translating are the model's fault
+    def fail(*args, **kwargs):
+        raise RuntimeError('out of memory')
+    monkeypatch.setattr(Translator, 'decode', fail)
+    response = client.post('/generate', json={'image': picture})
+    assert response.status_code == 500
+    assert 'out of memory' in response.json['error']
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# Ensure that the local version of the MUNIT modules is used
+import sys
+sys.path.insert(0, '..')
+sys.path.insert(0, '.')
+
+import copy
+import importlib.util
+import os
+import pytest
+import torch
+from inference import DEFAULT_CONFIG
+
+def import_munit_module(name, filename):
+    # load a MUNIT module by path, like test_utils.py loads the MUNIT utils.py
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', filename)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def import_trainer():
+    # trainer.py imports the MUNIT utils.py, which the runway test helpers in tests/utils.py shadow, so the
+    # MUNIT one stands in for utils while trainer.py is loaded
+    test_utils = sys.modules.get('utils')
+    sys.modules['utils'] = import_munit_module('munit_utils', 'utils.py')
+    try:
+        return import_munit_module('trainer', 'trainer.py')
+    finally:
+        if test_utils is None:
+            sys.modules.pop('utils')
+        else:
+            sys.modules['utils'] = test_utils
+
+trainer = import_trainer()
+
+CONFIG = copy.deepcopy(DEFAULT_CONFIG)
+CONFIG['gen'] = dict(CONFIG['gen'], dim=8, mlp_dim=16, n_res=1)
+CONFIG['dis'] = dict(CONFIG['dis'], dim=8, n_layer=2, num_scales=2)
+CONFIG['display_size'] = 3
+
+def make_trainer(**kwargs):
+    torch.manual_seed(0)
+    return trainer.MUNIT_Trainer(dict(CONFIG, **kwargs))
+
+def test_save_and_resume_without_amp(tmp_path):
+    munit = make_trainer()
+    assert not munit.gen_scaler.is_enabled() and not munit.dis_scaler.is_enabled()
+    munit.save(str(tmp_path), 9)
+    state_dict = torch.load(str(tmp_path / 'optimizer.pt'))
+    assert set(state_dict) == {'gen', 'dis', 'gen_scaler', 'dis_scaler'}
+    assert state_dict['gen_scaler'] == state_dict['dis_scaler'] == {}
+    # the disabled scalers round-trip, and an fp32 checkpoint resumes with and without amp
+    resumed = make_trainer()
+    assert resumed.resume(str(tmp_path), CONFIG) == 10
+    assert resumed.gen_scaler.state_dict() == munit.gen_scaler.state_dict()
+    assert resumed.dis_scaler.state_dict() == munit.dis_scaler.state_dict()
+    assert make_trainer(amp=True).resume(str(tmp_path), CONFIG) == 10
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason='mixed precision training needs CUDA')
+def test_save_and_resume_restore_the_loss_scalers(tmp_path):
+    munit = make_trainer(amp=True).cuda()
+    for scaler, scale in [(munit.gen_scaler, 256.), (munit.dis_scaler, 32.)]:
+        scaler.scale(torch.ones((), device='cuda'))
+        scaler.update(scale)
+    munit.save(str(tmp_path), 0)
+    resumed = make_trainer(amp=True).cuda()
+    resumed.resume(str(tmp_path), CONFIG)
+    assert resumed.gen_scaler.get_scale() == 256. and resumed.dis_scaler.get_scale() == 32.
+
+def test_exact_fused_update_matches_separate_updates():
+    separate, fused = make_trainer(), make_trainer()
+    x_a, x_b = torch.rand(2, 3, 32, 32) * 2 - 1, torch.rand(2, 3, 32, 32) * 2 - 1
+    torch.manual_seed(1)
+    separate.dis_update(x_a, x_b, CONFIG)
+    separate.gen_update(x_a, x_b, CONFIG)
+    torch.manual_seed(1)
+    fused.fused_update(x_a, x_b, CONFIG, exact=True)
+    assert not all(torch.equal(p, q) for p, q in zip(fused.parameters(), make_trainer().parameters()))
+    for (name, expected), (_, param) in zip(separate.named_parameters(), fused.named_parameters()):
+        assert torch.allclose(param, expected, atol=1e-6), name
+    assert torch.allclose(fused.loss_gen_total, separate.loss_gen_total, atol=1e-6)
+    assert torch.allclose(fused.loss_dis_total, separate.loss_dis_total, atol=1e-6)
+
+def test_sample_chunks_match_one_batch():
+    munit = make_trainer()
+    x_a, x_b = torch.rand(3, 3, 32, 32) * 2 - 1, torch.rand(3, 3, 32, 32) * 2 - 1
+    with torch.no_grad():
+        torch.manual_seed(1)
+        expected = munit.sample(x_a, x_b)
+        # one image per chunk, and a last chunk smaller than the others
+        for chunk_size in [1, 2]:
+            torch.manual_seed(1)
+            chunked = munit.sample(x_a, x_b, chunk_size=chunk_size)
+            for output, reference in zip(chunked, expected):
+                assert output.shape == reference.shape == (3, 3, 32, 32)
+                assert torch.allclose(output, reference, atol=1e-5)
+    assert munit.training
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason='needs CUDA')
+def test_training_styles_are_drawn_from_the_cpu_rng():
+    # styles come from the CPU RNG on every device, so a seed gives the same trajectory as with .cuda() draws
+    munit = make_trainer().cuda()
+    x_a, x_b = torch.rand(2, 3, 32, 32, device='cuda') * 2 - 1, torch.rand(2, 3, 32, 32, device='cuda') * 2 - 1
+    torch.manual_seed(1)
+    cpu_state, cuda_state = torch.get_rng_state(), torch.cuda.get_rng_state()
+    munit.dis_update(x_a, x_b, CONFIG)
+    munit.gen_update(x_a, x_b, CONFIG)
+    munit.fused_update(x_a, x_b, CONFIG)
+    with torch.no_grad():
+        munit.sample(x_a, x_b)
+    assert torch.equal(torch.cuda.get_rng_state(), cuda_state)
+    assert not torch.equal(torch.get_rng_state(), cpu_state)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Ensure that the local version of the MUNIT modules is used
+import sys
+sys.path.insert(0, '..')
+sys.path.insert(0, '.')
+
+import importlib.util
+import os
+import numpy as np
+import torch
+import inference
+
+def import_munit_utils():
+    # the runway test helpers in tests/utils.py shadow the MUNIT utils.py, so load it under another name
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils.py')
+    spec = importlib.util.spec_from_file_location('munit_utils', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+munit_utils = import_munit_utils()
+
+# the scalar implementations the vectorized ones replaced
+def scalar_slerp(val, low, high):
+    omega = np.arccos(np.dot(low / np.linalg.norm(low), high / np.linalg.norm(high)))
+    so = np.sin(omega)
+    return np.sin((1.0 - val) * omega) / so * low + np.sin(val * omega) / so * high
+
+def scalar_slerp_interp(nb_latents, nb_interp, z_dim):
+    latent_interps = np.empty(shape=(0, z_dim), dtype=np.float32)
+    for _ in range(nb_latents):
+        low = np.random.randn(z_dim)
+        high = np.random.randn(z_dim)
+        interp_vals = np.linspace(0, 1, num=nb_interp)
+        latent_interp = np.array([scalar_slerp(v, low, high) for v in interp_vals], dtype=np.float32)
+        latent_interps = np.vstack((latent_interps, latent_interp))
+    return latent_interps[:, :, np.newaxis, np.newaxis]
+
+def scalar_slerp_interp2(nb_latents, nb_interp, z_dim):
+    low = np.random.randn(z_dim)
+    latent_interps = np.empty(shape=(0, z_dim), dtype=np.float32)
+    for _ in range(nb_latents):
+        high = np.random.randn(z_dim)
+        interp_vals = np.linspace(1./nb_interp, 1, num=nb_interp)
+        latent_interp = np.array([scalar_slerp(v, low, high) for v in interp_vals], dtype=np.float32)
+        latent_interps = np.vstack((latent_interps, latent_interp))
+        low = high
+    return latent_interps[:, :, np.newaxis, np.newaxis]
+
+def test_slerp_matches_scalar_implementation():
+    rng = np.random.RandomState(0)
+    low, high = rng.randn(5, 8), rng.randn(5, 8)
+    vals = np.linspace(0, 1, num=7)
+    grid = munit_utils.slerp(vals[:, np.newaxis], low, high)
+    assert grid.shape == (7, 5, 8)
+    # utils.slerp is a NumPy front end of the torch implementation served by runway_model.py
+    assert np.array_equal(inference.slerp(torch.from_numpy(vals[:, np.newaxis]), torch.from_numpy(low), torch.from_numpy(high)).numpy(), grid)
+    for i, val in enumerate(vals):
+        for j in range(5):
+            assert np.allclose(grid[i, j], scalar_slerp(val, low[j], high[j]))
+            assert np.allclose(munit_utils.slerp(val, low[j], high[j]), scalar_slerp(val, low[j], high[j]))
+
+def test_slerp_of_parallel_latents_is_linear():
+    low = np.array([1., 2., -1., 0.5])
+    # the scalar implementation divides by sin(0) here and returns nan
+    for high in [low, 3 * low]:
+        for val in [0, 0.25, 1]:
+            assert np.allclose(munit_utils.slerp(val, low, high), (1 - val) * low + val * high)
+    mixed = munit_utils.slerp(0.5, np.stack([low, low]), np.stack([2 * low, -low[::-1]]))
+    assert np.isfinite(mixed).all() and np.allclose(mixed[0], 1.5 * low)
+
+def test_get_slerp_interp_matches_scalar_implementation():
+    for nb_latents, nb_interp, z_dim in [(1, 5, 8), (3, 4, 16)]:
+        np.random.seed(0)
+        expected = scalar_slerp_interp(nb_latents, nb_interp, z_dim)
+        np.random.seed(0)
+        latents = munit_utils.get_slerp_interp(nb_latents, nb_interp, z_dim)
+        assert latents.shape == expected.shape == (nb_latents * nb_interp, z_dim, 1, 1)
+        assert latents.dtype == np.float32
+        assert np.allclose(latents, expected, atol=1e-6)
+
+def test_get_slerp_interp2_matches_scalar_implementation():
+    for nb_latents, nb_interp, z_dim in [(1, 5, 8), (4, 3, 512)]:
+        np.random.seed(0)
+        expected = scalar_slerp_interp2(nb_latents, nb_interp, z_dim)
+        np.random.seed(0)
+        latents = munit_utils.get_slerp_interp2(nb_latents, nb_interp, z_dim)
+        assert latents.shape == expected.shape == (nb_latents * nb_interp, z_dim, 1, 1)
+        assert np.allclose(latents, expected, atol=1e-6)
+    # the latent size defaults to the style dim of the shipped configs, it was fixed to 512 before
+    assert munit_utils.get_slerp_interp2(2, 3).shape == (6, 8, 1, 1)
@@ -10,6 +10,10 @@ import torch.nn as nn
 import os
 
 class MUNIT_Trainer(nn.Module):
+    # A training iteration is either dis_update followed by gen_update, the separate updates of the original
+    # MUNIT, or fused_update, which shares the encodes (and by default the translations) of both updates, see
+    # fused_update. amp: True in the config runs either with mixed precision on CUDA. python benchmark.py train
+    # compares the iterations/sec of the separate, fused and fused exact updates.
     def __init__(self, hyperparameters):
         super(MUNIT_Trainer, self).__init__()
         lr = hyperparameters['lr']
@@ -21,10 +25,10 @@ class MUNIT_Trainer(nn.Module):
         self.instancenorm = nn.InstanceNorm2d(512, affine=False)
         self.style_dim = hyperparameters['gen']['style_dim']
 
-        # fix the noise used in sampling
+        # fix the noise used in sampling, registered as buffers so they follow .to(device)
         display_size = int(hyperparameters['display_size'])
-        self.s_a = torch.randn(display_size, self.style_dim, 1, 1).cuda()
-        self.s_b = torch.randn(display_size, self.style_dim, 1, 1).cuda()
+        self.register_buffer('s_a', torch.randn(display_size, self.style_dim, 1, 1))
+        self.register_buffer('s_b', torch.randn(display_size, self.style_dim, 1, 1))
 
         # Setup the optimizers
         beta1 = hyperparameters['beta1']
@@ -38,6 +42,13 @@ class MUNIT_Trainer(nn.Module):
         self.dis_scheduler = get_scheduler(self.dis_opt, hyperparameters)
         self.gen_scheduler = get_scheduler(self.gen_opt, hyperparameters)
 
+        # Mixed precision (opt-in with amp: True, needs torch >= 2.3): the forward passes of both updates run
+        # under fp16 autocast, and each optimizer gets its own loss scaler, since the two losses have different
+        # magnitudes. Without amp, autocast and the scalers are disabled and leave losses and steps unchanged.
+        self.amp = hyperparameters.get('amp', False)
+        self.gen_scaler = torch.amp.GradScaler('cuda', enabled=self.amp)
+        self.dis_scaler = torch.amp.GradScaler('cuda', enabled=self.amp)
+
         # Network weight initialization
         self.apply(weights_init(hyperparameters['init']))
         self.dis_a.apply(weights_init('gaussian'))
@@ -51,14 +62,24 @@ class MUNIT_Trainer(nn.Module):
                 param.requires_grad = False
 
     def recon_criterion(self, input, target):
-        return torch.mean(torch.abs(input - target))
+        # computed in fp32, also for fp16 outputs of an autocast forward
+        return torch.mean(torch.abs(input.float() - target.float()))
+
+    def autocast(self):
+        return torch.autocast('cuda', enabled=self.amp)
+
+    def backward_step(self, loss, optimizer, scaler):
+        # backward pass and optimizer step through the loss scaler, a plain backward and step without amp
+        scaler.scale(loss).backward()
+        scaler.step(optimizer)
+        scaler.update()
 
     def forward(self, x_a, x_b):
         self.eval()
         s_a = Variable(self.s_a)
         s_b = Variable(self.s_b)
-        c_a, s_a_fake = self.gen_a.encode(x_a)
-        c_b, s_b_fake = self.gen_b.encode(x_b)
+        c_a = self.gen_a.encode_content(x_a)
+        c_b = self.gen_b.encode_content(x_b)
         x_ba = self.gen_a.decode(c_b, s_a)
         x_ab = self.gen_b.decode(c_a, s_b)
         self.train()
@@ -66,54 +87,65 @@ class MUNIT_Trainer(nn.Module):
 
     def gen_update(self, x_a, x_b, hyperparameters):
         self.gen_opt.zero_grad()
-        s_a = Variable(torch.randn(x_a.size(0), self.style_dim, 1, 1).cuda())
-        s_b = Variable(torch.randn(x_b.size(0), self.style_dim, 1, 1).cuda())
-        # encode
-        c_a, s_a_prime = self.gen_a.encode(x_a)
-        c_b, s_b_prime = self.gen_b.encode(x_b)
-        # decode (within domain)
-        x_a_recon = self.gen_a.decode(c_a, s_a_prime)
-        x_b_recon = self.gen_b.decode(c_b, s_b_prime)
-        # decode (cross domain)
-        x_ba = self.gen_a.decode(c_b, s_a)
-        x_ab = self.gen_b.decode(c_a, s_b)
-        # encode again
-        c_b_recon, s_a_recon = self.gen_a.encode(x_ba)
-        c_a_recon, s_b_recon = self.gen_b.encode(x_ab)
-        # decode again (if needed)
-        x_aba = self.gen_a.decode(c_a_recon, s_a_prime) if hyperparameters['recon_x_cyc_w'] > 0 else None
-        x_bab = self.gen_b.decode(c_b_recon, s_b_prime) if hyperparameters['recon_x_cyc_w'] > 0 else None
+        s_a = Variable(torch.randn(x_a.size(0), self.style_dim, 1, 1).to(x_a.device))
+        s_b = Variable(torch.randn(x_b.size(0), self.style_dim, 1, 1).to(x_b.device))
+        self.gen_step(x_a, x_b, s_a, s_b, self.encode_decode(x_a, x_b, s_a, s_b), hyperparameters)
 
-        # reconstruction loss
-        self.loss_gen_recon_x_a = self.recon_criterion(x_a_recon, x_a)
-        self.loss_gen_recon_x_b = self.recon_criterion(x_b_recon, x_b)
-        self.loss_gen_recon_s_a = self.recon_criterion(s_a_recon, s_a)
-        self.loss_gen_recon_s_b = self.recon_criterion(s_b_recon, s_b)
-        self.loss_gen_recon_c_a = self.recon_criterion(c_a_recon, c_a)
-        self.loss_gen_recon_c_b = self.recon_criterion(c_b_recon, c_b)
-        self.loss_gen_cycrecon_x_a = self.recon_criterion(x_aba, x_a) if hyperparameters['recon_x_cyc_w'] > 0 else 0
-        self.loss_gen_cycrecon_x_b = self.recon_criterion(x_bab, x_b) if hyperparameters['recon_x_cyc_w'] > 0 else 0
-        # GAN loss
-        self.loss_gen_adv_a = self.dis_a.calc_gen_loss(x_ba)
-        self.loss_gen_adv_b = self.dis_b.calc_gen_loss(x_ab)
-        # domain-invariant perceptual loss
-        self.loss_gen_vgg_a = self.compute_vgg_loss(self.vgg, x_ba, x_b) if hyperparameters['vgg_w'] > 0 else 0
-        self.loss_gen_vgg_b = self.compute_vgg_loss(self.vgg, x_ab, x_a) if hyperparameters['vgg_w'] > 0 else 0
-        # total loss
-        self.loss_gen_total = hyperparameters['gan_w'] * self.loss_gen_adv_a + \
-                              hyperparameters['gan_w'] * self.loss_gen_adv_b + \
-                              hyperparameters['recon_x_w'] * self.loss_gen_recon_x_a + \
-                              hyperparameters['recon_s_w'] * self.loss_gen_recon_s_a + \
-                              hyperparameters['recon_c_w'] * self.loss_gen_recon_c_a + \
-                              hyperparameters['recon_x_w'] * self.loss_gen_recon_x_b + \
-                              hyperparameters['recon_s_w'] * self.loss_gen_recon_s_b + \
-                              hyperparameters['recon_c_w'] * self.loss_gen_recon_c_b + \
-                              hyperparameters['recon_x_cyc_w'] * self.loss_gen_cycrecon_x_a + \
-                              hyperparameters['recon_x_cyc_w'] * self.loss_gen_cycrecon_x_b + \
-                              hyperparameters['vgg_w'] * self.loss_gen_vgg_a + \
-                              hyperparameters['vgg_w'] * self.loss_gen_vgg_b
-        self.loss_gen_total.backward()
-        self.gen_opt.step()
+    def encode_decode(self, x_a, x_b, s_a, s_b):
+        # the codes of x_a and x_b, their reconstructions and their cross-domain translations with the
+        # random styles s_a and s_b
+        with self.autocast():
+            # encode
+            c_a, s_a_prime = self.gen_a.encode(x_a)
+            c_b, s_b_prime = self.gen_b.encode(x_b)
+            # decode (within domain)
+            x_a_recon = self.gen_a.decode(c_a, s_a_prime)
+            x_b_recon = self.gen_b.decode(c_b, s_b_prime)
+            # decode (cross domain)
+            x_ba = self.gen_a.decode(c_b, s_a)
+            x_ab = self.gen_b.decode(c_a, s_b)
+        return c_a, c_b, s_a_prime, s_b_prime, x_a_recon, x_b_recon, x_ba, x_ab
+
+    def gen_step(self, x_a, x_b, s_a, s_b, outputs, hyperparameters):
+        # generator losses, backward and optimizer step on the outputs of encode_decode(x_a, x_b, s_a, s_b)
+        c_a, c_b, s_a_prime, s_b_prime, x_a_recon, x_b_recon, x_ba, x_ab = outputs
+        with self.autocast():
+            # encode again
+            c_b_recon, s_a_recon = self.gen_a.encode(x_ba)
+            c_a_recon, s_b_recon = self.gen_b.encode(x_ab)
+            # decode again (if needed)
+            x_aba = self.gen_a.decode(c_a_recon, s_a_prime) if hyperparameters['recon_x_cyc_w'] > 0 else None
+            x_bab = self.gen_b.decode(c_b_recon, s_b_prime) if hyperparameters['recon_x_cyc_w'] > 0 else None
+
+            # reconstruction loss
+            self.loss_gen_recon_x_a = self.recon_criterion(x_a_recon, x_a)
+            self.loss_gen_recon_x_b = self.recon_criterion(x_b_recon, x_b)
+            self.loss_gen_recon_s_a = self.recon_criterion(s_a_recon, s_a)
+            self.loss_gen_recon_s_b = self.recon_criterion(s_b_recon, s_b)
+            self.loss_gen_recon_c_a = self.recon_criterion(c_a_recon, c_a)
+            self.loss_gen_recon_c_b = self.recon_criterion(c_b_recon, c_b)
+            self.loss_gen_cycrecon_x_a = self.recon_criterion(x_aba, x_a) if hyperparameters['recon_x_cyc_w'] > 0 else 0
+            self.loss_gen_cycrecon_x_b = self.recon_criterion(x_bab, x_b) if hyperparameters['recon_x_cyc_w'] > 0 else 0
+            # GAN loss
+            self.loss_gen_adv_a = self.dis_a.calc_gen_loss(x_ba)
+            self.loss_gen_adv_b = self.dis_b.calc_gen_loss(x_ab)
+            # domain-invariant perceptual loss
+            self.loss_gen_vgg_a = self.compute_vgg_loss(self.vgg, x_ba, x_b) if hyperparameters['vgg_w'] > 0 else 0
+            self.loss_gen_vgg_b = self.compute_vgg_loss(self.vgg, x_ab, x_a) if hyperparameters['vgg_w'] > 0 else 0
+            # total loss
+            self.loss_gen_total = hyperparameters['gan_w'] * self.loss_gen_adv_a + \
+                                  hyperparameters['gan_w'] * self.loss_gen_adv_b + \
+                                  hyperparameters['recon_x_w'] * self.loss_gen_recon_x_a + \
+                                  hyperparameters['recon_s_w'] * self.loss_gen_recon_s_a + \
+                                  hyperparameters['recon_c_w'] * self.loss_gen_recon_c_a + \
+                                  hyperparameters['recon_x_w'] * self.loss_gen_recon_x_b + \
+                                  hyperparameters['recon_s_w'] * self.loss_gen_recon_s_b + \
+                                  hyperparameters['recon_c_w'] * self.loss_gen_recon_c_b + \
+                                  hyperparameters['recon_x_cyc_w'] * self.loss_gen_cycrecon_x_a + \
+                                  hyperparameters['recon_x_cyc_w'] * self.loss_gen_cycrecon_x_b + \
+                                  hyperparameters['vgg_w'] * self.loss_gen_vgg_a + \
+                                  hyperparameters['vgg_w'] * self.loss_gen_vgg_b
+        self.backward_step(self.loss_gen_total, self.gen_opt, self.gen_scaler)
 
     def compute_vgg_loss(self, vgg, img, target):
         img_vgg = vgg_preprocess(img)
@@ -122,22 +154,25 @@ class MUNIT_Trainer(nn.Module):
         target_fea = vgg(target_vgg)
         return torch.mean((self.instancenorm(img_fea) - self.instancenorm(target_fea)) ** 2)
 
-    def sample(self, x_a, x_b):
+    def sample(self, x_a, x_b, chunk_size=16):
+        # encode and decode the display images in batches of up to chunk_size, decode applies the style code
+        # of each image to its own sample
         self.eval()
         s_a1 = Variable(self.s_a)
         s_b1 = Variable(self.s_b)
-        s_a2 = Variable(torch.randn(x_a.size(0), self.style_dim, 1, 1).cuda())
-        s_b2 = Variable(torch.randn(x_b.size(0), self.style_dim, 1, 1).cuda())
+        s_a2 = Variable(torch.randn(x_a.size(0), self.style_dim, 1, 1).to(x_a.device))
+        s_b2 = Variable(torch.randn(x_b.size(0), self.style_dim, 1, 1).to(x_b.device))
         x_a_recon, x_b_recon, x_ba1, x_ba2, x_ab1, x_ab2 = [], [], [], [], [], []
-        for i in range(x_a.size(0)):
-            c_a, s_a_fake = self.gen_a.encode(x_a[i].unsqueeze(0))
-            c_b, s_b_fake = self.gen_b.encode(x_b[i].unsqueeze(0))
+        for i in range(0, x_a.size(0), chunk_size):
+            j = i + chunk_size
+            c_a, s_a_fake = self.gen_a.encode(x_a[i:j])
+            c_b, s_b_fake = self.gen_b.encode(x_b[i:j])
             x_a_recon.append(self.gen_a.decode(c_a, s_a_fake))
             x_b_recon.append(self.gen_b.decode(c_b, s_b_fake))
-            x_ba1.append(self.gen_a.decode(c_b, s_a1[i].unsqueeze(0)))
-            x_ba2.append(self.gen_a.decode(c_b, s_a2[i].unsqueeze(0)))
-            x_ab1.append(self.gen_b.decode(c_a, s_b1[i].unsqueeze(0)))
-            x_ab2.append(self.gen_b.decode(c_a, s_b2[i].unsqueeze(0)))
+            x_ba1.append(self.gen_a.decode(c_b, s_a1[i:j]))
+            x_ba2.append(self.gen_a.decode(c_b, s_a2[i:j]))
+            x_ab1.append(self.gen_b.decode(c_a, s_b1[i:j]))
+            x_ab2.append(self.gen_b.decode(c_a, s_b2[i:j]))
         x_a_recon, x_b_recon = torch.cat(x_a_recon), torch.cat(x_b_recon)
         x_ba1, x_ba2 = torch.cat(x_ba1), torch.cat(x_ba2)
         x_ab1, x_ab2 = torch.cat(x_ab1), torch.cat(x_ab2)
@@ -146,20 +181,50 @@ class MUNIT_Trainer(nn.Module):
 
     def dis_update(self, x_a, x_b, hyperparameters):
         self.dis_opt.zero_grad()
-        s_a = Variable(torch.randn(x_a.size(0), self.style_dim, 1, 1).cuda())
-        s_b = Variable(torch.randn(x_b.size(0), self.style_dim, 1, 1).cuda())
-        # encode
-        c_a, _ = self.gen_a.encode(x_a)
-        c_b, _ = self.gen_b.encode(x_b)
-        # decode (cross domain)
-        x_ba = self.gen_a.decode(c_b, s_a)
-        x_ab = self.gen_b.decode(c_a, s_b)
-        # D loss
-        self.loss_dis_a = self.dis_a.calc_dis_loss(x_ba.detach(), x_a)
-        self.loss_dis_b = self.dis_b.calc_dis_loss(x_ab.detach(), x_b)
-        self.loss_dis_total = hyperparameters['gan_w'] * self.loss_dis_a + hyperparameters['gan_w'] * self.loss_dis_b
-        self.loss_dis_total.backward()
-        self.dis_opt.step()
+        s_a = Variable(torch.randn(x_a.size(0), self.style_dim, 1, 1).to(x_a.device))
+        s_b = Variable(torch.randn(x_b.size(0), self.style_dim, 1, 1).to(x_b.device))
+        with self.autocast():
+            # encode (the style codes are not needed for the discriminator update)
+            c_a = self.gen_a.encode_content(x_a)
+            c_b = self.gen_b.encode_content(x_b)
+            # decode (cross domain)
+            x_ba = self.gen_a.decode(c_b, s_a)
+            x_ab = self.gen_b.decode(c_a, s_b)
+        self.dis_step(x_a, x_b, x_ba, x_ab, hyperparameters)
+
+    def dis_step(self, x_a, x_b, x_ba, x_ab, hyperparameters):
+        # discriminator losses, backward and optimizer step on the (detached) translations x_ba and x_ab
+        with self.autocast():
+            self.loss_dis_a = self.dis_a.calc_dis_loss(x_ba.detach(), x_a)
+            self.loss_dis_b = self.dis_b.calc_dis_loss(x_ab.detach(), x_b)
+            self.loss_dis_total = hyperparameters['gan_w'] * self.loss_dis_a + hyperparameters['gan_w'] * self.loss_dis_b
+        self.backward_step(self.loss_dis_total, self.dis_opt, self.dis_scaler)
+
+    def fused_update(self, x_a, x_b, hyperparameters, exact=False):
+        # One training iteration, in place of dis_update followed by gen_update, that encodes x_a and x_b once.
+        # By default the cross-domain translations are also computed once, with one style draw per iteration:
+        # the discriminator is trained on the detached x_ba / x_ab and the generator through the attached ones,
+        # after the discriminator step as in the separate updates. This saves the content encodes and the two
+        # cross-domain decodes of dis_update, but trains along another trajectory than the separate updates
+        # for a given seed.
+        # With exact=True the styles are drawn in the same order as by dis_update + gen_update and the
+        # discriminator gets its own translations (decoded without autograd), which reproduces the separate
+        # updates for a given seed; only the content encodes are saved.
+        self.dis_opt.zero_grad()
+        self.gen_opt.zero_grad()
+        if exact:
+            s_a_dis = Variable(torch.randn(x_a.size(0), self.style_dim, 1, 1).to(x_a.device))
+            s_b_dis = Variable(torch.randn(x_b.size(0), self.style_dim, 1, 1).to(x_b.device))
+        s_a = Variable(torch.randn(x_a.size(0), self.style_dim, 1, 1).to(x_a.device))
+        s_b = Variable(torch.randn(x_b.size(0), self.style_dim, 1, 1).to(x_b.device))
+        outputs = self.encode_decode(x_a, x_b, s_a, s_b)
+        c_a, c_b, x_ba, x_ab = outputs[0], outputs[1], outputs[6], outputs[7]
+        if exact:
+            with self.autocast(), torch.no_grad():
+                x_ba = self.gen_a.decode(c_b, s_a_dis)
+                x_ab = self.gen_b.decode(c_a, s_b_dis)
+        self.dis_step(x_a, x_b, x_ba, x_ab, hyperparameters)
+        self.gen_step(x_a, x_b, s_a, s_b, outputs, hyperparameters)
 
     def update_learning_rate(self):
         if self.dis_scheduler is not None:
@@ -183,6 +248,10 @@ class MUNIT_Trainer(nn.Module):
         state_dict = torch.load(os.path.join(checkpoint_dir, 'optimizer.pt'))
         self.dis_opt.load_state_dict(state_dict['dis'])
         self.gen_opt.load_state_dict(state_dict['gen'])
+        # Load loss scalers, empty in fp32 checkpoints and absent from older ones
+        if state_dict.get('gen_scaler'):
+            self.gen_scaler.load_state_dict(state_dict['gen_scaler'])
+            self.dis_scaler.load_state_dict(state_dict['dis_scaler'])
         # Reinitilize schedulers
         self.dis_scheduler = get_scheduler(self.dis_opt, hyperparameters, iterations)
         self.gen_scheduler = get_scheduler(self.gen_opt, hyperparameters, iterations)
@@ -196,7 +265,9 @@ class MUNIT_Trainer(nn.Module):
         opt_name = os.path.join(snapshot_dir, 'optimizer.pt')
         torch.save({'a': self.gen_a.state_dict(), 'b': self.gen_b.state_dict()}, gen_name)
         torch.save({'a': self.dis_a.state_dict(), 'b': self.dis_b.state_dict()}, dis_name)
-        torch.save({'gen': self.gen_opt.state_dict(), 'dis': self.dis_opt.state_dict()}, opt_name)
+        state_dict = {'gen': self.gen_opt.state_dict(), 'dis': self.dis_opt.state_dict(),
+                      'gen_scaler': self.gen_scaler.state_dict(), 'dis_scaler': self.dis_scaler.state_dict()}
+        torch.save(state_dict, opt_name)
 
 
 class UNIT_Trainer(nn.Module):
@@ -312,12 +383,13 @@ class UNIT_Trainer(nn.Module):
         target_fea = vgg(target_vgg)
         return torch.mean((self.instancenorm(img_fea) - self.instancenorm(target_fea)) ** 2)
 
-    def sample(self, x_a, x_b):
+    def sample(self, x_a, x_b, chunk_size=16):
+        # encode and decode the display images in batches of up to chunk_size
         self.eval()
         x_a_recon, x_b_recon, x_ba, x_ab = [], [], [], []
-        for i in range(x_a.size(0)):
-            h_a, _ = self.gen_a.encode(x_a[i].unsqueeze(0))
-            h_b, _ = self.gen_b.encode(x_b[i].unsqueeze(0))
+        for i in range(0, x_a.size(0), chunk_size):
+            h_a, _ = self.gen_a.encode(x_a[i:i + chunk_size])
+            h_b, _ = self.gen_b.encode(x_b[i:i + chunk_size])
             x_a_recon.append(self.gen_a.decode(h_a))
             x_b_recon.append(self.gen_b.decode(h_b))
             x_ba.append(self.gen_a.decode(h_b))
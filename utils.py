@@ -182,10 +182,18 @@ def slerp(val, low, high):
     original: Animating Rotation with Quaternion Curves, Ken Shoemake
     https://arxiv.org/abs/1609.04468
     Code: https://github.com/soumith/dcgan.torch/issues/14, Tom White
+
+    Vectorized: low and high are [..., z_dim] arrays and val a scalar or an array that broadcasts against
+    their leading dimensions, e.g. val[:, None] with low and high of shape [nb_latents, z_dim] gives a
+    [nb_interp, nb_latents, z_dim] grid. Parallel low and high are interpolated linearly. A NumPy front end
+    of inference.slerp.
     """
-    omega = np.arccos(np.dot(low / np.linalg.norm(low), high / np.linalg.norm(high)))
-    so = np.sin(omega)
-    return np.sin((1.0 - val) * omega) / so * low + np.sin(val * omega) / so * high
+    low, high = np.array(low), np.array(high)
+    val = np.array(val, dtype=low.dtype)
+    # computed by the torch implementation served by runway_model.py, imported here so that training does not
+    # load the inference module
+    from inference import slerp as torch_slerp
+    return torch_slerp(torch.from_numpy(val), torch.from_numpy(low), torch.from_numpy(high)).numpy()
 
 
 def get_slerp_interp(nb_latents, nb_interp, z_dim):
@@ -194,30 +202,20 @@ def get_slerp_interp(nb_latents, nb_interp, z_dim):
     https://github.com/ptrblck/prog_gans_pytorch_inference
     """
 
-    latent_interps = np.empty(shape=(0, z_dim), dtype=np.float32)
-    for _ in range(nb_latents):
-        low = np.random.randn(z_dim)
-        high = np.random.randn(z_dim)  # low + np.random.randn(512) * 0.7
-        interp_vals = np.linspace(0, 1, num=nb_interp)
-        latent_interp = np.array([slerp(v, low, high) for v in interp_vals],
-                                 dtype=np.float32)
-        latent_interps = np.vstack((latent_interps, latent_interp))
+    # a (low, high) pair per latent, drawn in the same order as one pair at a time
+    latents = np.random.randn(nb_latents, 2, z_dim)
+    interp_vals = np.linspace(0, 1, num=nb_interp)
+    latent_interps = slerp(interp_vals[:, np.newaxis], latents[:, 0], latents[:, 1]).astype(np.float32)
+    latent_interps = latent_interps.transpose(1, 0, 2).reshape(-1, z_dim)
 
     return latent_interps[:, :, np.newaxis, np.newaxis]
 
-def get_slerp_interp2(nb_latents, nb_interp):
-    low = np.random.randn(512)
-    
-    latent_interps = np.empty(shape=(0, 512), dtype=np.float32)
-    for _ in range(nb_latents):
-        high = np.random.randn(512)#low + np.random.randn(512) * 0.7
-        
-        interp_vals = np.linspace(1./nb_interp, 1, num=nb_interp)
-        latent_interp = np.array([slerp(v, low, high) for v in interp_vals],
-                                  dtype=np.float32)
-        
-        latent_interps = np.vstack((latent_interps, latent_interp))
-        low = high
+def get_slerp_interp2(nb_latents, nb_interp, z_dim=8):
+    # a path through nb_latents + 1 random latents, each segment ending on its latent
+    latents = np.random.randn(nb_latents + 1, z_dim)
+    interp_vals = np.linspace(1./nb_interp, 1, num=nb_interp)
+    latent_interps = slerp(interp_vals[:, np.newaxis], latents[:-1], latents[1:]).astype(np.float32)
+    latent_interps = latent_interps.transpose(1, 0, 2).reshape(-1, z_dim)
 
     return latent_interps[:, :, np.newaxis, np.newaxis]
 